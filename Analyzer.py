@@ -1,10 +1,11 @@
 import os
 import re
 
+from ResultsIndex import parse_grade
+
 
 def extract_verdicts_to_table(directory_path, output_file="results.txt"):
     results = []
-    pattern = re.compile(r"VERDICT:\s*(\d+\.?\d*)")
 
     # Get the absolute folder name to avoid confusion
     folder_name = os.path.basename(os.path.normpath(directory_path))
@@ -15,9 +16,10 @@ def extract_verdicts_to_table(directory_path, output_file="results.txt"):
             try:
                 with open(file_path, 'r', encoding="utf-8") as f:
                     content = f.read()
-                    match = pattern.search(content)
-                    if match:
-                        results.append((filename, match.group(1)))
+                    # structured (JSON) grades and VERDICT lines alike
+                    verdict = parse_grade(content)["verdict"]
+                    if verdict is not None:
+                        results.append((filename, f"{verdict:g}"))
             except Exception as e:
                 print(f"Skipping {filename}: {e}")
 
@@ -101,12 +103,190 @@ def group_results_by_subject(input_file, output_file="grouped_results.txt"):
         print(f"Error: Could not find {input_file}")
 
 
+GRADING_DIRECTORIES = [os.path.join("Responses", name) for name in
+                       ("Grading projection", "Grading from projection", "Grading default", "Grading from files")]
+
+
+def index_grading_directories(directories=None, index_path=None):
+    # Incremental replacement for extract_verdicts_to_table: unchanged files are not re-read
+    # and re-running never appends duplicate rows
+    from ResultsIndex import ResultsIndex, DEFAULT_INDEX_PATH
+
+    index = ResultsIndex(index_path or DEFAULT_INDEX_PATH)
+    for directory in directories or GRADING_DIRECTORIES:
+        if os.path.isdir(directory):
+            index.ingest(directory)
+        else:
+            print(f"Skipping missing directory '{directory}'")
+    return index
+
+
+def report_grouped(index, by=("subject", "variant"), output_file=None, **filters):
+    rows = index.grouped(by, **filters)
+    if not rows:
+        print("No indexed verdicts match. Run index_grading_directories first.")
+        return rows
+
+    widths = {column: 26 if column in ("model", "directory") else 18 for column in by}
+    header = " | ".join(f"{column.upper():<{widths[column]}}" for column in by) + \
+        f" | {'N':>4} | {'MEAN':>6} | {'MIN':>5} | {'MAX':>5} | {'NO VERDICT':>10}"
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        mean = f"{row['mean']:>6.2f}" if row["mean"] is not None else f"{'-':>6}"
+        low = f"{row['min']:>5g}" if row["min"] is not None else f"{'-':>5}"
+        high = f"{row['max']:>5g}" if row["max"] is not None else f"{'-':>5}"
+        lines.append(" | ".join(f"{str(row[column]):<{widths[column]}}" for column in by) +
+                     f" | {row['n']:>4} | {mean} | {low} | {high} | {row['unparsed']:>10}")
+
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8') as out_f:
+            out_f.write("\n".join(lines) + "\n")
+        print(f"Wrote {len(rows)} groups to '{output_file}'")
+    else:
+        print("\n".join(lines))
+    return rows
+
+
+PAIRED_COLUMNS = ("provider", "model", "subject", "problem_id", "web_enabled", "search")
+COMPARED_VARIANTS = ("projection", "reprojection_keep", "reprojection_clean")
+BREAKDOWNS = ((), ("subject",), ("model",), ("web_enabled",), ("search",))
+
+
+def _bootstrap_group_means(diffs, group_ids, n_resamples, rng, chunk_elements=4_000_000):
+    # Bootstrap means for every group in one array operation. Verdicts only take a handful of
+    # values, and resampling n pairs with replacement is the same as drawing multinomial counts
+    # over the distinct differences, so a resample costs O(distinct values) instead of O(n).
+    import numpy as np
+
+    counts = np.bincount(group_ids)
+    values, value_ids = np.unique(diffs, return_inverse=True)
+    if len(values) <= 64:
+        frequencies = np.zeros((len(counts), len(values)))
+        np.add.at(frequencies, (group_ids, value_ids), 1)
+        draws = rng.multinomial(counts, frequencies / counts[:, None], size=(n_resamples, len(counts)))
+        return draws @ values / counts
+
+    # Continuous scores: draw indices instead. Pairs are sorted by group, each position draws
+    # inside its own group's slice and np.add.reduceat sums the slices; rows are chunked so a
+    # resample matrix never exceeds chunk_elements values.
+    order = np.argsort(group_ids, kind="stable")
+    diffs = diffs[order]
+    group_ids = group_ids[order]
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    position_offset = offsets[group_ids]
+    position_count = counts[group_ids]
+
+    means = np.empty((n_resamples, len(counts)))
+    rows = max(1, chunk_elements // len(diffs))
+    for start in range(0, n_resamples, rows):
+        block = min(rows, n_resamples - start)
+        draws = (rng.random((block, len(diffs))) * position_count).astype(np.int64) + position_offset
+        means[start:start + block] = np.add.reduceat(diffs[draws], offsets, axis=1) / counts
+    return means
+
+
+def paired_bootstrap(index, variant, baseline="default", by=(), n_resamples=5000, confidence=0.95, seed=0,
+                     pairs=None):
+    # Mean (variant - baseline) grade difference over problems graded under both, per group,
+    # with a percentile bootstrap confidence interval. Pass pairs (from index.paired) to reuse
+    # one query across several breakdowns.
+    import numpy as np
+
+    unknown = [column for column in by if column not in PAIRED_COLUMNS]
+    if unknown:
+        raise ValueError(f"Cannot break down by {unknown}, expected columns from {PAIRED_COLUMNS}")
+    if pairs is None:
+        pairs = index.paired(variant, baseline)
+    if not pairs:
+        return []
+
+    positions = [PAIRED_COLUMNS.index(column) for column in by]
+    keys = [tuple(row[i] for i in positions) for row in pairs]
+    group_keys = sorted(set(keys), key=lambda key: tuple(str(part) for part in key))
+    key_ids = {key: i for i, key in enumerate(group_keys)}
+    group_ids = np.fromiter((key_ids[key] for key in keys), dtype=np.int64, count=len(keys))
+    # index.paired rows: the PAIRED_COLUMNS, then the variant and baseline verdicts
+    scores = np.array([row[len(PAIRED_COLUMNS):] for row in pairs], dtype=float)
+    diffs = scores[:, 0] - scores[:, 1]
+
+    counts = np.bincount(group_ids, minlength=len(group_keys))
+    observed = np.bincount(group_ids, weights=diffs, minlength=len(group_keys)) / counts
+    mean_variant = np.bincount(group_ids, weights=scores[:, 0], minlength=len(group_keys)) / counts
+    mean_baseline = np.bincount(group_ids, weights=scores[:, 1], minlength=len(group_keys)) / counts
+    wins = np.bincount(group_ids, weights=diffs > 0, minlength=len(group_keys))
+    losses = np.bincount(group_ids, weights=diffs < 0, minlength=len(group_keys))
+
+    means = _bootstrap_group_means(diffs, group_ids, n_resamples, np.random.default_rng(seed))
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha], axis=0)
+    # share of resamples where the variant does not beat the baseline
+    not_better = (means <= 0).mean(axis=0)
+
+    results = []
+    for i, key in enumerate(group_keys):
+        result = dict(zip(by, key))
+        result.update({
+            "variant": variant,
+            "baseline": baseline,
+            "n": int(counts[i]),
+            "mean_variant": float(mean_variant[i]),
+            "mean_baseline": float(mean_baseline[i]),
+            "mean_diff": float(observed[i]),
+            "ci_low": float(low[i]),
+            "ci_high": float(high[i]),
+            "p_not_better": float(not_better[i]),
+            "wins": int(wins[i]),
+            "ties": int(counts[i] - wins[i] - losses[i]),
+            "losses": int(losses[i]),
+        })
+        results.append(result)
+    return results
+
+
+def report_paired(index, variants=COMPARED_VARIANTS, baseline="default", breakdowns=BREAKDOWNS,
+                  n_resamples=5000, confidence=0.95, seed=0, output_file=None):
+    lines = []
+    all_results = []
+    pairs = {variant: index.paired(variant, baseline) for variant in variants}
+    for by in breakdowns:
+        title = ", ".join(by) if by else "overall"
+        lines.append(f"\n======= {title.upper()}: VARIANT - {baseline.upper()} =======")
+        header = (f"{'VARIANT':<20} | {'GROUP':<30} | {'N':>5} | {'VARIANT':>7} | {'BASE':>6} | {'DIFF':>7} | "
+                  f"{f'{confidence:.0%} CI':<17} | {'P(<=0)':>6} | W/T/L")
+        lines.extend([header, "-" * len(header)])
+        for variant in variants:
+            results = paired_bootstrap(index, variant, baseline, by, n_resamples, confidence, seed,
+                                       pairs=pairs[variant])
+            if not results:
+                lines.append(f"{variant:<20} | no problems graded under both '{variant}' and '{baseline}'")
+            for r in results:
+                group = "/".join(str(r[column]) for column in by) or "all"
+                ci = f"[{r['ci_low']:+.3f}, {r['ci_high']:+.3f}]"
+                lines.append(f"{variant:<20} | {group:<30} | {r['n']:>5} | {r['mean_variant']:>7.3f} | "
+                             f"{r['mean_baseline']:>6.3f} | {r['mean_diff']:>+7.3f} | {ci:<17} | "
+                             f"{r['p_not_better']:>6.3f} | {r['wins']}/{r['ties']}/{r['losses']}")
+            all_results.extend(results)
+
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8') as out_f:
+            out_f.write("\n".join(lines) + "\n")
+        print(f"Wrote paired comparison to '{output_file}'")
+    else:
+        print("\n".join(lines))
+    return all_results
+
+
 # Usage Example:
 # extract_verdicts_to_table("./experiment_alpha")
 # extract_verdicts_to_table("./experiment_beta")
 # group_results_with_metadata("results.txt")
+#
+# index = index_grading_directories()
+# report_grouped(index, by=("model", "web_enabled", "variant"))
+# report_paired(index)
 
 
-# extract_verdicts_to_table(os.path.join("Responses", "Grading from projection"))
-# extract_verdicts_to_table(os.path.join("Responses", "Grading default"))
-group_results_by_subject("results.txt")
\ No newline at end of file
+if __name__ == "__main__":
+    # extract_verdicts_to_table(os.path.join("Responses", "Grading from projection"))
+    # extract_verdicts_to_table(os.path.join("Responses", "Grading default"))
+    group_results_by_subject("results.txt")
@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+from ChatSession import ChatSession
+from main import async_full_pipeline
+
+
+async def run_problems(problems, options, id_start=0, max_concurrency=None, max_pipelines=None, **pipeline_args):
+    # max_concurrency: {"openai": n, "anthropic": m} -> in-flight API calls per provider
+    # max_pipelines: how many (problem, option) pipelines may be active at once (None = all)
+    if max_concurrency:
+        ChatSession.MAX_CONCURRENCY.update(max_concurrency)
+    pipeline_slots = asyncio.Semaphore(max_pipelines) if max_pipelines else None
+
+    async def run_one(problem_d, id_count, provider, model_name, web_enabled):
+        args = dict(pipeline_args)
+        args.update(provider=provider, model_name=model_name, web_enabled=web_enabled)
+        label = f"{provider}_{model_name}_{problem_d['subject']}_{id_count}_web_{web_enabled}"
+        if pipeline_slots:
+            await pipeline_slots.acquire()
+        try:
+            print(f"Starting with {label}")
+            start = time.perf_counter()
+            await async_full_pipeline(problem_d, id_count, **args)
+            print(f"Finished with {label} in {time.perf_counter() - start:.1f}s")
+        finally:
+            if pipeline_slots:
+                pipeline_slots.release()
+
+    tasks = []
+    labels = []
+    for i, problem_d in enumerate(problems):
+        for provider, model_name, web_enabled in options:
+            tasks.append(run_one(problem_d, i + id_start, provider, model_name, web_enabled))
+            labels.append((i + id_start, provider, model_name, web_enabled))
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    failures = [(label, result) for label, result in zip(labels, results) if isinstance(result, BaseException)]
+    for label, error in failures:
+        print(f"Pipeline {label} failed: {error!r}")
+    print(f"Sweep done: {len(tasks) - len(failures)}/{len(tasks)} pipelines succeeded")
+    return results
+
+
+def run_sweep(problems, options, id_start=0, max_concurrency=None, max_pipelines=None, **pipeline_args):
+    # the registry closes the async SDK clients of the loop before asyncio.run ends it
+    return ChatSession.client_registry.run(run_problems(problems, options, id_start=id_start,
+                                                        max_concurrency=max_concurrency, max_pipelines=max_pipelines,
+                                                        **pipeline_args))
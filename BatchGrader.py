@@ -0,0 +1,221 @@
+import json
+import os
+import shutil
+import time
+import types
+import uuid
+
+from ChatSession import ChatSession
+
+BATCH_DIR = "Batches"
+# Batch jobs are billed at half the synchronous price
+BATCH_DISCOUNT = 0.5
+
+
+class OpenAIBatchBackend:
+    def __init__(self, client=None, api_key=None):
+        if client is None:
+            from ClientRegistry import shared_registry
+            client = shared_registry.get_client("openai", api_key or os.environ.get("OPENAI_API_KEY"))
+        self.client = client
+
+    def submit(self, batch_file):
+        with open(batch_file, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/responses",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines.extend(self.client.files.content(file_id).text.splitlines())
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+class LocalBatchBackend:
+    # File-based stand-in for the batch endpoint, so batch grading can run offline.
+    # responder(body) -> text; the default returns a fixed grade.
+    def __init__(self, root=os.path.join(BATCH_DIR, "local"), responder=None):
+        self.root = root
+        self.responder = responder or (lambda body: "Offline batch grading stand-in.\nVERDICT: 0")
+
+    def submit(self, batch_file):
+        batch_id = f"local_batch_{uuid.uuid4().hex[:12]}"
+        batch_dir = os.path.join(self.root, batch_id)
+        os.makedirs(batch_dir, exist_ok=True)
+        shutil.copy(batch_file, os.path.join(batch_dir, "input.jsonl"))
+        return batch_id
+
+    def status(self, batch_id):
+        batch_dir = os.path.join(self.root, batch_id)
+        output_path = os.path.join(batch_dir, "output.jsonl")
+        if not os.path.exists(output_path):
+            self._process(batch_dir, output_path)
+        return "completed"
+
+    def _process(self, batch_dir, output_path):
+        with open(os.path.join(batch_dir, "input.jsonl"), encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        with open(output_path, "w", encoding="utf-8") as out:
+            for request in requests:
+                text = self.responder(request["body"])
+                prompt = request["body"]["input"][-1]["content"]
+                body = {
+                    "output": [{"type": "message", "content": [{"type": "output_text", "text": text}]}],
+                    "usage": {"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4},
+                }
+                out.write(json.dumps({
+                    "id": f"req_{request['custom_id']}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": body},
+                    "error": None,
+                }) + "\n")
+
+    def results(self, batch_id):
+        with open(os.path.join(self.root, batch_id, "output.jsonl"), encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+class BatchGrader:
+    # Collects grading prompts into one batch job, submits it, polls until it finishes and
+    # writes every grade to the same Responses/ and FullChats/ paths as synchronous grading.
+    # Used by grade_answers_from_directory(batch=True); full_pipeline waits on each grade, so
+    # its grading stages always call the provider directly.
+    def __init__(self, backend=None, model_name="gpt-5", name=None, batch_dir=BATCH_DIR, response_schema=None):
+        self.backend = backend if backend is not None else OpenAIBatchBackend()
+        self.model_name = model_name
+        self.name = name or time.strftime("grading_%Y%m%d_%H%M%S")
+        self.batch_dir = batch_dir
+        # same JSON-schema output as ChatSession(response_schema=...)
+        self.response_schema = response_schema
+        self.jobs = {}
+        self.batch_id = None
+
+    @property
+    def state_path(self):
+        return os.path.join(self.batch_dir, f"{self.name}.json")
+
+    def add(self, prompt, response_save_path, history_path):
+        custom_id = f"grade-{len(self.jobs)}"
+        self.jobs[custom_id] = {"prompt": prompt, "save_path": response_save_path, "history_path": history_path}
+        return custom_id
+
+    def write_batch_file(self):
+        os.makedirs(self.batch_dir, exist_ok=True)
+        batch_file = os.path.join(self.batch_dir, f"{self.name}.jsonl")
+        with open(batch_file, "w", encoding="utf-8") as f:
+            for custom_id, job in self.jobs.items():
+                body = {
+                    "model": self.model_name,
+                    "reasoning": {"effort": "high"},
+                    "input": [{"role": "user", "content": job["prompt"]}],
+                }
+                if self.response_schema is not None:
+                    body["text"] = {"format": dict(self.response_schema, type="json_schema"), "verbosity": "low"}
+                f.write(json.dumps({
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/responses",
+                    "body": body,
+                }, ensure_ascii=False) + "\n")
+        return batch_file
+
+    def submit(self):
+        if not self.jobs:
+            print("No grading jobs to submit")
+            return None
+        batch_file = self.write_batch_file()
+        self.batch_id = self.backend.submit(batch_file)
+        self._save_state()
+        print(f"Submitted {len(self.jobs)} grading requests as batch {self.batch_id}")
+        return self.batch_id
+
+    def wait(self, poll_interval=30, timeout=None):
+        start = time.time()
+        while True:
+            status = self.backend.status(self.batch_id)
+            if status in ("completed", "failed", "expired", "cancelled"):
+                return status
+            if timeout is not None and time.time() - start > timeout:
+                return status
+            print(f"Batch {self.batch_id}: {status}, checking again in {poll_interval}s")
+            time.sleep(poll_interval)
+
+    def collect(self):
+        from main import write_history
+        grades = {}
+        total_cost = 0.0
+        for result in self.backend.results(self.batch_id):
+            job = self.jobs.get(result["custom_id"])
+            if job is None:
+                continue
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                print(f"Grading request {result['custom_id']} failed: {result.get('error') or response}")
+                continue
+            body = response["body"]
+            grade = _output_text(body)
+            usage = self._usage(body.get("usage") or {})
+            ChatSession.ledger.record(run_id=self.name, stage="batch_grading", provider="openai",
+                                      model=self.model_name, **usage)
+            total_cost += usage["cost"]
+            with open(job["save_path"], "w", encoding="utf-8") as f:
+                f.write(grade)
+            write_history(job["history_path"], [[
+                {"role": "user", "content": job["prompt"]},
+                {"role": "assistant", "content": grade},
+            ]])
+            grades[job["save_path"]] = grade
+        print(f"--- [Batch {self.batch_id}: {len(grades)}/{len(self.jobs)} graded | Cost: ${total_cost:.4f}] ---")
+        return grades
+
+    def run(self, poll_interval=30, timeout=None):
+        if self.submit() is None:
+            return {}
+        status = self.wait(poll_interval, timeout)
+        if status != "completed":
+            print(f"Batch {self.batch_id} ended with status {status}; resume later with BatchGrader.load")
+            return {}
+        return self.collect()
+
+    def _usage(self, usage):
+        details = {key: types.SimpleNamespace(**value) if isinstance(value, dict) else value
+                   for key, value in usage.items()}
+        usage = ChatSession.cost_breakdown(self.model_name, types.SimpleNamespace(**details))
+        usage["cost"] *= BATCH_DISCOUNT
+        return usage
+
+    def _save_state(self):
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump({"name": self.name, "model_name": self.model_name, "batch_id": self.batch_id,
+                       "response_schema": self.response_schema, "jobs": self.jobs}, f, indent=2, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, name, backend=None, batch_dir=BATCH_DIR):
+        # Pick up a submitted batch after a restart, e.g. to collect results the next day
+        with open(os.path.join(batch_dir, f"{name}.json"), encoding="utf-8") as f:
+            state = json.load(f)
+        grader = cls(backend=backend, model_name=state["model_name"], name=state["name"], batch_dir=batch_dir,
+                     response_schema=state.get("response_schema"))
+        grader.jobs = state["jobs"]
+        grader.batch_id = state["batch_id"]
+        return grader
+
+
+def _output_text(body):
+    if "output_text" in body:
+        return body["output_text"]
+    parts = []
+    for item in body.get("output", []):
+        if item.get("type") == "message":
+            parts.extend(c.get("text", "") for c in item.get("content", []) if c.get("type") == "output_text")
+    return "".join(parts)
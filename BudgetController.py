@@ -0,0 +1,264 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+# Output tokens assumed for a (stage, model) the ledger has no calls for yet, by reasoning effort
+DEFAULT_OUTPUT_TOKENS = {"xhigh": 16000, "high": 8000, "medium": 4000, "low": 1500}
+# Stages that start a new problem: they must leave reserve_fraction of every cap to the stages
+# of problems already started (the stages in between leave half of it to grading)
+START_STAGES = ("project", "default_answer")
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def stage_priority(stage):
+    # 0: grading (completes an evaluation), 1: continues a started problem, 2: starts a new one
+    stage = stage or ""
+    if stage.startswith("grade"):
+        return 0
+    if stage in START_STAGES:
+        return 2
+    return 1
+
+
+def _day_start(now=None):
+    local = time.localtime(now)
+    return time.mktime((local.tm_year, local.tm_mon, local.tm_mday, 0, 0, 0, 0, 0, -1))
+
+
+class BudgetController:
+    # Admission control for provider calls. Before a call, ChatSession asks for a ticket with
+    # the call's estimated cost: pre-flight input tokens at the historical cached share, the
+    # historical mean output (reasoning included) and search count for its stage and model,
+    # times safety_margin. The estimate is reserved until the call settles with its real cost.
+    #   admit   it fits under the per-run and per-day caps with everything in flight
+    #   defer   it would fit once in-flight calls settle, or a more urgent stage is waiting
+    #   reject  it does not fit even with nothing in flight: BudgetExceeded
+    # The per-run cap covers this process; the per-day cap counts every call in the ledger
+    # since local midnight, so processes sharing a ledger share the daily budget.
+    def __init__(self, run_cap=None, day_cap=None, reserve_fraction=0.1, safety_margin=1.2, ledger=None,
+                 poll_interval=0.5, max_wait=None):
+        if ledger is None:
+            from Telemetry import ledger
+        self.run_cap = run_cap
+        self.day_cap = day_cap
+        self.reserve_fraction = reserve_fraction
+        self.safety_margin = safety_margin
+        self.ledger = ledger
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        # (stage, model) / model -> [calls, input_tokens, cached_tokens, output_tokens, search_calls]
+        self.history = defaultdict(lambda: [0, 0, 0, 0, 0])
+        self.ledger_offset = 0
+        self.ledger_day = None
+        self.ledger_day_cost = 0.0
+        self.run_spent = 0.0
+        self.day_spent_local = 0.0
+        self.reserved = 0.0
+        self.in_flight = {}
+        self.waiting = {}
+        self.next_id = 0
+        self.counts = {"admitted": 0, "deferred": 0, "rejected": 0}
+        self.estimated_total = 0.0
+        self.actual_total = 0.0
+
+    # ---- history ----
+
+    def _observe(self, stage, model, usage):
+        for key in ((stage or "-", model), model):
+            stats = self.history[key]
+            stats[0] += 1
+            stats[1] += usage.get("input_tokens") or 0
+            stats[2] += usage.get("cached_tokens") or 0
+            stats[3] += usage.get("output_tokens") or 0
+            stats[4] += usage.get("search_calls") or 0
+
+    def _refresh(self):
+        # Reads ledger lines appended since the last call (by any process); caller holds the lock
+        today = _day_start()
+        if self.ledger_day != today:
+            self.ledger_day = today
+            self.ledger_day_cost = 0.0
+            self.day_spent_local = 0.0
+            self.ledger_offset = 0
+            self.history.clear()
+        path = self.ledger.path
+        if not self.ledger.enabled or not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            f.seek(self.ledger_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        self.ledger_offset += end
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("cache_hit") or entry.get("cost") is None:
+                continue
+            if (entry.get("timestamp") or 0) >= today:
+                self.ledger_day_cost += entry["cost"] + (entry.get("hedge_cost") or 0.0)
+            self._observe(entry.get("stage"), entry.get("model"), entry)
+
+    def _day_spent(self):
+        # the ledger already holds this process's settled calls; without it only they are known
+        return self.ledger_day_cost if self.ledger.enabled else self.day_spent_local
+
+    # ---- estimates ----
+
+    def estimate(self, pricing, model, stage, input_tokens, effort="high", web_enabled=False, force_search=False):
+        with self.lock:
+            self._refresh()
+            stats = self.history.get((stage or "-", model)) or self.history.get(model)
+        price = pricing.get(model, {"input": 0, "output": 0, "search": 0})
+        if stats and stats[0]:
+            calls, history_input, history_cached, history_output, history_searches = stats
+            cached_share = history_cached / history_input if history_input else 0.0
+            output_tokens = history_output / calls
+            searches = history_searches / calls
+        else:
+            cached_share = 0.0
+            output_tokens = DEFAULT_OUTPUT_TOKENS.get(effort, DEFAULT_OUTPUT_TOKENS["high"])
+            searches = 1.0
+        if not web_enabled:
+            searches = 0.0
+        elif force_search:
+            searches = max(searches, 1.0)
+        cost = input_tokens * (1 - cached_share) * price["input"] / 1e6
+        cost += input_tokens * cached_share * price.get("cached_input", price["input"]) / 1e6
+        cost += output_tokens * price["output"] / 1e6
+        cost += searches * price.get("search", 0)
+        return cost * self.safety_margin
+
+    # ---- admission ----
+
+    def _limits(self, priority):
+        # (name, cap, spent) per configured cap, less the reserve kept for more urgent stages
+        share = 1.0 - self.reserve_fraction * priority / 2
+        limits = []
+        if self.run_cap is not None:
+            limits.append(("run", self.run_cap * share, self.run_spent))
+        if self.day_cap is not None:
+            limits.append(("day", self.day_cap * share, self._day_spent()))
+        return limits
+
+    def _decide(self, ticket):
+        # caller holds the lock -> "admit", "defer" or "reject"
+        self._refresh()
+        cost = ticket["estimate"]
+        decision = "admit"
+        for name, limit, spent in self._limits(ticket["priority"]):
+            if spent + cost > limit:
+                ticket["reason"] = f"{name} cap: ${spent:.4f} spent + ~${cost:.4f} > ${limit:.4f}"
+                return "reject"
+            if spent + self.reserved + cost > limit:
+                ticket["reason"] = f"{name} cap: ${self.reserved:.4f} reserved by calls in flight"
+                decision = "defer"
+        if decision == "admit":
+            urgent = [t for t in self.waiting.values() if t["priority"] < ticket["priority"]]
+            if urgent:
+                ticket["reason"] = f"{len(urgent)} more urgent calls waiting"
+                decision = "defer"
+        return decision
+
+    def _new_ticket(self, request):
+        estimate = self.estimate(**request["estimate"])
+        with self.lock:
+            self.next_id += 1
+            return {"id": self.next_id, "estimate": estimate, "stage": request["stage"],
+                    "model": request["estimate"]["model"], "run_id": request.get("run_id"),
+                    "priority": stage_priority(request["stage"]), "created": time.time(), "deferred": False}
+
+    def _apply(self, ticket, decision):
+        # caller holds the lock; True when the ticket is settled one way or the other
+        if decision == "admit":
+            self.waiting.pop(ticket["id"], None)
+            self.in_flight[ticket["id"]] = ticket
+            self.reserved += ticket["estimate"]
+            self.estimated_total += ticket["estimate"]
+            self.counts["admitted"] += 1
+            return True
+        waited = time.time() - ticket["created"]
+        if decision == "reject" or (self.max_wait is not None and waited > self.max_wait):
+            self.waiting.pop(ticket["id"], None)
+            self.counts["rejected"] += 1
+            raise BudgetExceeded(f"{ticket['stage'] or 'call'} (~${ticket['estimate']:.4f}) rejected: "
+                                 f"{ticket.get('reason', f'waited {waited:.0f}s')}")
+        if not ticket["deferred"]:
+            ticket["deferred"] = True
+            self.counts["deferred"] += 1
+            print(f"--- [Budget: deferring {ticket['stage'] or 'call'} (~${ticket['estimate']:.4f}), "
+                  f"{ticket['reason']}] ---")
+        self.waiting[ticket["id"]] = ticket
+        return False
+
+    def admit(self, request):
+        ticket = self._new_ticket(request)
+        with self.condition:
+            while not self._apply(ticket, self._decide(ticket)):
+                self.condition.wait(self.poll_interval)
+        return ticket
+
+    async def async_admit(self, request):
+        import asyncio
+        ticket = self._new_ticket(request)
+        try:
+            while True:
+                with self.lock:
+                    if self._apply(ticket, self._decide(ticket)):
+                        return ticket
+                await asyncio.sleep(self.poll_interval)
+        except asyncio.CancelledError:
+            # e.g. the losing attempt of a hedged call: a ticket left waiting would defer
+            # every less urgent call from then on
+            with self.lock:
+                self.waiting.pop(ticket["id"], None)
+            raise
+
+    def settle(self, ticket, cost, usage=None):
+        # releases the reservation and books the real cost (0 for a failed call)
+        if ticket is None:
+            return
+        with self.condition:
+            if self.in_flight.pop(ticket["id"], None) is None:
+                return
+            self.reserved -= ticket["estimate"]
+            self.run_spent += cost
+            self.day_spent_local += cost
+            self.actual_total += cost
+            if usage and not self.ledger.enabled:
+                self._observe(ticket["stage"], ticket["model"], usage)
+            self.condition.notify_all()
+
+    def summary(self):
+        with self.lock:
+            self._refresh()
+            summary = dict(self.counts, run_spent=self.run_spent, day_spent=self._day_spent(), reserved=self.reserved,
+                           run_cap=self.run_cap, day_cap=self.day_cap, estimated=self.estimated_total,
+                           actual=self.actual_total)
+        run_cap = f" / ${self.run_cap:.2f}" if self.run_cap is not None else ""
+        day_cap = f" / ${self.day_cap:.2f}" if self.day_cap is not None else ""
+        print(f"Budget: {summary['admitted']} admitted, {summary['deferred']} deferred, {summary['rejected']} rejected"
+              f" | run ${summary['run_spent']:.4f}{run_cap} | today ${summary['day_spent']:.4f}{day_cap}"
+              f" | estimated ${summary['estimated']:.4f} vs actual ${summary['actual']:.4f}")
+        return summary
+
+
+def budget_from_env():
+    # BUDGET_RUN_CAP / BUDGET_DAY_CAP in dollars; no caps, no controller
+    run_cap = os.environ.get("BUDGET_RUN_CAP")
+    day_cap = os.environ.get("BUDGET_DAY_CAP")
+    if not run_cap and not day_cap:
+        return None
+    return BudgetController(run_cap=float(run_cap) if run_cap else None, day_cap=float(day_cap) if day_cap else None,
+                            reserve_fraction=float(os.environ.get("BUDGET_RESERVE_FRACTION", 0.1)))
+
+
+shared_budget = budget_from_env()
@@ -1,58 +1,608 @@
-import openai
-import anthropic
+import contextlib
 import os
+import time
+import types
+import weakref
+from RateLimiter import shared_limiter
+from ResponseCache import ResponseCache, get_default_cache
+from ClientRegistry import shared_registry
+from Telemetry import ledger
+from BudgetController import shared_budget
+from HedgePolicy import shared_hedge_policy
+from HistoryBudget import count_message_tokens
+from LocalRetrieval import TOOL_DESCRIPTION, TOOL_NAME, TOOL_PARAMETERS, resolve_search_backend
+
+
+class HistorySnapshot:
+    # Frozen point in a session's history. The message dicts are shared with the session and
+    # every fork, never copied: messages are only ever appended, not edited in place. The
+    # OpenAI chain state lets a fork continue from the same server-side response.
+    __slots__ = ("messages", "last_response_id", "chained_length", "provider", "model_name")
+
+    def __init__(self, messages, last_response_id=None, chained_length=0, provider=None, model_name=None):
+        self.messages = tuple(messages)
+        self.last_response_id = last_response_id
+        self.chained_length = chained_length
+        self.provider = provider
+        self.model_name = model_name
+
+    def __len__(self):
+        return len(self.messages)
+
+    def last_output(self):
+        return next((m["content"] for m in reversed(self.messages) if m["role"] == "assistant"), None)
+
 
 class ChatSession:
     # 2026 Pricing for High Reasoning Models (Per 1M Tokens)
+    # cached_input: cache reads; cache_write: Anthropic cache creation (OpenAI caches for free)
     PRICING = {
-        "gpt-5.2": {"input": 1.75, "output": 14.00, "search": 0.01},
-        "gpt-5.1": {"input": 1.25, "output": 10.00, "search": 0.01},
-        "gpt-5": {"input": 1.00, "output": 8.00, "search": 0.01},
-        "claude-opus-4-5-20251101": {"input": 5.00, "output": 25.00, "search": 0.01},
+        "gpt-5.2": {"input": 1.75, "cached_input": 0.175, "output": 14.00, "search": 0.01},
+        "gpt-5.1": {"input": 1.25, "cached_input": 0.125, "output": 10.00, "search": 0.01},
+        "gpt-5": {"input": 1.00, "cached_input": 0.10, "output": 8.00, "search": 0.01},
+        "claude-opus-4-5-20251101": {"input": 5.00, "cached_input": 0.50, "cache_write": 6.25, "output": 25.00, "search": 0.01},
+        # offline MockProvider, priced like gpt-5 so benchmarks report comparable costs
+        "mock": {"input": 1.00, "cached_input": 0.10, "output": 8.00, "search": 0.01},
     }
+    PROVIDERS = ("openai", "anthropic", "mock")
+    # Providers spoken to through the OpenAI Responses API shape ("mock" is MockProvider)
+    RESPONSES_API_PROVIDERS = ("openai", "mock")
+    # local search: model turns that may call the tool before answering (the last one may not)
+    MAX_TOOL_ROUNDS = 6
+
+    # Max in-flight async requests per provider, shared by every session in the process
+    MAX_CONCURRENCY = {"openai": 8, "anthropic": 4, "mock": 16}
+    _semaphores = weakref.WeakKeyDictionary()
+    # RPM/TPM limiter with 429/Retry-After backoff, shared by every session in the process
+    rate_limiter = shared_limiter
+    # Pooled SDK clients (keep-alive connections) shared by every session in the process;
+    # provider SDKs are imported by the registry on first use
+    client_registry = shared_registry
+    # every provider call (and cache hit) is appended to this JSONL ledger
+    ledger = ledger
+    # per-run / per-day spending caps (BudgetController.budget_from_env); None admits every call
+    budget = shared_budget
+    # per-stage deadlines for non-streamed calls, and hedged duplicates for async ones
+    # (HedgePolicy.hedge_policy_from_env)
+    hedge_policy = shared_hedge_policy
 
-    def __init__(self, provider, model_name,  api_key, history=None,  web_enabled=False, high_reasoning=True):
+    def __init__(self, provider, model_name,  api_key, history=None,  web_enabled=False, high_reasoning=True,
+                 cache=None, cache_salt="", incremental=True, stream=False, max_output_chars=None,
+                 run_id="", stage="", history_budget=None, response_schema=None, reasoning_effort=None,
+                 search_backend=None):
         self.provider = provider.lower()
+        if self.provider not in self.PROVIDERS:
+            raise ValueError(f"Unknown provider {provider!r}, expected one of {self.PROVIDERS}")
         self.model_name = model_name
         self.history = history if history else []
         self.total_cost = 0
         self.web_enabled = web_enabled
         self.high_reasoning = high_reasoning
+        # reasoning_effort overrides the effort high_reasoning picks (e.g. "low" for rubric items)
+        self.reasoning_effort = reasoning_effort
 
-        if self.provider == "openai":
-            self.client = openai.OpenAI(api_key=api_key)
-        elif self.provider == "anthropic":
-            key = os.environ.get("ANTHROPIC_API_KEY")
-            self.client = anthropic.Anthropic(api_key=key)
+        self.api_key = api_key
+        # cache_salt separates intentional repeat samples (e.g. run ids) that share the same prompt
+        self.cache = cache if cache is not None else get_default_cache()
+        self.cache_salt = cache_salt
+        # incremental: Anthropic gets cache_control on the history prefix, OpenAI turns are
+        # chained with previous_response_id instead of re-uploading the whole history
+        self.incremental = incremental
+        self.last_response_id = None
+        self.chained_length = 0
+        # stream: get_and_save_response writes deltas to disk as they arrive;
+        # max_output_chars stops a runaway generation early (streaming only)
+        self.stream = stream
+        self.max_output_chars = max_output_chars
+        self.last_call_metrics = {}
+        # run_id / stage label the telemetry records; the pipeline sets stage per call
+        self.run_id = run_id
+        self.stage = stage
+        self.last_usage = {}
+        self.call_stats = {"retries": 0}
+        # history_budget (a HistoryBudget) trims what is sent; self.history always stays complete
+        self.history_budget = history_budget
+        self.outgoing = None
+        self.last_preflight = {}
+        self.last_estimate = None
+        # the BudgetController ticket of the call in flight and the cost already settled on earlier
+        # tickets of the same call (local search rounds are admitted one by one)
+        self.budget_ticket = None
+        self.budget_booked = 0.0
+        self.next_round_tokens = 0
+        # response_schema ({"name", "schema", "strict"}, e.g. PromptFactory.grading_schema()) makes
+        # every reply a JSON document constrained by that schema
+        self.response_schema = response_schema
+        # search_backend: "hosted" (or None) for the providers' web search tools when web_enabled,
+        # "local" (or a LocalRetrieval) for a function tool answered from the local corpus
+        self.search_backend = search_backend
+        self.retrieval = resolve_search_backend(search_backend)
+
+        self.client = self.client_registry.get_client(self.provider, api_key)
 
     def send_message(self, prompt, force_search = False):
         self.history.append({"role": "user", "content": prompt})
+        with self._admission():
+            self._preflight(*self._budget_apply())
+            cache_key = self._cache_key(force_search)
+            cached = self._cached_response(cache_key)
+            if cached is None:
+                self._admit(force_search)
+        if cached is not None:
+            return cached
+
+        try:
+            start = self._start_call()
+            if self.provider in self.RESPONSES_API_PROVIDERS:
+                output = self._openai_logic(force_search)
+            elif self.provider == "anthropic":
+                output = self._claude_logic()
+            self._record_call(time.perf_counter() - start)
+        finally:
+            self._settle()
+        self.cache.put(cache_key, self.provider, self.model_name, output)
+        return output
+
+    async def async_send_message(self, prompt, force_search = False):
+        self.history.append({"role": "user", "content": prompt})
+        with self._admission():
+            self._preflight(*await self._async_budget_apply())
+            cache_key = self._cache_key(force_search)
+            cached = self._cached_response(cache_key)
+            # admitted before taking a provider slot: a deferred call does not hold one while it waits
+            if cached is None:
+                await self._async_admit(force_search)
+        if cached is not None:
+            return cached
+
+        try:
+            async with self._provider_semaphore():
+                start = self._start_call()
+                if self.provider in self.RESPONSES_API_PROVIDERS:
+                    output = await self._async_openai_logic(force_search)
+                elif self.provider == "anthropic":
+                    output = await self._async_claude_logic()
+            self._record_call(time.perf_counter() - start)
+        finally:
+            self._settle()
+        self.cache.put(cache_key, self.provider, self.model_name, output)
+        return output
+
+    def stream_message(self, prompt, force_search = False, save_path = None):
+        # Generator over text deltas; each delta is appended to save_path as soon as it arrives
+        if self._local_search():
+            # tool rounds are not streamed: the answer is written once it is complete
+            output = self.send_message(prompt, force_search)
+            StreamRecorder(save_path).write_all(output)
+            yield output
+            return
+        self.history.append({"role": "user", "content": prompt})
+        with self._admission():
+            self._preflight(*self._budget_apply())
+            cache_key = self._cache_key(force_search)
+            cached = self._cached_response(cache_key)
+            if cached is None:
+                self._admit(force_search)
+        if cached is not None:
+            StreamRecorder(save_path).write_all(cached)
+            yield cached
+            return
+
+        try:
+            # timed from here: sending, rate-limiter waits and retries count towards TTFT
+            start = self._start_call()
+            if self.provider in self.RESPONSES_API_PROVIDERS:
+                request = self._openai_request(force_search)
+                stream = self._limited_call(lambda: self.client.responses.create(stream=True, **request))
+                parse_event = self._openai_stream_event
+            elif self.provider == "anthropic":
+                request = self._claude_request()
+                stream = self._limited_call(lambda: self.client.beta.messages.create(stream=True, **request))
+                parse_event = self._claude_stream_event
+
+            recorder = StreamRecorder(save_path, self.max_output_chars, start)
+            state = {}
+            try:
+                for event in stream:
+                    delta = parse_event(event, state)
+                    if delta:
+                        recorder.add(delta)
+                        yield delta
+                        if recorder.truncated:
+                            break
+            finally:
+                recorder.close()
+                if recorder.truncated:
+                    stream.close()
+            self._finish_stream(recorder, state, cache_key)
+        finally:
+            self._settle()
+
+    async def async_stream_message(self, prompt, force_search = False, save_path = None):
+        if self._local_search():
+            output = await self.async_send_message(prompt, force_search)
+            StreamRecorder(save_path).write_all(output)
+            yield output
+            return
+        self.history.append({"role": "user", "content": prompt})
+        with self._admission():
+            self._preflight(*await self._async_budget_apply())
+            cache_key = self._cache_key(force_search)
+            cached = self._cached_response(cache_key)
+            if cached is None:
+                await self._async_admit(force_search)
+        if cached is not None:
+            StreamRecorder(save_path).write_all(cached)
+            yield cached
+            return
+
+        try:
+            async with self._provider_semaphore():
+                start = self._start_call()
+                client = self._get_async_client()
+                if self.provider in self.RESPONSES_API_PROVIDERS:
+                    request = self._openai_request(force_search)
+                    stream = await self._async_limited_call(lambda: client.responses.create(stream=True, **request))
+                    parse_event = self._openai_stream_event
+                elif self.provider == "anthropic":
+                    request = self._claude_request()
+                    stream = await self._async_limited_call(
+                        lambda: client.beta.messages.create(stream=True, **request))
+                    parse_event = self._claude_stream_event
+
+                recorder = StreamRecorder(save_path, self.max_output_chars, start)
+                state = {}
+                try:
+                    async for event in stream:
+                        delta = parse_event(event, state)
+                        if delta:
+                            recorder.add(delta)
+                            yield delta
+                            if recorder.truncated:
+                                break
+                finally:
+                    recorder.close()
+                    if recorder.truncated:
+                        await stream.close()
+            self._finish_stream(recorder, state, cache_key)
+        finally:
+            self._settle()
+
+    @staticmethod
+    def _openai_stream_event(event, state):
+        if event.type == "response.output_text.delta":
+            return event.delta
+        if event.type == "response.web_search_call.searching":
+            print("🌐 [OpenAI Web Search Performed]")
+        if event.type == "response.completed":
+            state["usage"] = event.response.usage
+            state["response_id"] = event.response.id
+            state["completed"] = True
+        return None
+
+    @staticmethod
+    def _claude_stream_event(event, state):
+        # Input usage arrives with message_start, the output token count with message_delta
+        if event.type == "message_start":
+            state["usage"] = types.SimpleNamespace(**vars(event.message.usage))
+        elif event.type == "message_delta" and "usage" in state:
+            state["usage"].output_tokens = event.usage.output_tokens
+        elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+            return event.delta.text
+        elif event.type == "message_stop":
+            state["completed"] = True
+        return None
+
+    def _finish_stream(self, recorder, state, cache_key):
+        # a stream that ended without its completion event (e.g. a dropped connection) is as
+        # partial as one cut off at max_output_chars
+        if not state.get("completed"):
+            recorder.truncated = True
+        output = recorder.text()
+        usage = state.get("usage")
+        if usage is not None:
+            self._calculate_cost(usage)
+            self.rate_limiter.record_usage(self.provider, self.model_name, self._estimate_tokens(), usage)
+        self.history.append({"role": "assistant", "content": output})
+        if self.provider in self.RESPONSES_API_PROVIDERS and not recorder.truncated:
+            self.last_response_id = state.get("response_id")
+            self.chained_length = len(self.history)
+        self.last_call_metrics = recorder.metrics(getattr(usage, "output_tokens", None))
+        metrics = self.last_call_metrics
+        self._record_call(metrics["total_time"], streamed=True, time_to_first_token=metrics["time_to_first_token"])
+        print(f"--- [TTFT: {metrics['time_to_first_token']:.2f}s | {metrics['tokens_per_second']:.1f} tok/s | "
+              f"Total: {metrics['total_time']:.1f}s{' | TRUNCATED' if recorder.truncated else ''}] ---")
+        if not recorder.truncated:
+            self.cache.put(cache_key, self.provider, self.model_name, output)
+
+    @contextlib.contextmanager
+    def _admission(self):
+        # A call refused before it reaches the provider (BudgetExceeded, a failed pre-flight
+        # summary) takes its prompt back out of the history: no user turn is left without a reply
+        size = len(self.history)
+        try:
+            yield
+        except BaseException:
+            del self.history[size - 1:]
+            raise
+
+    def _budget_apply(self):
+        if self.history_budget is None:
+            return self.history, None
+        return self.history_budget.apply(self.history, self)
+
+    async def _async_budget_apply(self):
+        if self.history_budget is None:
+            return self.history, None
+        return await self.history_budget.async_apply(self.history, self)
+
+    def _preflight(self, messages, report):
+        # Fixes the messages this call sends and estimates their input tokens and cost up front
+        self.outgoing = messages
+        if report is None:
+            report = {"input_tokens": count_message_tokens(messages), "dropped_turns": 0,
+                      "summarized": False, "trimmed": False}
+        price = self.PRICING.get(self.model_name, {"input": 0})["input"]
+        report["max_input_cost"] = report["input_tokens"] * price / 1e6
+        self.last_preflight = report
+        self.last_estimate = None
+        if self.history_budget is not None:
+            print(f"--- [Pre-flight: ~{report['input_tokens']} input tokens (<= ${report['max_input_cost']:.4f}) | "
+                  f"{report['dropped_turns']} turns {'summarized' if report['summarized'] else 'dropped'}"
+                  f"{' | OVER BUDGET' if report.get('over_budget') else ''}] ---")
+        return report
+
+    def preflight(self, prompt):
+        # Estimate for sending prompt next, without sending it (summaries are not requested:
+        # turns that would be summarized are counted as dropped)
+        history = self.history + [{"role": "user", "content": prompt}]
+        if self.history_budget is None:
+            messages = history
+        else:
+            pinned, dropped, kept = self.history_budget.plan(history)
+            messages = [m for turn in pinned + kept for m in turn]
+        tokens = count_message_tokens(messages)
+        price = self.PRICING.get(self.model_name, {"input": 0})["input"]
+        return {"input_tokens": tokens, "max_input_cost": tokens * price / 1e6}
+
+    def _request_messages(self):
+        return self.outgoing if self.outgoing is not None else self.history
+
+    def _reasoning_effort(self):
+        if self.reasoning_effort:
+            return self.reasoning_effort
+        if self.provider in self.RESPONSES_API_PROVIDERS:
+            return "xhigh" if self.model_name == "gpt-5.2" and self.high_reasoning else "high"
+        return "high" if self.high_reasoning else "medium"
+
+    def _cache_key(self, force_search = False):
+        corpus = self.retrieval.fingerprint() if self._local_search() else None
+        return ResponseCache.make_key(self.provider, self.model_name, self._request_messages(), self._reasoning_effort(),
+                                      self.web_enabled, force_search, self.cache_salt, self.response_schema, corpus)
+
+    def _local_search(self):
+        return self.web_enabled and self.retrieval is not None
+
+    def _cached_response(self, cache_key):
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            print("--- [Cache hit: $0.000000] ---")
+            self.history.append({"role": "assistant", "content": cached})
+            self.last_usage = {"cost": 0.0}
+            self.call_stats = {"retries": 0}
+            self.last_call_metrics = {}
+            self._record_call(0.0, cache_hit=True)
+        return cached
+
+    def _start_call(self):
+        self.last_usage = {}
+        self.call_stats = {"retries": 0}
+        self.last_call_metrics = {}
+        return time.perf_counter()
 
-        if self.provider == "openai":
-            return self._openai_logic(force_search)
-        elif self.provider == "anthropic":
-            return self._claude_logic()
+    def _record_call(self, latency, **extra):
+        self.ledger.record(run_id=self.run_id, stage=self.stage, provider=self.provider, model=self.model_name,
+                           latency=latency, retries=self.call_stats.get("retries", 0),
+                           estimated_input_tokens=self.last_preflight.get("input_tokens"),
+                           estimated_cost=self.last_estimate, hedged=self.call_stats.get("hedged"),
+                           hedge_won=self.call_stats.get("hedge_won"), hedge_cost=self.call_stats.get("hedge_cost"),
+                           **self.last_usage, **extra)
+
+    def _budget_request(self, force_search = False, input_tokens = None):
+        # local searches carry no search fee: only hosted web search is priced per search
+        if input_tokens is None:
+            input_tokens = self.last_preflight["input_tokens"]
+        return {"stage": self.stage, "run_id": self.run_id,
+                "estimate": {"pricing": self.PRICING, "model": self.model_name, "stage": self.stage,
+                             "input_tokens": input_tokens, "effort": self._reasoning_effort(),
+                             "web_enabled": self.web_enabled and not self._local_search(),
+                             "force_search": force_search}}
+
+    def _admit(self, force_search = False):
+        # Reserves the call's estimated cost against the caps; may wait (defer) or raise
+        # BudgetExceeded (reject). Cache hits never get here: they cost nothing.
+        self.budget_booked = 0.0
+        if self.budget is None:
+            return None
+        self.budget_ticket = self.budget.admit(self._budget_request(force_search))
+        self.last_estimate = self.budget_ticket["estimate"]
+        return self.budget_ticket
+
+    async def _async_admit(self, force_search = False):
+        self.budget_booked = 0.0
+        if self.budget is None:
+            return None
+        self.budget_ticket = await self.budget.async_admit(self._budget_request(force_search))
+        self.last_estimate = self.budget_ticket["estimate"]
+        return self.budget_ticket
+
+    def _admit_round(self):
+        # A local search follow-up is one more billed request: the rounds so far are settled and
+        # the next one is admitted on its own, so many rounds cannot outspend one reservation
+        if self.budget_ticket is None:
+            return
+        self._settle(final=False)
+        self.budget_ticket = self.budget.admit(self._budget_request(input_tokens=self.next_round_tokens))
+        self.last_estimate += self.budget_ticket["estimate"]
+
+    async def _async_admit_round(self):
+        if self.budget_ticket is None:
+            return
+        self._settle(final=False)
+        self.budget_ticket = await self.budget.async_admit(self._budget_request(input_tokens=self.next_round_tokens))
+        self.last_estimate += self.budget_ticket["estimate"]
+
+    def _settle(self, final = True):
+        # Books what the call has cost since the last settle on its current ticket. A failed call
+        # settles at 0: last_usage is only filled once a response is priced.
+        ticket, self.budget_ticket = self.budget_ticket, None
+        if ticket is not None:
+            cost = (self.last_usage.get("cost") or 0.0) + self.call_stats.get("hedge_cost", 0.0)
+            self.budget.settle(ticket, cost - self.budget_booked, self.last_usage if final else None)
+            self.budget_booked = cost
+
+    def _limited_call(self, request_func, deadline = None):
+        return self.rate_limiter.call(self.provider, self.model_name, self._estimate_tokens(), request_func,
+                                      stats=self.call_stats, deadline=deadline)
+
+    async def _async_limited_call(self, request_func, deadline = None):
+        return await self.rate_limiter.async_call(self.provider, self.model_name, self._estimate_tokens(),
+                                                  request_func, stats=self.call_stats, deadline=deadline)
+
+    @staticmethod
+    def _request_options(expires):
+        # the SDK timeout of each attempt is what is left of the stage deadline
+        return {"timeout": max(0.1, expires - time.monotonic())} if expires is not None else {}
+
+    def _hedged_call(self, create, request):
+        # one provider request with its retries, within the stage deadline (not hedged: sync)
+        if self.hedge_policy is None:
+            return self._limited_call(lambda: create(**request))
+        response, info = self.hedge_policy.call(
+            (self.provider, self.model_name, self.stage),
+            lambda expires: self._limited_call(lambda: create(**request, **self._request_options(expires)), expires))
+        self._record_hedge(info)
+        return response
+
+    async def _async_hedged_call(self, create, request):
+        # both attempts share this call's provider slot
+        if self.hedge_policy is None:
+            return await self._async_limited_call(lambda: create(**request))
+        response, info = await self.hedge_policy.async_call(
+            (self.provider, self.model_name, self.stage),
+            lambda expires: self._async_limited_call(lambda: create(**request, **self._request_options(expires)),
+                                                     expires))
+        self._record_hedge(info)
+        return response
+
+    def _record_hedge(self, info):
+        if not info["hedged"]:
+            return
+        # the losing attempt: its real cost when it completed too, else at least its input
+        if info["loser"] is not None:
+            hedge_cost = self.cost_breakdown(self.model_name, info["loser"].usage)["cost"]
+        else:
+            hedge_cost = self.last_preflight.get("max_input_cost", 0.0)
+        # summed over the rounds of a local search call
+        self.call_stats.update(hedged=True, hedge_won=info["hedge_won"],
+                               hedge_cost=self.call_stats.get("hedge_cost", 0.0) + hedge_cost)
+        self.total_cost += hedge_cost
+        self.hedge_policy.add_extra_cost(hedge_cost)
+
+    def _provider_semaphore(self):
+        # asyncio semaphores belong to one event loop, so keep one set per running loop
+        import asyncio
+        loop = asyncio.get_running_loop()
+        per_loop = self._semaphores.setdefault(loop, {})
+        if self.provider not in per_loop:
+            per_loop[self.provider] = asyncio.Semaphore(self.MAX_CONCURRENCY.get(self.provider, 4))
+        return per_loop[self.provider]
+
+    def _get_async_client(self):
+        # not cached on the session: async clients belong to the event loop they were made on
+        return self.client_registry.get_client(self.provider, self.api_key, use_async=True)
+
+    def _estimate_tokens(self):
+        # Pre-flight estimate of the input tokens; the limiter corrects it from the real usage
+        if self.last_preflight:
+            return self.last_preflight["input_tokens"]
+        return count_message_tokens(self._request_messages())
 
     def _openai_logic(self, force_search = False):
-        tools = [{"type": "web_search"}] if self.web_enabled else []
+        request = self._openai_request(force_search)
+        create = self.client.responses.with_raw_response.create
+        for round_number in range(self.MAX_TOOL_ROUNDS + 1):
+            response = self._hedged_call(create, request)
+            request = self._openai_tool_round(request, response, round_number)
+            if request is None:
+                break
+            self._admit_round()
+        return self._openai_response(response)
+
+    async def _async_openai_logic(self, force_search = False):
+        request = self._openai_request(force_search)
+        client = self._get_async_client()
+        create = client.responses.with_raw_response.create
+        for round_number in range(self.MAX_TOOL_ROUNDS + 1):
+            response = await self._async_hedged_call(create, request)
+            request = self._openai_tool_round(request, response, round_number)
+            if request is None:
+                break
+            await self._async_admit_round()
+        return self._openai_response(response)
 
-        effort = "xhigh" if self.model_name == "gpt-5.2" and self.high_reasoning else "high"
+    def _openai_tool_round(self, request, response, round_number):
+        # -> the follow-up request answering the response's local search calls, None when it has none.
+        # The follow-up continues the response server-side, so only the tool outputs are uploaded.
+        calls = [item for item in response.output if item.type == "function_call"]
+        if not calls or not self._local_search() or round_number >= self.MAX_TOOL_ROUNDS:
+            return None
+        usage = self._calculate_cost(response.usage)
+        outputs = [{"type": "function_call_output", "call_id": call.call_id,
+                    "output": self.retrieval.run_tool(call.name, call.arguments)} for call in calls]
+        self.last_usage["local_searches"] = self.last_usage.get("local_searches", 0) + len(calls)
+        # the follow-up is billed for everything so far (server-side) plus the tool outputs
+        self.next_round_tokens = (usage["input_tokens"] + usage["output_tokens"] +
+                                  count_message_tokens([{"role": "user", "content": outputs}]))
+        last_round = round_number + 1 == self.MAX_TOOL_ROUNDS
+        return dict(request, input=outputs, previous_response_id=response.id,
+                    tool_choice="none" if last_round else "auto")
 
-        # The 'include' list below uses the exact supported values from the 2026 spec
-        include_params = ["web_search_call.results"]
-        if self.web_enabled:
-            include_params.append("web_search_call.action.sources")
+    def _openai_request(self, force_search = False):
+        tools = [{"type": "web_search"}] if self.web_enabled else []
         tool_choice = {"type": "web_search"} if force_search else "auto"
-        response = self.client.responses.create(
+        if self._local_search():
+            tools = [{"type": "function", "name": TOOL_NAME, "description": TOOL_DESCRIPTION,
+                      "parameters": TOOL_PARAMETERS, "strict": True}]
+            tool_choice = {"type": "function", "name": TOOL_NAME} if force_search else "auto"
+
+        effort = self._reasoning_effort()
+
+        # The 'include' list below uses the exact supported values from the 2026 spec;
+        # web search results are only requested when the web_search tool is offered
+        include_params = []
+        if any(tool["type"] == "web_search" for tool in tools):
+            include_params = ["web_search_call.results", "web_search_call.action.sources"]
+        request = dict(
             model=self.model_name,
             tools=tools,
-            input=self.history,
+            input=self._request_messages(),
             reasoning={"effort": effort},
             include=include_params,  # Corrected field names
             tool_choice = tool_choice
         )
+        if self.response_schema is not None:
+            # low verbosity: the schema already fixes what the answer contains
+            request["text"] = {"format": dict(self.response_schema, type="json_schema"), "verbosity": "low"}
+        # Only the new turn is uploaded when the server already holds everything before it.
+        # A trimmed request is never chained: the server-side context is the untrimmed one.
+        chainable = not self.last_preflight.get("trimmed")
+        if chainable and self.incremental and self.last_response_id and self.chained_length == len(self.history) - 1:
+            request["input"] = self.history[self.chained_length:]
+            request["previous_response_id"] = self.last_response_id
+        return request
 
-
+    def _openai_response(self, response):
         # DETECTING THE SEARCH
         # The 'output' attribute is an array of items (reasoning, search_calls, message)
         search_occurred = any(item.type == "web_search_call" for item in response.output)
@@ -66,22 +616,70 @@ class ChatSession:
                     print(f"   -> Query: {query}")
 
         output = response.output_text
-        self._calculate_cost(response.usage)
+        search_calls = sum(1 for item in response.output if item.type == "web_search_call")
+        self._calculate_cost(response.usage, search_calls)
         self.history.append({"role": "assistant", "content": output})
+        self.last_response_id = getattr(response, "id", None)
+        self.chained_length = len(self.history)
         return output
 
     def _claude_logic(self):
+        # Since we are using betas, we use the .beta namespace
+        request = self._claude_request()
+        create = self.client.beta.messages.with_raw_response.create
+        for round_number in range(self.MAX_TOOL_ROUNDS + 1):
+            response = self._hedged_call(create, request)
+            request = self._claude_tool_round(request, response, round_number)
+            if request is None:
+                break
+            self._admit_round()
+        return self._claude_response(response)
+
+    async def _async_claude_logic(self):
+        request = self._claude_request()
+        client = self._get_async_client()
+        create = client.beta.messages.with_raw_response.create
+        for round_number in range(self.MAX_TOOL_ROUNDS + 1):
+            response = await self._async_hedged_call(create, request)
+            request = self._claude_tool_round(request, response, round_number)
+            if request is None:
+                break
+            await self._async_admit_round()
+        return self._claude_response(response)
+
+    def _claude_tool_round(self, request, response, round_number):
+        # -> the follow-up request with the tool results, None when the response made no local search
+        # calls. The assistant turn goes back unchanged: thinking blocks must precede their tool_use.
+        calls = [block for block in response.content if block.type == "tool_use"]
+        if not calls or not self._local_search() or round_number >= self.MAX_TOOL_ROUNDS:
+            return None
+        usage = self._calculate_cost(response.usage)
+        results = [{"type": "tool_result", "tool_use_id": call.id,
+                    "content": self.retrieval.run_tool(call.name, call.input)} for call in calls]
+        self.last_usage["local_searches"] = self.last_usage.get("local_searches", 0) + len(calls)
+        self.next_round_tokens = (usage["input_tokens"] + usage["output_tokens"] +
+                                  count_message_tokens([{"role": "user", "content": results}]))
+        messages = list(request["messages"]) + [{"role": "assistant", "content": response.content},
+                                                {"role": "user", "content": results}]
+        followup = dict(request, messages=messages)
+        if round_number + 1 == self.MAX_TOOL_ROUNDS:
+            followup["tool_choice"] = {"type": "none"}
+        return followup
+
+    def _claude_request(self):
         kwargs = {
             "model": "claude-opus-4-5-20251101",
             "max_tokens": 20000,
-            "messages": self.history,
+            "messages": self._cacheable_messages() if self.incremental else self._request_messages(),
         }
 
         # List for all necessary beta headers
         betas = []
 
         # 1. Web Search Setup
-        if self.web_enabled:
+        if self._local_search():
+            kwargs["tools"] = [{"name": TOOL_NAME, "description": TOOL_DESCRIPTION, "input_schema": TOOL_PARAMETERS}]
+        elif self.web_enabled:
             betas.append("web-search-2025-03-05")
             kwargs["tools"] = [{
                 "type": "web_search_20250305",
@@ -92,7 +690,7 @@ class ChatSession:
         # Note: This requires the effort beta header
         betas.append("effort-2025-11-24")
         kwargs["output_config"] = {
-            "effort": "high" if self.high_reasoning else "medium"
+            "effort": self._reasoning_effort()
         }
 
         # 3. Thinking Configuration (Now only for the token budget)
@@ -102,37 +700,158 @@ class ChatSession:
                 "budget_tokens": 12000
             }
 
-        # 4. Final Header Assembly
+        # 4. Structured output constrained by a JSON schema
+        if self.response_schema is not None:
+            betas.append("structured-outputs-2025-11-13")
+            kwargs["output_format"] = {"type": "json_schema", "schema": self.response_schema["schema"]}
+
+        # 5. Final Header Assembly
         if betas:
             kwargs["betas"] = betas
+        return kwargs
 
-        # 5. API Call
-        # Since we are using betas, we use the .beta namespace
-        response = self.client.beta.messages.create(**kwargs)
+    def _cacheable_messages(self):
+        # Put a cache breakpoint on the last turn: the next request reads the whole prefix
+        # from the prompt cache. self.history itself stays plain (it is used for cache keys).
+        messages = list(self._request_messages())
+        last = messages[-1]
+        content = last["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        content = [dict(block) for block in content]
+        content[-1]["cache_control"] = {"type": "ephemeral"}
+        messages[-1] = {"role": last["role"], "content": content}
+        return messages
 
+    def _claude_response(self, response):
         # 6. Extraction
         response_text = "".join([b.text for b in response.content if b.type == "text"])
         self._calculate_cost(response.usage)
         self.history.append({"role": "assistant", "content": response_text})
         return response_text
 
-    def _calculate_cost(self, usage):
-        p = self.PRICING.get(self.model_name, {"input": 0, "output": 0, "search": 0})
+    @classmethod
+    def cost_breakdown(cls, model_name, usage, search_calls = None):
+        p = cls.PRICING.get(model_name, {"input": 0, "output": 0, "search": 0})
         # Standard input/output usage
         # Note: reasoning_tokens are billed as output tokens
-        input_tokens = getattr(usage, 'input_tokens', getattr(usage, 'prompt_tokens', 0))
-        output_tokens = getattr(usage, 'output_tokens', getattr(usage, 'completion_tokens', 0))
+        input_tokens = getattr(usage, 'input_tokens', getattr(usage, 'prompt_tokens', 0)) or 0
+        output_tokens = getattr(usage, 'output_tokens', getattr(usage, 'completion_tokens', 0)) or 0
+        output_details = getattr(usage, 'output_tokens_details', None)
+        reasoning_tokens = (getattr(output_details, 'reasoning_tokens', 0) or 0) if output_details is not None else 0
 
-        cost = (input_tokens * p["input"] / 1e6) + (output_tokens * p["output"] / 1e6)
+        # OpenAI reports cached tokens as part of input_tokens,
+        # Anthropic reports cache reads/writes separately from input_tokens
+        details = getattr(usage, 'input_tokens_details', None)
+        cached_tokens = (getattr(details, 'cached_tokens', 0) or 0) if details is not None else 0
+        uncached_tokens = input_tokens - cached_tokens
+        cached_tokens += getattr(usage, 'cache_read_input_tokens', 0) or 0
+        cache_write_tokens = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+
+        cost = (uncached_tokens * p["input"] / 1e6) + (output_tokens * p["output"] / 1e6)
+        cost += cached_tokens * p.get("cached_input", p["input"]) / 1e6
+        cost += cache_write_tokens * p.get("cache_write", p["input"]) / 1e6
 
         # Add flat search fee if applicable
-        if hasattr(usage, 'web_search_calls'):
-            cost += (usage.web_search_calls * p["search"])
+        if search_calls is None:
+            server_tools = getattr(usage, 'server_tool_use', None)
+            search_calls = getattr(usage, 'web_search_calls', None) or getattr(server_tools, 'web_search_requests', 0) or 0
+        cost += search_calls * p["search"]
 
-        self.total_cost += cost
-        print(f"--- [Turn Cost: ${cost:.6f} | Total: ${self.total_cost:.4f}] ---")
+        return {
+            "input_tokens": uncached_tokens + cached_tokens + cache_write_tokens,
+            "cached_tokens": cached_tokens,
+            "cache_write_tokens": cache_write_tokens,
+            "output_tokens": output_tokens,
+            "reasoning_tokens": reasoning_tokens,
+            "search_calls": search_calls,
+            "cost": cost,
+        }
+
+    def _calculate_cost(self, usage, search_calls = None):
+        # adds to last_usage (reset by _start_call): a call with local search rounds is billed per round
+        u = self.cost_breakdown(self.model_name, usage, search_calls)
+        for key, value in u.items():
+            self.last_usage[key] = self.last_usage.get(key, 0) + value
+        self.total_cost += u["cost"]
+        uncached = u['input_tokens'] - u['cached_tokens'] - u['cache_write_tokens']
+        print(f"--- [Turn Cost: ${u['cost']:.6f} | Input: {uncached} uncached, {u['cached_tokens']} cached, "
+              f"{u['cache_write_tokens']} cache-write | Total: ${self.total_cost:.4f}] ---")
+        return u
+
+    def snapshot(self):
+        return HistorySnapshot(self.history, self.last_response_id, self.chained_length, self.provider, self.model_name)
+
+    def fork(self, snapshot=None, **overrides):
+        # New session continuing from snapshot (default: this session as it is now), with this
+        # session's settings unless overridden. Its history list holds references to the
+        # snapshot's messages, so branches share the prefix and only their own turns are new;
+        # its cost starts at 0. Branches of one snapshot are independent of each other.
+        snapshot = snapshot if snapshot is not None else self.snapshot()
+        settings = dict(provider=self.provider, model_name=self.model_name, api_key=self.api_key,
+                        web_enabled=self.web_enabled, high_reasoning=self.high_reasoning, cache=self.cache,
+                        cache_salt=self.cache_salt, incremental=self.incremental, stream=self.stream,
+                        max_output_chars=self.max_output_chars, run_id=self.run_id, stage=self.stage,
+                        history_budget=self.history_budget, response_schema=self.response_schema,
+                        reasoning_effort=self.reasoning_effort, search_backend=self.search_backend)
+        settings.update(overrides)
+        branch = type(self)(history=list(snapshot.messages), **settings)
+        # a previous_response_id can be continued any number of times, by any branch
+        if (branch.provider, branch.model_name) == (snapshot.provider, snapshot.model_name):
+            branch.last_response_id = snapshot.last_response_id
+            branch.chained_length = snapshot.chained_length
+        return branch
 
     def get_history(self):
         return self.history
 
 
+class StreamRecorder:
+    # Collects streamed deltas, appends them to a file as they arrive and times the call
+    # from start (ChatSession passes the time it began the request; default: now)
+    def __init__(self, save_path = None, max_output_chars = None, start = None):
+        self.start = start if start is not None else time.perf_counter()
+        self.first_token = None
+        self.end = None
+        self.parts = []
+        self.chars = 0
+        self.max_output_chars = max_output_chars
+        self.truncated = False
+        self.file = open(save_path, "w", encoding="utf-8") if save_path else None
+
+    def add(self, delta):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.parts.append(delta)
+        self.chars += len(delta)
+        if self.file:
+            self.file.write(delta)
+            self.file.flush()
+        if self.max_output_chars and self.chars >= self.max_output_chars:
+            self.truncated = True
+
+    def write_all(self, text):
+        self.add(text)
+        self.close()
+
+    def close(self):
+        self.end = self.end or time.perf_counter()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def text(self):
+        return "".join(self.parts)
+
+    def metrics(self, output_tokens = None):
+        # Without a usage report, fall back to ~4 characters per token
+        output_tokens = output_tokens if output_tokens is not None else self.chars // 4
+        first_token = self.first_token or self.end
+        generation_time = self.end - first_token
+        return {
+            "time_to_first_token": first_token - self.start,
+            "total_time": self.end - self.start,
+            "output_tokens": output_tokens,
+            "tokens_per_second": output_tokens / generation_time if generation_time > 0 else 0.0,
+            "truncated": self.truncated,
+        }
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+import weakref
+
+
+class ClientRegistry:
+    # Process-wide cache of provider SDK clients keyed by provider and credentials, so every
+    # ChatSession shares one keep-alive connection pool per provider instead of building its own.
+    # Async clients are additionally keyed by event loop: an httpx.AsyncClient pool cannot be
+    # used from a loop other than the one it was created on.
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0,
+                 timeout=600.0, connect_timeout=10.0):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.async_clients = weakref.WeakKeyDictionary()
+        self.stats = {}
+
+    def configure(self, **settings):
+        # Only affects clients created afterwards
+        for name, value in settings.items():
+            if not hasattr(self, name) or name in ("lock", "clients", "async_clients", "stats"):
+                raise ValueError(f"Unknown client setting {name!r}")
+            setattr(self, name, value)
+
+    def get_client(self, provider, api_key, use_async=False):
+        if provider == "anthropic":
+            api_key = os.environ.get("ANTHROPIC_API_KEY")
+        # never keep raw keys around as dict keys / in stats
+        key = (provider, hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12], use_async)
+        with self.lock:
+            if use_async:
+                import asyncio
+                clients = self.async_clients.setdefault(asyncio.get_running_loop(), {})
+            else:
+                clients = self.clients
+            stats = self.stats.setdefault(key, {"clients_created": 0, "client_reuses": 0, "requests": 0})
+            if key in clients:
+                stats["client_reuses"] += 1
+                return clients[key][0]
+            client, http_client = self._build(provider, api_key, use_async, stats)
+            clients[key] = (client, http_client)
+            stats["clients_created"] += 1
+            return client
+
+    def _build(self, provider, api_key, use_async, stats):
+        if provider == "mock":
+            # offline stand-in (MockProvider): no HTTP pool behind it
+            from MockProvider import MockClient, AsyncMockClient
+            return (AsyncMockClient() if use_async else MockClient()), None
+        import httpx
+        limits = httpx.Limits(max_connections=self.max_connections,
+                              max_keepalive_connections=self.max_keepalive_connections,
+                              keepalive_expiry=self.keepalive_expiry)
+        timeout = httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+        def count_request(request):
+            stats["requests"] += 1
+
+        async def async_count_request(request):
+            stats["requests"] += 1
+
+        hooks = {"request": [async_count_request if use_async else count_request]}
+        # Retries are handled by the shared rate limiter, not by the SDKs
+        if provider == "openai":
+            import openai
+            http_class = openai.DefaultAsyncHttpxClient if use_async else openai.DefaultHttpxClient
+            client_class = openai.AsyncOpenAI if use_async else openai.OpenAI
+        elif provider == "anthropic":
+            import anthropic
+            http_class = anthropic.DefaultAsyncHttpxClient if use_async else anthropic.DefaultHttpxClient
+            client_class = anthropic.AsyncAnthropic if use_async else anthropic.Anthropic
+        else:
+            raise ValueError(f"Unknown provider {provider!r}")
+        http_client = http_class(limits=limits, timeout=timeout, event_hooks=hooks)
+        client = client_class(api_key=api_key, max_retries=0, timeout=timeout, http_client=http_client)
+        return client, http_client
+
+    def pool_stats(self):
+        # Request counts per client plus the live connections in each httpx pool (best effort:
+        # the pool is an httpx/httpcore internal)
+        with self.lock:
+            result = {}
+            entries = list(self.clients.items())
+            for per_loop in self.async_clients.values():
+                entries.extend(per_loop.items())
+            for key, (client, http_client) in entries:
+                provider, key_hash, use_async = key
+                name = f"{provider}/{key_hash}/{'async' if use_async else 'sync'}"
+                pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+                connections = list(getattr(pool, "connections", []))
+                stats = result.setdefault(name, dict(self.stats[key], open_connections=0, idle_connections=0))
+                stats["open_connections"] += len(connections)
+                stats["idle_connections"] += sum(1 for c in connections if getattr(c, "is_idle", lambda: False)())
+            return result
+
+    async def aclose(self):
+        # Closes the async clients of the running event loop; they cannot be closed from another
+        # loop, so this has to run before the loop ends (run() does it)
+        import asyncio
+        with self.lock:
+            per_loop = self.async_clients.pop(asyncio.get_running_loop(), {})
+        for client, http_client in per_loop.values():
+            if http_client is not None:
+                await http_client.aclose()
+
+    def run(self, coroutine):
+        # asyncio.run(coroutine) that closes the loop's async clients before the loop goes away
+        import asyncio
+
+        async def main():
+            try:
+                return await coroutine
+            finally:
+                await self.aclose()
+        return asyncio.run(main())
+
+    def close(self):
+        with self.lock:
+            clients, self.clients = self.clients, {}
+            async_clients, self.async_clients = dict(self.async_clients), weakref.WeakKeyDictionary()
+        for client, http_client in clients.values():
+            if http_client is not None:
+                http_client.close()
+        # async clients of loops that still exist but are not running; a running loop closes its
+        # own with aclose(), and a closed loop's clients can no longer be closed
+        for loop, per_loop in async_clients.items():
+            pools = [http_client for client, http_client in per_loop.values() if http_client is not None]
+            if pools and not loop.is_closed() and not loop.is_running():
+                for http_client in pools:
+                    loop.run_until_complete(http_client.aclose())
+
+
+shared_registry = ClientRegistry()
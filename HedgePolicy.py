@@ -0,0 +1,226 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+
+class StageTimeout(TimeoutError):
+    # Raised by HedgePolicy around the whole retry loop, never inside it: RateLimiter does not
+    # retry it (not a transient error) and stops retrying by itself at the deadline (raising
+    # its DeadlineExceeded, which the policy turns into this)
+    pass
+
+
+def parse_stage_timeouts(text):
+    # "grade=300,project=600,default=900" -> {"grade": 300.0, ...}, e.g. from STAGE_TIMEOUTS
+    timeouts = {}
+    for item in text.split(","):
+        if item.strip():
+            stage, seconds = item.split("=", 1)
+            timeouts[stage.strip()] = float(seconds)
+    return timeouts
+
+
+class LatencyTracker:
+    # The last `window` latencies per (provider, model, stage): the calls of this process plus
+    # whatever the ledger held when the key was first asked for
+    def __init__(self, window=200, ledger=None):
+        self.window = window
+        self.ledger = ledger
+        self.latencies = defaultdict(lambda: deque(maxlen=window))
+        self.lock = threading.Lock()
+        self.seeded = False
+
+    def _seed(self):
+        # caller holds the lock; cache hits and streamed calls (wall time depends on output length) are skipped
+        self.seeded = True
+        if self.ledger is None or not self.ledger.enabled:
+            return
+        for entry in self.ledger.read():
+            if entry.get("cache_hit") or entry.get("streamed") or not entry.get("latency"):
+                continue
+            key = (entry.get("provider"), entry.get("model"), entry.get("stage") or "")
+            self.latencies[key].append(entry["latency"])
+
+    def record(self, key, latency):
+        with self.lock:
+            if not self.seeded:
+                self._seed()
+            self.latencies[key].append(latency)
+
+    def percentile(self, key, q, min_samples=20):
+        with self.lock:
+            if not self.seeded:
+                self._seed()
+            values = sorted(self.latencies.get(key, ()))
+        if len(values) < min_samples:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class HedgePolicy:
+    # Per-stage deadlines and hedged requests for non-streamed provider calls.
+    #   deadline  stage_timeouts maps a stage (or a stage prefix: "grade" covers "grade_projection")
+    #             to seconds; "default" covers the rest. Past it the call raises StageTimeout.
+    #             request_func(expires) gets the time.monotonic() deadline and keeps it itself:
+    #             ChatSession sets each attempt's SDK timeout to the time left and the rate
+    #             limiter stops retrying at it.
+    #   hedge     async calls only: once a call has run longer than the `percentile` latency of
+    #             recent calls for the same provider, model and stage, one duplicate is sent; the
+    #             first to complete wins and the other is cancelled. No hedging before min_samples
+    #             calls. Sync calls are never hedged: a blocking SDK request in another thread
+    #             cannot be cancelled, so the loser would go on retrying, spending and taking
+    #             rate-limiter tokens.
+    # A failed attempt does not fail the call while the other one is still running.
+    def __init__(self, percentile=None, min_samples=20, window=200, stage_timeouts=None, ledger=None):
+        if ledger is None:
+            from Telemetry import ledger
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.stage_timeouts = dict(stage_timeouts or {})
+        self.tracker = LatencyTracker(window, ledger)
+        self.lock = threading.Lock()
+        self.counts = {"calls": 0, "hedged": 0, "hedge_wins": 0, "timeouts": 0}
+        self.extra_cost = 0.0
+
+    def expires_at(self, stage):
+        deadline = self.timeout(stage)
+        return time.monotonic() + deadline if deadline is not None else None
+
+    def timeout(self, stage):
+        stage = stage or ""
+        matches = [name for name in self.stage_timeouts if name != "default" and stage.startswith(name)]
+        if matches:
+            return self.stage_timeouts[max(matches, key=len)]
+        return self.stage_timeouts.get("default")
+
+    def hedge_delay(self, key):
+        if self.percentile is None:
+            return None
+        return self.tracker.percentile(key, self.percentile, self.min_samples)
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def add_extra_cost(self, cost):
+        with self.lock:
+            self.extra_cost += cost
+
+    def _timed_out(self, key, deadline):
+        self._count("timeouts")
+        provider, model, stage = key
+        return StageTimeout(f"{provider}/{model} {stage or 'call'} exceeded its {deadline:g}s deadline")
+
+    def _raise_failure(self, key, deadline, expires, error):
+        # StageTimeout when the deadline ended the call (e.g. RateLimiter's DeadlineExceeded), else error
+        if expires is not None and (isinstance(error, TimeoutError) or time.monotonic() >= expires):
+            raise self._timed_out(key, deadline) from error
+        raise error
+
+    def call(self, key, request_func):
+        # -> (result, info); info: "hedged", "hedge_won", "loser" (see async_call; never hedged here).
+        # key is (provider, model, stage). Runs in the calling thread, so nothing is left running
+        # after a timeout.
+        self._count("calls")
+        deadline = self.timeout(key[2])
+        info = {"hedged": False, "hedge_won": False, "loser": None}
+        start = time.monotonic()
+        expires = start + deadline if deadline is not None else None
+        try:
+            result = request_func(expires)
+        except Exception as e:
+            self._raise_failure(key, deadline, expires, e)
+        self.tracker.record(key, time.monotonic() - start)
+        return result, info
+
+    async def async_call(self, key, request_func):
+        # -> (result, info); info: "hedged", "hedge_won", "loser" (the duplicate's result when it
+        # also completed, else None)
+        import asyncio
+        self._count("calls")
+        deadline = self.timeout(key[2])
+        delay = self.hedge_delay(key)
+        info = {"hedged": False, "hedge_won": False, "loser": None}
+        expires = self.expires_at(key[2])
+        start = time.perf_counter()
+        if deadline is None and delay is None:
+            result = await request_func(expires)
+            self.tracker.record(key, time.perf_counter() - start)
+            return result, info
+        attempts = [asyncio.ensure_future(request_func(expires))]
+        running = list(attempts)
+        try:
+            while True:
+                now = time.perf_counter()
+                waits = [t - now for t in (None if info["hedged"] or delay is None else start + delay,
+                                           None if deadline is None else start + deadline) if t is not None]
+                done, _ = await asyncio.wait(running, timeout=max(0.0, min(waits)) if waits else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    running.remove(task)
+                    if task.exception() is None:
+                        return self._won(key, start, info, task, attempts)
+                    if not running:
+                        self._raise_failure(key, deadline, expires, task.exception())
+                if done:
+                    continue
+                now = time.perf_counter()
+                if deadline is not None and now - start >= deadline:
+                    raise self._timed_out(key, deadline)
+                if not info["hedged"] and delay is not None and now - start >= delay:
+                    self._hedge(key, info, now - start)
+                    attempts.append(asyncio.ensure_future(request_func(expires)))
+                    running.append(attempts[-1])
+        finally:
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+            # a cancelled attempt's exception is retrieved here, not reported as never retrieved
+            for task in attempts:
+                if task.done() and not task.cancelled():
+                    task.exception()
+
+    def _hedge(self, key, info, elapsed):
+        info["hedged"] = True
+        self._count("hedged")
+        provider, model, stage = key
+        print(f"--- [Hedge: {provider}/{model} {stage or 'call'} still running after {elapsed:.1f}s, "
+              f"sending a duplicate] ---")
+
+    def _won(self, key, start, info, winner, attempts):
+        info["hedge_won"] = winner is not attempts[0]
+        if info["hedge_won"]:
+            self._count("hedge_wins")
+        # the other attempt, if it completed too (e.g. both in the same wait)
+        others = [a for a in attempts if a is not winner and a.done() and not a.cancelled() and a.exception() is None]
+        info["loser"] = others[0].result() if others else None
+        self.tracker.record(key, time.perf_counter() - start)
+        return winner.result(), info
+
+    def summary(self):
+        with self.lock:
+            counts, extra_cost = dict(self.counts), self.extra_cost
+        rate = counts["hedged"] / counts["calls"] if counts["calls"] else 0.0
+        return dict(counts, hedge_rate=rate, extra_cost=extra_cost)
+
+    def report(self):
+        summary = self.summary()
+        print(f"Hedging: {summary['calls']} calls, {summary['hedged']} hedged ({summary['hedge_rate']:.1%}), "
+              f"{summary['hedge_wins']} won by the duplicate, {summary['timeouts']} timed out | "
+              f"extra cost ${summary['extra_cost']:.4f}")
+        return summary
+
+
+def hedge_policy_from_env():
+    # HEDGE_PERCENTILE (e.g. 0.95) turns hedging on; STAGE_TIMEOUTS="grade=300,default=900" sets deadlines
+    percentile = os.environ.get("HEDGE_PERCENTILE")
+    timeouts = os.environ.get("STAGE_TIMEOUTS")
+    if not percentile and not timeouts:
+        return None
+    return HedgePolicy(percentile=float(percentile) if percentile else None,
+                       min_samples=int(os.environ.get("HEDGE_MIN_SAMPLES", 20)),
+                       stage_timeouts=parse_stage_timeouts(timeouts or ""))
+
+
+shared_hedge_policy = hedge_policy_from_env()
@@ -0,0 +1,138 @@
+import functools
+import hashlib
+import json
+
+SUMMARY_PROMPT = ("Summarize the following earlier part of a conversation so it can replace it. Keep every "
+                  "fact, definition, number, question and conclusion that later turns may rely on; drop "
+                  "pleasantries and repetition. Answer with the summary only.\n\n{transcript}")
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+SUMMARY_ACK = "Understood, continuing from that summary."
+
+
+@functools.lru_cache(maxsize=1)
+def _encoder():
+    # tiktoken is optional; without it tokens are estimated at ~4 characters each
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("o200k_base")
+
+
+@functools.lru_cache(maxsize=8192)
+def count_tokens(text):
+    encoder = _encoder()
+    if encoder is None:
+        return len(text) // 4
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def content_text(content):
+    if isinstance(content, str):
+        return content
+    parts = []
+    for block in content:
+        if isinstance(block, dict):
+            parts.append(block.get("text") or json.dumps(block, sort_keys=True, default=str))
+        else:
+            parts.append(str(block))
+    return "\n".join(parts)
+
+
+def count_message_tokens(messages):
+    # a few tokens of per-message framing on top of the content
+    return sum(count_tokens(content_text(m["content"])) + 4 for m in messages)
+
+
+def split_turns(messages):
+    # A turn is a user message plus the replies that follow it
+    turns = []
+    for message in messages:
+        if message["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+class HistoryBudget:
+    # Decides what part of a ChatSession history is sent with each request. The session keeps
+    # the full history (transcripts, resume); only the outgoing messages are trimmed:
+    #   keep_last_turns   send only the pinned first turns plus the last N turns
+    #   max_input_tokens  drop (or summarize) the oldest unpinned turns until the estimate fits
+    #   summarize         replace dropped turns with a model-written summary, cached per prefix
+    def __init__(self, max_input_tokens=None, keep_last_turns=None, keep_first_turns=1, summarize=False):
+        self.max_input_tokens = max_input_tokens
+        self.keep_last_turns = keep_last_turns
+        self.keep_first_turns = keep_first_turns
+        self.summarize = summarize
+        self.summaries = {}
+
+    def describe(self):
+        return (f"max_input_tokens={self.max_input_tokens} keep_last_turns={self.keep_last_turns} "
+                f"keep_first_turns={self.keep_first_turns} summarize={self.summarize}")
+
+    def plan(self, history):
+        # -> (pinned turns, turns to drop or summarize, kept turns); the current prompt's turn is always kept
+        turns = split_turns(history)
+        pinned = turns[:min(self.keep_first_turns, len(turns) - 1)]
+        rest = turns[len(pinned):]
+        cut = 0
+        if self.keep_last_turns is not None:
+            cut = max(0, len(rest) - max(1, self.keep_last_turns))
+        if self.max_input_tokens is not None:
+            pinned_tokens = sum(count_message_tokens(t) for t in pinned)
+            rest_tokens = [count_message_tokens(t) for t in rest]
+            while cut < len(rest) - 1 and pinned_tokens + sum(rest_tokens[cut:]) > self.max_input_tokens:
+                cut += 1
+        return pinned, rest[:cut], rest[cut:]
+
+    def _summary_key(self, dropped):
+        return hashlib.sha256(json.dumps(dropped, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _summary_prompt(self, dropped):
+        transcript = "\n\n".join(f"[{m['role']}]\n{content_text(m['content'])}" for turn in dropped for m in turn)
+        return SUMMARY_PROMPT.format(transcript=transcript)
+
+    def _summary_session(self, session):
+        # Same provider and model, low effort, no budget of its own; the response cache makes
+        # the summary of a given prefix free on later runs
+        return type(session)(session.provider, session.model_name, session.api_key, high_reasoning=False,
+                             cache=session.cache, cache_salt=session.cache_salt, run_id=session.run_id,
+                             stage="history_summary")
+
+    def _assemble(self, history, pinned, dropped, kept, summary):
+        messages = [m for turn in pinned for m in turn]
+        if dropped and summary is not None:
+            messages.append({"role": "user", "content": SUMMARY_PREFIX + summary})
+            messages.append({"role": "assistant", "content": SUMMARY_ACK})
+        messages.extend(m for turn in kept for m in turn)
+        report = {
+            "input_tokens": count_message_tokens(messages),
+            "dropped_turns": len(dropped),
+            "summarized": bool(dropped and summary is not None),
+            "trimmed": messages != history,
+        }
+        # pinned turns and the current prompt are never dropped, so the budget can still be exceeded
+        report["over_budget"] = self.max_input_tokens is not None and report["input_tokens"] > self.max_input_tokens
+        return messages, report
+
+    def apply(self, history, session=None):
+        pinned, dropped, kept = self.plan(history)
+        summary = None
+        if dropped and self.summarize and session is not None:
+            key = self._summary_key(dropped)
+            if key not in self.summaries:
+                self.summaries[key] = self._summary_session(session).send_message(self._summary_prompt(dropped))
+            summary = self.summaries[key]
+        return self._assemble(history, pinned, dropped, kept, summary)
+
+    async def async_apply(self, history, session=None):
+        pinned, dropped, kept = self.plan(history)
+        summary = None
+        if dropped and self.summarize and session is not None:
+            key = self._summary_key(dropped)
+            if key not in self.summaries:
+                summary_session = self._summary_session(session)
+                self.summaries[key] = await summary_session.async_send_message(self._summary_prompt(dropped))
+            summary = self.summaries[key]
+        return self._assemble(history, pinned, dropped, kept, summary)
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+DEFAULT_CORPUS_DIR = "Corpus"
+DEFAULT_INDEX_PATH = os.path.join("Cache", "corpus_index.sqlite")
+# bumped whenever the tables change; an index built by an older version is rebuilt from scratch
+SCHEMA_VERSION = 1
+CORPUS_EXTENSIONS = (".txt", ".md", ".jsonl")
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset((
+    "a an and are as at be but by for from has have in is it its of on or that the this to was were which with "
+    "what when where who why how do does not no can will would should their there these those than then into"
+).split())
+
+# The tool the model sees, in the providers' shared JSON-schema terms (ChatSession wraps it per provider)
+TOOL_NAME = "search"
+TOOL_DESCRIPTION = ("Search the local reference library of science texts. Returns the most relevant passages "
+                    "with their sources. Use short keyword queries.")
+TOOL_PARAMETERS = {
+    "type": "object",
+    "properties": {"query": {"type": "string", "description": "keywords to search for"}},
+    "required": ["query"],
+    "additionalProperties": False,
+}
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _passages(text, passage_words):
+    # paragraphs merged up to passage_words; a longer paragraph is cut into passage_words pieces
+    passages = []
+    current = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        words = paragraph.split()
+        for start in range(0, len(words), passage_words):
+            piece = words[start:start + passage_words]
+            if current and len(current) + len(piece) > passage_words:
+                passages.append(" ".join(current))
+                current = []
+            current.extend(piece)
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+class LocalRetrieval:
+    # BM25 (Okapi) search over a local corpus directory, offered to the models as a "search"
+    # function tool instead of the providers' hosted web search (ChatSession search_backend="local").
+    # .txt/.md files are split into passages of about passage_words words; .jsonl files hold
+    # one passage per line ({"text", "source"}). The inverted index lives in SQLite and is
+    # rebuilt only when a corpus file or an indexing parameter changes (the fingerprint), so
+    # the same query returns the same passages in every run. Results are cached per query
+    # (its terms, in any order) in an in-memory LRU.
+    def __init__(self, corpus_dir=DEFAULT_CORPUS_DIR, index_path=DEFAULT_INDEX_PATH, top_k=5, k1=1.5, b=0.75,
+                 passage_words=200, cache_size=4096):
+        self.corpus_dir = corpus_dir
+        self.index_path = index_path
+        self.top_k = top_k
+        self.k1 = k1
+        self.b = b
+        self.passage_words = passage_words
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.conn = None
+        self.lock = threading.Lock()
+        self._fingerprint = None
+        self.searches = 0
+        self.hits = 0
+        self.search_seconds = 0.0
+
+    def _corpus_files(self):
+        files = []
+        for root, dirs, names in os.walk(self.corpus_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            files.extend(os.path.join(root, name) for name in sorted(names)
+                         if name.endswith(CORPUS_EXTENSIONS) and not name.startswith("."))
+        return files
+
+    def fingerprint(self):
+        # corpus file names, sizes and mtimes plus the indexing parameters; part of ChatSession's
+        # response cache key, so a changed corpus never serves answers built on the old one
+        if self._fingerprint is None:
+            digest = hashlib.sha256(json.dumps([self.passage_words, self.k1, self.b, self.top_k]).encode("utf-8"))
+            for path in self._corpus_files():
+                stat = os.stat(path)
+                digest.update(f"{os.path.relpath(path, self.corpus_dir)}:{stat.st_size}:{stat.st_mtime_ns}\n"
+                              .encode("utf-8"))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def _read_passages(self, path):
+        source = os.path.relpath(path, self.corpus_dir)
+        with open(path, encoding="utf-8") as f:
+            if not path.endswith(".jsonl"):
+                return [(source, passage) for passage in _passages(f.read(), self.passage_words)]
+            passages = []
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    entry = json.loads(line)
+                    passages.append((entry.get("source") or entry.get("title") or f"{source}:{number}", entry["text"]))
+            return passages
+
+    def _connect(self):
+        # caller holds the lock; opened (and built if stale) on the first search
+        if self.conn is not None:
+            return self.conn
+        if not os.path.isdir(self.corpus_dir):
+            raise FileNotFoundError(f"Local search corpus '{self.corpus_dir}' does not exist "
+                                    f"(set LOCAL_SEARCH_CORPUS or create it)")
+        directory = os.path.dirname(self.index_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        row = None
+        if version == SCHEMA_VERSION:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != self.fingerprint():
+            self._build(conn)
+        self.conn = conn
+        return conn
+
+    def _build(self, conn):
+        start = time.perf_counter()
+        passages = []
+        for path in self._corpus_files():
+            passages.extend(self._read_passages(path))
+        postings = []
+        document_frequency = defaultdict(int)
+        lengths = []
+        for passage_id, (_, text) in enumerate(passages):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.append((term, passage_id, tf))
+                document_frequency[term] += 1
+        with conn:
+            for table in ("meta", "passages", "postings", "terms"):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("CREATE TABLE passages (id INTEGER PRIMARY KEY, source TEXT, text TEXT, length INTEGER)")
+            conn.execute("CREATE TABLE postings (term TEXT, passage INTEGER, tf INTEGER)")
+            conn.execute("CREATE TABLE terms (term TEXT PRIMARY KEY, df INTEGER)")
+            conn.executemany("INSERT INTO passages VALUES (?, ?, ?, ?)",
+                             ((i, source, text, lengths[i]) for i, (source, text) in enumerate(passages)))
+            conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+            conn.executemany("INSERT INTO terms VALUES (?, ?)", document_frequency.items())
+            conn.execute("CREATE INDEX postings_term ON postings(term)")
+            average = sum(lengths) / len(lengths) if lengths else 0.0
+            conn.executemany("INSERT INTO meta VALUES (?, ?)", [("fingerprint", self.fingerprint()),
+                                                                ("passages", str(len(passages))),
+                                                                ("average_length", str(average))])
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        print(f"--- [Local search: indexed {len(passages)} passages from '{self.corpus_dir}' "
+              f"in {time.perf_counter() - start:.1f}s] ---")
+
+    def _score(self, conn, terms, top_k):
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        total, average = int(meta["passages"]), float(meta["average_length"]) or 1.0
+        scores = defaultdict(float)
+        for term in terms:
+            row = conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+            if row is None:
+                continue
+            idf = math.log(1 + (total - row[0] + 0.5) / (row[0] + 0.5))
+            for passage, tf, length in conn.execute(
+                    "SELECT p.passage, p.tf, d.length FROM postings p JOIN passages d ON d.id = p.passage "
+                    "WHERE p.term = ?", (term,)):
+                scores[passage] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / average))
+        # ties broken by passage id: identical queries always get identical results
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+        results = []
+        for passage, score in ranked:
+            source, text = conn.execute("SELECT source, text FROM passages WHERE id = ?", (passage,)).fetchone()
+            results.append({"source": source, "text": text, "score": round(score, 4)})
+        return results
+
+    def search(self, query, top_k=None):
+        # -> [{"source", "text", "score"}], best first
+        top_k = top_k or self.top_k
+        key = (tuple(sorted(set(tokenize(query)))), top_k)
+        start = time.perf_counter()
+        with self.lock:
+            self.searches += 1
+            results = self.cache.get(key)
+            if results is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+            else:
+                results = self._score(self._connect(), key[0], top_k) if key[0] else []
+                self.cache[key] = results
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            self.search_seconds += time.perf_counter() - start
+        return results
+
+    def run_tool(self, name, arguments):
+        # arguments: a JSON string (OpenAI function calls) or a dict (Anthropic tool_use input)
+        if name != TOOL_NAME:
+            return f"Unknown tool {name!r}"
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments)
+            except json.JSONDecodeError:
+                arguments = {"query": arguments}
+        query = str((arguments or {}).get("query", ""))
+        results = self.search(query)
+        print(f"🔎 [Local search] {query!r}: {len(results)} passages")
+        if not results:
+            return f"No passages found for {query!r}."
+        return "\n\n".join(f"[{i}] {result['source']}\n{result['text']}" for i, result in enumerate(results, 1))
+
+    def stats(self):
+        with self.lock:
+            return {"searches": self.searches, "cache_hits": self.hits, "search_seconds": self.search_seconds,
+                    "corpus": self.corpus_dir, "index": self.index_path}
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+_default_retrieval = None
+
+
+def get_default_retrieval():
+    # corpus and index location can be switched per run without code changes
+    global _default_retrieval
+    if _default_retrieval is None:
+        _default_retrieval = LocalRetrieval(
+            corpus_dir=os.environ.get("LOCAL_SEARCH_CORPUS", DEFAULT_CORPUS_DIR),
+            index_path=os.environ.get("LOCAL_SEARCH_INDEX", DEFAULT_INDEX_PATH),
+        )
+    return _default_retrieval
+
+
+def resolve_search_backend(search_backend):
+    # "hosted" (or None): the providers' web search tools; "local": the default LocalRetrieval;
+    # or any object with fingerprint() and run_tool(name, arguments)
+    if search_backend in (None, "hosted"):
+        return None
+    if search_backend == "local":
+        return get_default_retrieval()
+    if isinstance(search_backend, str):
+        raise ValueError(f"Unknown search backend {search_backend!r}, expected 'hosted' or 'local'")
+    return search_backend
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import types
+
+# Offline stand-in for the OpenAI Responses API, used by ChatSession as provider "mock".
+# Completions, usage and VERDICT lines (or JSON grades, for requests with a json_schema text
+# format) are a pure function of the request; latency, 5xx
+# errors and 429s are drawn from a generator seeded by the request and how often it was
+# already sent, so a run replays identically however its calls interleave.
+
+WORDS = ("energy", "molecule", "cell", "force", "reaction", "protein", "field", "charge", "membrane",
+         "equilibrium", "gradient", "enzyme", "particle", "bond", "signal", "pressure", "wave", "gene")
+RUBRIC_ITEM_PATTERN = re.compile(r"Points:\s*(\d+(?:\.\d+)?),\s*Item:\s*([^\n]*)")
+# RubricGrader's single-item prompts
+ITEM_WORTH_PATTERN = re.compile(r"item worth (\d+(?:\.\d+)?) points")
+
+
+class MockRateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__(f"mock rate limit, retry after {retry_after}s")
+        self.response = types.SimpleNamespace(headers={"retry-after": str(retry_after)})
+
+
+class MockServerError(Exception):
+    status_code = 500
+
+    def __init__(self):
+        super().__init__("mock internal server error")
+        self.response = types.SimpleNamespace(headers={})
+
+
+class MockSettings:
+    # latency: lognormal around latency_median seconds; error_rate / rate_limit_rate: share of
+    # calls failing with a 500 / 429; output_words: length of every completion
+    def __init__(self, latency_median=0.05, latency_sigma=0.5, stream_chunk_delay=0.0, error_rate=0.0,
+                 rate_limit_rate=0.0, retry_after=0.05, output_words=200, seed=0):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.stream_chunk_delay = stream_chunk_delay
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.output_words = output_words
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.calls = 0
+        self.failures = 0
+
+    def configure(self, **settings):
+        for name, value in settings.items():
+            if not hasattr(self, name) or name in ("lock", "attempts", "calls", "failures"):
+                raise ValueError(f"Unknown mock setting {name!r}")
+            setattr(self, name, type(getattr(self, name))(value))
+
+    def configure_from_string(self, text):
+        # "latency_median=0.2,error_rate=0.01", e.g. from the MOCK_PROVIDER environment variable
+        self.configure(**dict(item.split("=", 1) for item in text.split(",") if item.strip()))
+
+    def draw(self, digest):
+        # -> (latency, error or None) for this request's next attempt
+        with self.lock:
+            attempt = self.attempts.get(digest, 0)
+            self.attempts[digest] = attempt + 1
+            self.calls += 1
+        rng = random.Random(f"{self.seed}:{digest}:{attempt}")
+        latency = rng.lognormvariate(math.log(max(self.latency_median, 1e-6)), self.latency_sigma)
+        roll = rng.random()
+        error = None
+        if roll < self.rate_limit_rate:
+            error = MockRateLimitError(self.retry_after)
+        elif roll < self.rate_limit_rate + self.error_rate:
+            error = MockServerError()
+        if error is not None:
+            with self.lock:
+                self.failures += 1
+        return latency, error
+
+
+mock_settings = MockSettings()
+if os.environ.get("MOCK_PROVIDER"):
+    mock_settings.configure_from_string(os.environ["MOCK_PROVIDER"])
+
+
+def _request_digest(request):
+    material = json.dumps({key: request.get(key) for key in ("model", "input", "previous_response_id", "tool_choice",
+                                                             "text")},
+                          sort_keys=True, default=str)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _structured_grade(request, rng):
+    # JSON grade for grading_schema(): one entry per "Points: X, Item: ..." of the prompt's rubric,
+    # or for RubricGrader's ITEM_SCHEMA: the points of the one item in the prompt
+    schema = request["text"]["format"]["schema"]
+    prompt = "\n".join(m["content"] for m in request.get("input") or [] if isinstance(m.get("content"), str))
+    if "items" not in schema["properties"]:
+        worth = ITEM_WORTH_PATTERN.search(prompt)
+        max_points = float(worth.group(1)) if worth else 1.0
+        return json.dumps({"points": rng.randint(0, int(max_points * 2)) / 2,
+                           "rationale": " ".join(rng.choice(WORDS) for _ in range(8))})
+    with_rationale = "rationale" in schema["properties"]["items"]["items"]["properties"]
+    items = []
+    for max_points, label in RUBRIC_ITEM_PATTERN.findall(prompt):
+        max_points = float(max_points)
+        item = {"item": label.split(" - ")[0].strip()[:60], "max_points": max_points,
+                "points": rng.randint(0, int(max_points * 2)) / 2}
+        if with_rationale:
+            item["rationale"] = " ".join(rng.choice(WORDS) for _ in range(8))
+        items.append(item)
+    return json.dumps({"items": items, "total": sum(item["points"] for item in items)})
+
+
+def _search_call(request, digest, rng):
+    # ChatSession's local search tool: the first turn of a request offering it usually calls it
+    # (always when forced), with keywords from the prompt; the turn after its results answers
+    tools = [tool for tool in request.get("tools") or [] if tool.get("type") == "function"]
+    inputs = request.get("input") or []
+    if not tools or request.get("tool_choice") == "none":
+        return None
+    if any(item.get("type") == "function_call_output" for item in inputs if isinstance(item, dict)):
+        return None
+    if request.get("tool_choice") == "auto" and rng.random() < 0.3:
+        return None
+    prompt = next((m["content"] for m in reversed(inputs) if isinstance(m.get("content"), str)), "")
+    keywords = re.findall(r"[A-Za-z]{5,}", prompt)[:6] or [rng.choice(WORDS)]
+    return types.SimpleNamespace(type="function_call", call_id=f"call_{digest[:12]}", name=tools[0]["name"],
+                                 arguments=json.dumps({"query": " ".join(keywords)}))
+
+
+def _build_response(request, digest, settings):
+    rng = random.Random(digest)
+    words = [rng.choice(WORDS) for _ in range(settings.output_words)]
+    structured = (request.get("text") or {}).get("format", {}).get("type") == "json_schema"
+    if structured:
+        text = _structured_grade(request, rng)
+    else:
+        verdict = int(digest[:8], 16) % 11
+        text = " ".join(words) + f"\n\nVERDICT: {verdict}"
+    output = []
+    web_search = any(tool.get("type") == "web_search" for tool in request.get("tools") or [])
+    if request.get("tool_choice") == {"type": "web_search"} or (web_search and rng.random() < 0.3):
+        output.append(types.SimpleNamespace(type="web_search_call", query=" ".join(words[:3])))
+    output.append(types.SimpleNamespace(type="message"))
+    output_tokens = len(text) // 4 if structured else int(settings.output_words * 1.3) + 5
+    search_call = _search_call(request, digest, rng)
+    if search_call is not None:
+        output, text, output_tokens = [search_call], "", len(search_call.arguments) // 4 + 10
+    input_chars = len(json.dumps(request.get("input"), default=str))
+    usage = types.SimpleNamespace(
+        input_tokens=input_chars // 4,
+        output_tokens=output_tokens,
+        input_tokens_details=types.SimpleNamespace(cached_tokens=0),
+        output_tokens_details=types.SimpleNamespace(reasoning_tokens=output_tokens // 3),
+    )
+    return types.SimpleNamespace(id=f"mock_{digest[:16]}", output=output, output_text=text, usage=usage)
+
+
+class MockRawResponse:
+    # Same shape as the SDKs' with_raw_response results: rate-limit headers plus parse()
+    headers = {
+        "x-ratelimit-limit-requests": "10000", "x-ratelimit-remaining-requests": "9999",
+        "x-ratelimit-reset-requests": "6ms",
+        "x-ratelimit-limit-tokens": "10000000", "x-ratelimit-remaining-tokens": "9999000",
+        "x-ratelimit-reset-tokens": "6ms",
+    }
+
+    def __init__(self, response):
+        self.response = response
+
+    def parse(self):
+        return self.response
+
+
+def _events(response):
+    words = response.output_text.split(" ")
+    for i, word in enumerate(words):
+        yield types.SimpleNamespace(type="response.output_text.delta", delta=word if i == 0 else " " + word)
+    yield types.SimpleNamespace(type="response.completed", response=response)
+
+
+class MockStream:
+    def __init__(self, response, chunk_delay):
+        self.events = _events(response)
+        self.chunk_delay = chunk_delay
+
+    def __iter__(self):
+        for event in self.events:
+            if self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            yield event
+
+    def close(self):
+        self.events.close()
+
+
+class AsyncMockStream(MockStream):
+    async def _aiter(self):
+        import asyncio
+        for event in self.events:
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            yield event
+
+    def __aiter__(self):
+        return self._aiter()
+
+    async def close(self):
+        self.events.close()
+
+
+class MockResponses:
+    def __init__(self, settings):
+        self.settings = settings
+        self.with_raw_response = self
+
+    def create(self, stream=False, **request):
+        digest = _request_digest(request)
+        latency, error = self.settings.draw(digest)
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        response = _build_response(request, digest, self.settings)
+        return MockStream(response, self.settings.stream_chunk_delay) if stream else MockRawResponse(response)
+
+
+class AsyncMockResponses(MockResponses):
+    async def create(self, stream=False, **request):
+        import asyncio
+        digest = _request_digest(request)
+        latency, error = self.settings.draw(digest)
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        response = _build_response(request, digest, self.settings)
+        return AsyncMockStream(response, self.settings.stream_chunk_delay) if stream else MockRawResponse(response)
+
+
+class MockClient:
+    def __init__(self, settings=None):
+        self.responses = MockResponses(settings or mock_settings)
+
+
+class AsyncMockClient:
+    def __init__(self, settings=None):
+        self.responses = AsyncMockResponses(settings or mock_settings)
@@ -0,0 +1,149 @@
+import json
+import mmap
+import os
+import random
+from collections import defaultdict
+
+INDEX_VERSION = 1
+
+
+class ProblemDataset:
+    # Lazily-loaded view of a JSONL problem file. A byte-offset index (with subject and
+    # task_group_id per record) is built once and stored next to the data as
+    # <path>.index.json; the cleaned problem texts go to <path>.clean.jsonl. Both are rebuilt
+    # when the data file changes. Problems are parsed from a memory map only when accessed.
+    def __init__(self, path="test.json"):
+        self.path = path
+        self.index_path = f"{path}.index.json"
+        self.clean_path = f"{path}.clean.jsonl"
+        self.entries = None
+        self.data_map = None
+        self.clean_map = None
+        self._files = []
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        index = self._read_index()
+        if index is None:
+            index = self._build_index()
+        self.entries = index["entries"]
+        self.data_map = self._map(self.path)
+        self.clean_map = self._map(self.clean_path)
+
+    def _source_stamp(self):
+        stat = os.stat(self.path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path) or not os.path.exists(self.clean_path):
+            return None
+        with open(self.index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") != INDEX_VERSION or index.get("source") != self._source_stamp():
+            return None
+        return index
+
+    def _build_index(self):
+        # imported here: PromptFactory itself builds a ProblemDataset
+        from PromptFactory import clean_problem
+        entries = []
+        offset = 0
+        clean_offset = 0
+        # per-process temp files: several sweep workers may build the same index at once
+        clean_tmp_path = f"{self.clean_path}.{os.getpid()}.tmp"
+        with open(self.path, "rb") as data, open(clean_tmp_path, "wb") as clean:
+            for line in data:
+                if line.strip():
+                    record = json.loads(line)
+                    cleaned = (json.dumps(clean_problem(record["problem"]), ensure_ascii=False) + "\n").encode("utf-8")
+                    clean.write(cleaned)
+                    entries.append({
+                        "offset": offset,
+                        "length": len(line),
+                        "clean_offset": clean_offset,
+                        "clean_length": len(cleaned),
+                        "subject": record.get("subject"),
+                        "task_group_id": record.get("task_group_id"),
+                    })
+                    clean_offset += len(cleaned)
+                offset += len(line)
+        index = {"version": INDEX_VERSION, "source": self._source_stamp(), "entries": entries}
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(clean_tmp_path, self.clean_path)
+        os.replace(tmp_path, self.index_path)
+        print(f"Indexed {len(entries)} problems from {self.path}")
+        return index
+
+    def _map(self, path):
+        f = open(path, "rb")
+        self._files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        self._load()
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        self._load()
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self.entries)))]
+        entry = self.entries[i]
+        problem_d = json.loads(self.data_map[entry["offset"]:entry["offset"] + entry["length"]])
+        problem_d["clean_problem"] = self.clean_problem(i)
+        return problem_d
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def clean_problem(self, i):
+        # Same text as clean_problem(problem["problem"]) without parsing the full record
+        self._load()
+        entry = self.entries[i]
+        start = entry["clean_offset"]
+        return json.loads(self.clean_map[start:start + entry["clean_length"]])
+
+    def indices(self, subject=None, task_group_id=None):
+        self._load()
+        return [i for i, entry in enumerate(self.entries)
+                if (subject is None or entry["subject"] == subject)
+                and (task_group_id is None or entry["task_group_id"] == task_group_id)]
+
+    def by_subject(self, subject):
+        return [self[i] for i in self.indices(subject=subject)]
+
+    def by_task_group(self, task_group_id):
+        return [self[i] for i in self.indices(task_group_id=task_group_id)]
+
+    def subjects(self):
+        self._load()
+        return sorted({entry["subject"] for entry in self.entries})
+
+    def sample_indices_by_subject(self, n, seed=None):
+        # Up to n random problem indices per subject, chosen from the index without parsing the rest
+        self._load()
+        by_subject = defaultdict(list)
+        for i, entry in enumerate(self.entries):
+            by_subject[entry["subject"]].append(i)
+        rng = random.Random(seed)
+        chosen = []
+        for subject in sorted(by_subject):
+            chosen.extend(rng.sample(by_subject[subject], min(n, len(by_subject[subject]))))
+        return chosen
+
+    def sample_by_subject(self, n, seed=None):
+        return [self[i] for i in self.sample_indices_by_subject(n, seed)]
+
+    def close(self):
+        for m in (self.data_map, self.clean_map):
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in self._files:
+            f.close()
+        self._files = []
+        self.entries = None
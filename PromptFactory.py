@@ -21,6 +21,58 @@ First, think step-by-step about each rubric item. Explain your reasoning for eac
 Then, tally the points up and write VERDICT: ¡total˙points¿ in the last line of your response, \
 no other text. For example, VERDICT: 2.5 or VERDICT: 8."
 
+# Structured grading: same instructions, but the answer is JSON constrained by grading_schema(),
+# one entry per rubric item plus the total, instead of free-text reasoning and a VERDICT line
+STRUCTURED_GRADING_TEMPLATE = "You are grading a science exam.\n\
+You will be given the problem, attempted answer, and a rubric to grade the answer. The rubric \
+will total up to 10 points and lists its items as \"Points: X, Item: ...\".\n\
+Evaluate the attemped answer against the provided rubric. Pay close attention to detail and \
+grade it strictly, but fairly. Only evaluate against the rubric, as you yourself should not make \
+any judgements (e.g., even if you think the answer is correct but rubric is wrong, you should \
+treat the rubric as the gold standard). *** \n\
+The problem: {problem} \
+***\n\
+The rubric: {rubric}\
+***\n\
+The attempted answer: {answer}\
+***\n\n\
+Respond only with JSON: one entry in \"items\" per rubric item, in rubric order, with a short \
+label, the item's max_points and the points earned (it can be a decimal based on the rubric), and \
+\"total\", the sum of the points earned.{rationale}"
+STRUCTURED_RATIONALE = " Give each item a rationale of at most one sentence."
+
+
+def grading_schema(rationale=True):
+    # JSON schema for structured grading (strict: every property required, nothing extra)
+    item_properties = {
+        "item": {"type": "string"},
+        "max_points": {"type": "number"},
+        "points": {"type": "number"},
+    }
+    if rationale:
+        item_properties["rationale"] = {"type": "string"}
+    return {
+        "name": "rubric_grade",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "items": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": item_properties,
+                        "required": list(item_properties),
+                        "additionalProperties": False,
+                    },
+                },
+                "total": {"type": "number"},
+            },
+            "required": ["items", "total"],
+            "additionalProperties": False,
+        },
+    }
+
 
 def clean_problem(raw_text, remove_cot = True):
     # 1. Remove the "Context:" and "Question:" labels
@@ -62,17 +114,23 @@ class PromptFactory:
     def get_grading_prompt(problem, rubric, answer):
         return GRADING_TEMPLATE.format(problem=problem, rubric=rubric, answer=answer)
 
+    @staticmethod
+    def get_structured_grading_prompt(problem, rubric, answer, rationale=True):
+        # send with ChatSession(response_schema=grading_schema(rationale))
+        return STRUCTURED_GRADING_TEMPLATE.format(problem=problem, rubric=rubric, answer=answer,
+                                                  rationale=STRUCTURED_RATIONALE if rationale else "")
+
 
 
-import json
+from ProblemDataset import ProblemDataset
 
 
 
 
 test_json_path = "test.json"
 
-with open(test_json_path, "r", encoding="utf-8") as f:
-    problem_dicts = [json.loads(line) for line in f if line.strip()]
+# lazy: nothing is read until a problem is accessed
+problem_dicts = ProblemDataset(test_json_path)
 
 
 # prompt = PromptFactory.get_projection_prompt(problem_dicts[30])
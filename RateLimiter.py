@@ -0,0 +1,257 @@
+import random
+import re
+import threading
+import time
+
+# Status codes worth retrying; 529 is Anthropic's "overloaded"
+TRANSIENT_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+TRANSIENT_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "InternalServerError", "OverloadedError"}
+
+
+class DeadlineExceeded(TimeoutError):
+    # A transient error that was not retried because the retry would start after the caller's deadline
+    pass
+
+
+class TokenBucket:
+    def __init__(self, capacity, per_minute):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        # Debit right away (the level may go negative) so concurrent callers queue up in order,
+        # and return how long this caller has to wait before its reservation is covered
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        self.level -= amount
+        if self.level >= 0:
+            return 0.0
+        return -self.level / self.rate
+
+    def credit(self, amount, now):
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+    def sync(self, limit, remaining, reset_seconds, now):
+        # Trust the server's view of our quota over the local estimate
+        if limit:
+            self.capacity = limit
+            self.rate = limit / 60.0
+        if remaining is not None:
+            self._refill(now)
+            self.level = min(self.level, remaining)
+            if reset_seconds and remaining <= 0:
+                self.level = min(self.level, -reset_seconds * self.rate)
+
+
+class RateLimiter:
+    # Requests / tokens per minute; overridden by whatever the rate-limit headers report
+    DEFAULT_LIMITS = {
+        "openai": {"rpm": 500, "tpm": 500_000},
+        "anthropic": {"rpm": 50, "tpm": 80_000},
+        "mock": {"rpm": 10_000, "tpm": 10_000_000},
+    }
+
+    def __init__(self, limits=None, max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.limits = dict(self.DEFAULT_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.buckets = {}
+        self.blocked_until = {}
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def _get_buckets(self, provider, model):
+        key = (provider, model)
+        if key not in self.buckets:
+            limits = self.limits.get(key, self.limits.get(provider, {"rpm": 60, "tpm": 100_000}))
+            self.buckets[key] = (TokenBucket(limits["rpm"], limits["rpm"]), TokenBucket(limits["tpm"], limits["tpm"]))
+        return self.buckets[key]
+
+    def reserve(self, provider, model, tokens):
+        with self.lock:
+            now = time.monotonic()
+            requests, token_bucket = self._get_buckets(provider, model)
+            wait = max(requests.reserve(1, now), token_bucket.reserve(tokens, now))
+            blocked = self.blocked_until.get((provider, model), 0) - now
+            return max(wait, blocked)
+
+    def acquire(self, provider, model, tokens):
+        wait = self.reserve(provider, model, tokens)
+        if wait > 0:
+            print(f"   [rate limit] waiting {wait:.1f}s for {provider}/{model}")
+            time.sleep(wait)
+
+    async def async_acquire(self, provider, model, tokens):
+        import asyncio
+        wait = self.reserve(provider, model, tokens)
+        if wait > 0:
+            print(f"   [rate limit] waiting {wait:.1f}s for {provider}/{model}")
+            await asyncio.sleep(wait)
+
+    def record_usage(self, provider, model, estimated_tokens, usage):
+        if usage is None:
+            return
+        actual = (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0)
+        with self.lock:
+            token_bucket = self._get_buckets(provider, model)[1]
+            # Give back (or take) the difference between the estimate and the billed tokens
+            token_bucket.credit(estimated_tokens - actual, time.monotonic())
+
+    def update_from_headers(self, provider, model, headers):
+        if not headers:
+            return
+        with self.lock:
+            now = time.monotonic()
+            requests, token_bucket = self._get_buckets(provider, model)
+            # MockProvider sends OpenAI-style headers
+            if provider in ("openai", "mock"):
+                requests.sync(_int(headers.get("x-ratelimit-limit-requests")),
+                              _int(headers.get("x-ratelimit-remaining-requests")),
+                              _duration(headers.get("x-ratelimit-reset-requests")), now)
+                token_bucket.sync(_int(headers.get("x-ratelimit-limit-tokens")),
+                                  _int(headers.get("x-ratelimit-remaining-tokens")),
+                                  _duration(headers.get("x-ratelimit-reset-tokens")), now)
+            elif provider == "anthropic":
+                requests.sync(_int(headers.get("anthropic-ratelimit-requests-limit")),
+                              _int(headers.get("anthropic-ratelimit-requests-remaining")),
+                              _timestamp(headers.get("anthropic-ratelimit-requests-reset")), now)
+                token_bucket.sync(_int(headers.get("anthropic-ratelimit-tokens-limit")),
+                                  _int(headers.get("anthropic-ratelimit-tokens-remaining")),
+                                  _timestamp(headers.get("anthropic-ratelimit-tokens-reset")), now)
+
+    def block(self, provider, model, seconds):
+        with self.lock:
+            key = (provider, model)
+            self.blocked_until[key] = max(self.blocked_until.get(key, 0), time.monotonic() + seconds)
+
+    def _retry_delay(self, error, attempt, provider, model, stats=None, deadline=None):
+        # Returns None when the error should not be retried; raises DeadlineExceeded when the retry
+        # would start after deadline (time.monotonic(), e.g. a HedgePolicy stage deadline)
+        status = getattr(error, "status_code", None)
+        if status not in TRANSIENT_STATUS_CODES and type(error).__name__ not in TRANSIENT_ERROR_NAMES:
+            return None
+        if attempt >= self.max_retries:
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        retry_after = retry_after_seconds(headers)
+        if retry_after is not None:
+            # Everybody using this model waits, not only the caller that got the 429
+            self.block(provider, model, retry_after)
+            delay = max(delay, retry_after)
+        self.update_from_headers(provider, model, headers)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            raise DeadlineExceeded(f"{provider}/{model}: {type(error).__name__} (status {status}) not retried, "
+                                   f"the deadline passes within {delay:.1f}s") from error
+        self.retries += 1
+        if stats is not None:
+            stats["retries"] = stats.get("retries", 0) + 1
+        print(f"   [retry {attempt + 1}/{self.max_retries}] {provider}/{model}: {type(error).__name__} "
+              f"(status {status}), sleeping {delay:.1f}s")
+        return delay
+
+    def _finish(self, provider, model, tokens, result):
+        # Raw SDK responses carry the rate-limit headers; parse() gives the usual response object
+        if hasattr(result, "parse") and hasattr(result, "headers"):
+            self.update_from_headers(provider, model, result.headers)
+            result = result.parse()
+        self.record_usage(provider, model, tokens, getattr(result, "usage", None))
+        return result
+
+    def call(self, provider, model, tokens, request_func, stats=None, deadline=None):
+        attempt = 0
+        while True:
+            self.acquire(provider, model, tokens)
+            try:
+                result = request_func()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, provider, model, stats, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            return self._finish(provider, model, tokens, result)
+
+    async def async_call(self, provider, model, tokens, request_func, stats=None, deadline=None):
+        import asyncio
+        attempt = 0
+        while True:
+            await self.async_acquire(provider, model, tokens)
+            try:
+                result = await request_func()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, provider, model, stats, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            return self._finish(provider, model, tokens, result)
+
+
+def retry_after_seconds(headers):
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _duration(value):
+    # OpenAI reset headers look like "1s", "6m0s" or "120ms"
+    if not value:
+        return None
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+
+def _timestamp(value):
+    # Anthropic reset headers are RFC 3339 timestamps
+    if not value:
+        return None
+    try:
+        from datetime import datetime
+        reset = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return max(0.0, reset.timestamp() - time.time())
+
+
+# One limiter for the whole process, so every ChatSession (grading sessions included) shares quota
+shared_limiter = RateLimiter()
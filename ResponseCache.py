@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# read_only: serve hits but never store (reproduce an earlier sweep)
+# write_through: serve hits and store new responses
+# bypass: ignore the cache completely (fresh sampling)
+CACHE_MODES = ("read_only", "write_through", "bypass")
+
+DEFAULT_CACHE_PATH = os.path.join("Cache", "responses.sqlite")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, mode="write_through", max_bytes=DEFAULT_MAX_BYTES):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {CACHE_MODES}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        # Opened lazily so that creating a ChatSession never touches the disk by itself
+        if self.conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, provider TEXT, model TEXT, response TEXT, "
+                "size INTEGER, created REAL, last_access REAL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses(last_access)")
+        return self.conn
+
+    @staticmethod
+    def make_key(provider, model_name, history, effort, web_enabled, force_search, salt="", response_schema=None,
+                 search_corpus=None):
+        fields = {
+            "provider": provider,
+            "model": model_name,
+            "history": history,
+            "effort": effort,
+            "web_enabled": web_enabled,
+            "force_search": force_search,
+            "salt": salt,
+        }
+        # only keyed when set, so free-text responses keep their existing keys
+        if response_schema is not None:
+            fields["response_schema"] = response_schema
+        # local search (LocalRetrieval.fingerprint()) answers from a corpus, not the web
+        if search_corpus is not None:
+            fields["search_corpus"] = search_corpus
+        payload = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        if self.mode == "bypass":
+            return None
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, provider, model_name, response):
+        if self.mode != "write_through":
+            return
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model_name, response, size, now, now),
+            )
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn):
+        # Least-recently-used eviction down to 90% of the size cap
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        rows = conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= target:
+                break
+            evicted.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self):
+        with self.lock:
+            count, total = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": count, "bytes": total, "hits": self.hits, "misses": self.misses, "mode": self.mode}
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    # Mode and location can be switched per run without code changes
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache(
+            path=os.environ.get("RESPONSE_CACHE_PATH", DEFAULT_CACHE_PATH),
+            mode=os.environ.get("RESPONSE_CACHE_MODE", "write_through"),
+        )
+    return _default_cache
+
+
+def set_default_cache(cache):
+    global _default_cache
+    _default_cache = cache
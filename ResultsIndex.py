@@ -0,0 +1,216 @@
+import json
+import os
+import re
+import sqlite3
+
+DEFAULT_INDEX_PATH = "results_index.sqlite"
+# bumped whenever the tables change; an index built by an older version is rebuilt from scratch
+SCHEMA_VERSION = 3
+
+VERDICT_PATTERN = re.compile(r"VERDICT:\s*(\d+\.?\d*)")
+JSON_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+# {provider}_{model}_{subject}_{id}_{web_text}.txt as built by full_pipeline (save_suffix),
+# with the "high_reasoning_" prefix of default grades and the "_clean" suffix of clean-chat grades;
+# web_local marks runs searching the local corpus (search_backend="local") instead of the web
+SAVE_SUFFIX_PATTERN = re.compile(
+    r"^(?:high_reasoning_)?(?P<provider>openai|anthropic|mock)_(?P<model>.+?)_(?P<subject>biology|physics|chemistry)_"
+    r"(?P<problem_id>\d+)_(?P<web>web_enabled|web_disabled|web_local)\.txt(?P<clean>_clean)?$"
+)
+# Grading directory -> what was graded
+DIRECTORY_VARIANTS = {
+    "Grading projection": "projection",
+    "Grading from projection": "reprojection_keep",
+    "Grading default": "default",
+    "Grading from files": "file",
+}
+
+COLUMNS = ("path", "directory", "filename", "mtime", "size", "verdict", "provider", "model", "subject",
+           "problem_id", "web_enabled", "search", "variant", "format")
+GROUPABLE = ("directory", "provider", "model", "subject", "problem_id", "web_enabled", "search", "variant", "format")
+ITEM_COLUMNS = ("path", "position", "item", "max_points", "points", "rationale")
+
+
+def _number(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _parse_json_grade(text):
+    text = text.strip()
+    fenced = JSON_FENCE_PATTERN.match(text)
+    if fenced:
+        text = fenced.group(1)
+    if not text.startswith("{"):
+        return None
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    items = []
+    for entry in data.get("items") or []:
+        if isinstance(entry, dict) and _number(entry.get("points")) is not None:
+            items.append({"item": str(entry.get("item", "")), "max_points": _number(entry.get("max_points")),
+                          "points": _number(entry.get("points")), "rationale": entry.get("rationale")})
+    # the item points are the grade; the model's own total is only used when there are none
+    verdict = sum(item["points"] for item in items) if items else _number(data.get("total"))
+    if verdict is None:
+        return None
+    return {"verdict": verdict, "items": items, "format": "json"}
+
+
+def parse_grade(text):
+    # Structured (JSON schema) grades first, then the VERDICT line of free-text grades;
+    # -> {"verdict", "items", "format"}, verdict None when neither is found
+    grade = _parse_json_grade(text)
+    if grade is not None:
+        return grade
+    match = VERDICT_PATTERN.search(text)
+    if match:
+        return {"verdict": float(match.group(1)), "items": [], "format": "verdict"}
+    return {"verdict": None, "items": [], "format": None}
+
+
+def parse_grading_filename(directory, filename):
+    folder = os.path.basename(os.path.normpath(directory))
+    variant = DIRECTORY_VARIANTS.get(folder, folder)
+    match = SAVE_SUFFIX_PATTERN.match(filename)
+    if not match:
+        return {"provider": None, "model": None, "subject": None, "problem_id": None, "web_enabled": None,
+                "search": None, "variant": variant}
+    if match.group("clean") and variant == "reprojection_keep":
+        variant = "reprojection_clean"
+    return {
+        "provider": match.group("provider"),
+        "model": match.group("model"),
+        "subject": match.group("subject"),
+        "problem_id": int(match.group("problem_id")),
+        "web_enabled": int(match.group("web") != "web_disabled"),
+        "search": {"web_enabled": "hosted", "web_local": "local"}.get(match.group("web"), "off"),
+        "variant": variant,
+    }
+
+
+class ResultsIndex:
+    # SQLite index of grading files. ingest() only re-reads files whose mtime or size changed,
+    # so re-running it is cheap and never duplicates rows; verdicts and the metadata parsed from
+    # the file name are typed columns that can be grouped directly.
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            # every row can be re-read from the grading files, so an old index is simply rebuilt
+            with self.conn:
+                self.conn.execute("DROP TABLE IF EXISTS grades")
+                self.conn.execute("DROP TABLE IF EXISTS grade_items")
+                self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS grades ("
+            "path TEXT PRIMARY KEY, directory TEXT, filename TEXT, mtime REAL, size INTEGER, "
+            "verdict REAL, provider TEXT, model TEXT, subject TEXT, problem_id INTEGER, "
+            "web_enabled INTEGER, search TEXT, variant TEXT, format TEXT)"
+        )
+        # per-rubric-item scores of structured grades, in rubric order
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS grade_items ("
+            "path TEXT, position INTEGER, item TEXT, max_points REAL, points REAL, rationale TEXT, "
+            "PRIMARY KEY (path, position))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS grades_subject ON grades(subject, variant)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS grades_directory ON grades(directory)")
+        # lookup path of paired(): the baseline row of every variant row
+        self.conn.execute("CREATE INDEX IF NOT EXISTS grades_pairing ON grades("
+                          "variant, provider, model, subject, problem_id, web_enabled, search, verdict)")
+
+    def ingest(self, directory):
+        directory = os.path.normpath(directory)
+        known = {row[0]: (row[1], row[2]) for row in self.conn.execute(
+            "SELECT path, mtime, size FROM grades WHERE directory = ?", (directory,))}
+        seen = set()
+        rows = []
+        items = []
+        unparsed = []
+        for entry in os.scandir(directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            seen.add(entry.path)
+            if known.get(entry.path) == (stat.st_mtime, stat.st_size):
+                continue
+            try:
+                with open(entry.path, encoding="utf-8") as f:
+                    grade = parse_grade(f.read())
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"Skipping {entry.name}: {e}")
+                continue
+            if grade["verdict"] is None:
+                unparsed.append(entry.name)
+            meta = parse_grading_filename(directory, entry.name)
+            rows.append((entry.path, directory, entry.name, stat.st_mtime, stat.st_size, grade["verdict"],
+                         meta["provider"], meta["model"], meta["subject"], meta["problem_id"],
+                         meta["web_enabled"], meta["search"], meta["variant"], grade["format"]))
+            items.extend((entry.path, position, item["item"], item["max_points"], item["points"], item["rationale"])
+                         for position, item in enumerate(grade["items"]))
+        removed = [(path,) for path in known if path not in seen]
+        with self.conn:
+            self.conn.executemany(f"INSERT OR REPLACE INTO grades VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+            self.conn.executemany("DELETE FROM grades WHERE path = ?", removed)
+            self.conn.executemany("DELETE FROM grade_items WHERE path = ?", [row[:1] for row in rows] + removed)
+            self.conn.executemany(f"INSERT INTO grade_items VALUES ({', '.join('?' * len(ITEM_COLUMNS))})", items)
+        # files without a grade are kept (verdict NULL) instead of silently dropped
+        if unparsed:
+            print(f"No VERDICT or JSON grade found in {len(unparsed)} files of '{directory}': {unparsed[:5]}")
+        print(f"Indexed '{directory}': {len(rows)} new/changed, {len(removed)} removed, "
+              f"{len(seen) - len(rows)} unchanged")
+        return len(rows)
+
+    def _where(self, filters, prefix=""):
+        clauses = []
+        params = []
+        for column, value in filters.items():
+            if column not in COLUMNS:
+                raise ValueError(f"Unknown column {column!r}")
+            clauses.append(f"{prefix}{column} = ?")
+            params.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def verdicts(self, **filters):
+        where, params = self._where(filters)
+        cursor = self.conn.execute(f"SELECT {', '.join(COLUMNS)} FROM grades{where} ORDER BY path", params)
+        return [dict(zip(COLUMNS, row)) for row in cursor]
+
+    def items(self, **filters):
+        # per-item scores of structured grades, joined with their file's metadata
+        where, params = self._where(filters, prefix="g.")
+        columns = ", ".join(f"i.{column}" for column in ITEM_COLUMNS[1:])
+        cursor = self.conn.execute(
+            f"SELECT g.{', g.'.join(COLUMNS)}, {columns} FROM grade_items i JOIN grades g ON g.path = i.path"
+            f"{where} ORDER BY g.path, i.position", params)
+        return [dict(zip(COLUMNS + ITEM_COLUMNS[1:], row)) for row in cursor]
+
+    def grouped(self, by=("subject", "variant"), **filters):
+        unknown = [column for column in by if column not in GROUPABLE]
+        if unknown:
+            raise ValueError(f"Cannot group by {unknown}, expected columns from {GROUPABLE}")
+        where, params = self._where(filters)
+        group = ", ".join(by)
+        cursor = self.conn.execute(
+            f"SELECT {group}, COUNT(verdict), AVG(verdict), MIN(verdict), MAX(verdict), COUNT(*) - COUNT(verdict) "
+            f"FROM grades{where} GROUP BY {group} ORDER BY {group}", params)
+        names = list(by) + ["n", "mean", "min", "max", "unparsed"]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def paired(self, variant, baseline="default"):
+        # One row per problem graded under both variants: same provider, model, subject,
+        # problem id and search setting, i.e. the same full_pipeline save_suffix
+        cursor = self.conn.execute(
+            "SELECT v.provider, v.model, v.subject, v.problem_id, v.web_enabled, v.search, v.verdict, b.verdict "
+            "FROM grades v JOIN grades b ON v.provider = b.provider AND v.model = b.model "
+            "AND v.subject = b.subject AND v.problem_id = b.problem_id AND v.web_enabled = b.web_enabled "
+            "AND v.search = b.search "
+            "WHERE v.variant = ? AND b.variant = ? AND v.verdict IS NOT NULL AND b.verdict IS NOT NULL",
+            (variant, baseline))
+        return cursor.fetchall()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,256 @@
+import hashlib
+import json
+import math
+import os
+import re
+import statistics
+import threading
+import time
+
+from ResultsIndex import VERDICT_PATTERN, parse_grade
+
+RUBRIC_ITEM_PATTERN = re.compile(r"Points:\s*(\d+(?:\.\d+)?),\s*Item:\s*")
+DEFAULT_AGREEMENT_LOG = os.path.join("Telemetry", "rubric_agreement.jsonl")
+
+ITEM_GRADING_TEMPLATE = "You are grading one item of a science exam rubric.\n\
+You will be given the problem, the attempted answer, and a single rubric item worth {max_points} \
+points. Evaluate the attemped answer against this item only. Pay close attention to detail and \
+grade it strictly, but fairly. Treat the rubric item as the gold standard. *** \n\
+The problem: {problem} \
+***\n\
+The rubric item: {item}\
+***\n\
+The attempted answer: {answer}\
+***\n\n\
+Respond only with JSON: \"points\", the points earned for this item (from 0 to {max_points}, it can \
+be a decimal based on the item), and \"rationale\", at most one sentence."
+
+ITEM_SCHEMA = {
+    "name": "rubric_item_grade",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {"points": {"type": "number"}, "rationale": {"type": "string"}},
+        "required": ["points", "rationale"],
+        "additionalProperties": False,
+    },
+}
+
+
+def split_rubric(rubric):
+    # -> [{"label", "max_points", "text"}] in rubric order, one per "Points: X, Item: ..." entry
+    matches = list(RUBRIC_ITEM_PATTERN.finditer(rubric))
+    items = []
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(rubric)
+        text = rubric[match.end():end].strip()
+        items.append({"label": text.split(" - ")[0].split("\n")[0].strip()[:60], "max_points": float(match.group(1)),
+                      "text": text})
+    return items
+
+
+def parse_item_points(text, max_points):
+    # -> (points clamped to [0, max_points], rationale); points None when the reply has none
+    try:
+        data = json.loads(text.strip())
+    except json.JSONDecodeError:
+        data = None
+    if isinstance(data, dict) and isinstance(data.get("points"), (int, float)):
+        points, rationale = float(data["points"]), data.get("rationale")
+    else:
+        match = VERDICT_PATTERN.search(text)
+        if not match:
+            return None, None
+        points, rationale = float(match.group(1)), None
+    return min(max(points, 0.0), max_points), rationale
+
+
+class RubricSplitCache:
+    # task_group_id -> split rubric, shared by every grader in the process. The rubric's digest
+    # is kept with it, so a reused id with a different rubric is split again.
+    def __init__(self):
+        self.splits = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, rubric, task_group_id=None):
+        digest = hashlib.sha256(rubric.encode("utf-8")).hexdigest()
+        key = task_group_id or digest
+        with self.lock:
+            cached = self.splits.get(key)
+            if cached is not None and cached[0] == digest:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        items = split_rubric(rubric)
+        with self.lock:
+            self.splits[key] = (digest, items)
+        return items
+
+
+rubric_splits = RubricSplitCache()
+
+
+class RubricGrader:
+    # Decomposed grading: every rubric item is graded by its own low-effort, schema-constrained
+    # call, all of them in flight at once (bounded by ChatSession's per-provider semaphore),
+    # and the item points are summed. The grade has the same JSON shape as structured grading,
+    # so ResultsIndex reads it like any other grade.
+    def __init__(self, provider="openai", model_name="gpt-5", api_key="", reasoning_effort="low",
+                 splits=None, run_id=""):
+        self.provider = provider
+        self.model_name = model_name
+        self.api_key = api_key
+        self.reasoning_effort = reasoning_effort
+        self.splits = splits if splits is not None else rubric_splits
+        self.run_id = run_id
+        self.last_cost = 0.0
+        self.last_histories = []
+
+    def items(self, rubric, task_group_id=None):
+        return self.splits.get(rubric, task_group_id)
+
+    def _session(self, stage):
+        from ChatSession import ChatSession
+        return ChatSession(self.provider, self.model_name, self.api_key, high_reasoning=False,
+                           reasoning_effort=self.reasoning_effort, response_schema=ITEM_SCHEMA,
+                           run_id=self.run_id, stage=stage)
+
+    async def _grade_item(self, problem, answer, item, stage):
+        chat = self._session(stage)
+        prompt = ITEM_GRADING_TEMPLATE.format(problem=problem, item=item["text"], answer=answer,
+                                              max_points=f"{item['max_points']:g}")
+        points, rationale = parse_item_points(await chat.async_send_message(prompt), item["max_points"])
+        return {"item": item["label"], "max_points": item["max_points"], "points": points,
+                "rationale": rationale}, chat
+
+    async def async_grade(self, problem, answer, rubric, task_group_id=None, stage="grade_items"):
+        import asyncio
+        items = self.items(rubric, task_group_id)
+        if not items:
+            raise ValueError("Rubric has no 'Points: X, Item: ...' entries to grade separately")
+        results = await asyncio.gather(*(self._grade_item(problem, answer, item, stage) for item in items))
+        graded = [result for result, _ in results]
+        self.last_cost = sum(chat.total_cost for _, chat in results)
+        self.last_histories = [chat.get_history() for _, chat in results]
+        unparsed = sum(1 for item in graded if item["points"] is None)
+        if unparsed:
+            print(f"\t[{stage}] {unparsed} of {len(graded)} rubric items had no points, counted as 0")
+        for item in graded:
+            item["points"] = item["points"] or 0.0
+        return {"items": graded, "total": sum(item["points"] for item in graded)}
+
+    def grade(self, problem, answer, rubric, task_group_id=None, stage="grade_items"):
+        from ChatSession import ChatSession
+        return ChatSession.client_registry.run(self.async_grade(problem, answer, rubric, task_group_id, stage))
+
+
+def format_grade(grade):
+    return json.dumps(grade, ensure_ascii=False)
+
+
+class AgreementLog:
+    # One JSONL line per answer graded both ways (full_pipeline with rubric_grading="check"):
+    # the monolithic and the decomposed totals, per-item points when both have them, and the
+    # wall time and cost of each path
+    def __init__(self, path=DEFAULT_AGREEMENT_LOG):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record(self, run_id, stage, monolithic_text, decomposed, monolithic_seconds, decomposed_seconds,
+               monolithic_cost=0.0, decomposed_cost=0.0):
+        monolithic = parse_grade(monolithic_text)
+        entry = {
+            "timestamp": time.time(),
+            "run_id": run_id,
+            "stage": stage,
+            "monolithic": monolithic["verdict"],
+            "decomposed": decomposed["total"],
+            "monolithic_items": [item["points"] for item in monolithic["items"]] or None,
+            "decomposed_items": [item["points"] for item in decomposed["items"]],
+            "monolithic_seconds": monolithic_seconds,
+            "decomposed_seconds": decomposed_seconds,
+            "monolithic_cost": monolithic_cost,
+            "decomposed_cost": decomposed_cost,
+        }
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        return entry
+
+    def entries(self, run_id=None):
+        # the latest line per (run_id, stage): re-running a pipeline does not count an answer twice
+        if not os.path.exists(self.path):
+            return []
+        latest = {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    latest[(entry.get("run_id"), entry.get("stage"))] = entry
+        return [e for e in latest.values() if run_id is None or run_id in (e.get("run_id") or "")]
+
+    def summary(self, tolerance=1.0, run_id=None):
+        entries = [e for e in self.entries(run_id) if e["monolithic"] is not None]
+        if not entries:
+            return {"n": 0}
+        diffs = [e["decomposed"] - e["monolithic"] for e in entries]
+        summary = {
+            "n": len(entries),
+            "mean_abs_diff": statistics.mean(abs(d) for d in diffs),
+            "bias": statistics.mean(diffs),
+            "within_tolerance": sum(1 for d in diffs if abs(d) <= tolerance) / len(diffs),
+            "correlation": None,
+            "item_mean_abs_diff": None,
+            "median_speedup": None,
+            "monolithic_cost": sum(e["monolithic_cost"] or 0.0 for e in entries),
+            "decomposed_cost": sum(e["decomposed_cost"] or 0.0 for e in entries),
+        }
+        speedups = [e["monolithic_seconds"] / e["decomposed_seconds"] for e in entries if e["decomposed_seconds"]]
+        if speedups:
+            summary["median_speedup"] = statistics.median(speedups)
+        xs = [e["monolithic"] for e in entries]
+        ys = [e["decomposed"] for e in entries]
+        if len(entries) > 1 and statistics.pstdev(xs) and statistics.pstdev(ys):
+            mx, my = statistics.mean(xs), statistics.mean(ys)
+            covariance = sum((x - mx) * (y - my) for x, y in zip(xs, ys))
+            summary["correlation"] = covariance / math.sqrt(sum((x - mx) ** 2 for x in xs) *
+                                                            sum((y - my) ** 2 for y in ys))
+        # item-level comparison needs structured monolithic grades with the same number of items
+        item_diffs = [abs(a - b) for e in entries
+                      if e["monolithic_items"] and len(e["monolithic_items"]) == len(e["decomposed_items"])
+                      for a, b in zip(e["monolithic_items"], e["decomposed_items"])]
+        if item_diffs:
+            summary["item_mean_abs_diff"] = statistics.mean(item_diffs)
+        return summary
+
+    def report(self, tolerance=1.0, run_id=None):
+        summary = self.summary(tolerance, run_id)
+        if not summary["n"]:
+            print(f"No graded pairs in {self.path}")
+            return summary
+        print(f"Rubric-item grading vs monolithic grading over {summary['n']} answers ({self.path})")
+        lines = [
+            ("mean |decomposed - monolithic|", f"{summary['mean_abs_diff']:.2f} points"),
+            ("mean decomposed - monolithic", f"{summary['bias']:+.2f} points"),
+            (f"within {tolerance:g} point(s)", f"{summary['within_tolerance']:.1%}"),
+        ]
+        if summary["correlation"] is not None:
+            lines.append(("correlation", f"{summary['correlation']:.3f}"))
+        if summary["item_mean_abs_diff"] is not None:
+            lines.append(("mean per-item |difference|", f"{summary['item_mean_abs_diff']:.2f} points"))
+        if summary["median_speedup"] is not None:
+            lines.append(("median speedup (wall time)", f"{summary['median_speedup']:.2f}x"))
+        lines.append(("cost monolithic / decomposed",
+                      f"${summary['monolithic_cost']:.4f} / ${summary['decomposed_cost']:.4f}"))
+        for label, value in lines:
+            print(f"  {label:<32} {value}")
+        return summary
+
+
+agreement_log = AgreementLog(os.environ.get("RUBRIC_AGREEMENT_LOG", DEFAULT_AGREEMENT_LOG))
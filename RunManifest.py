@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+MANIFEST_DIR = "Manifests"
+
+
+class RunManifest:
+    # One JSON file per pipeline run recording, per stage: status, inputs hash, output path,
+    # cost and timestamps. A stage counts as done only if its inputs are unchanged and its
+    # output file still exists, so editing a prompt or deleting an output re-runs it.
+    def __init__(self, run_id, manifest_dir=MANIFEST_DIR):
+        self.run_id = run_id
+        self.path = os.path.join(manifest_dir, f"{run_id}.json")
+        self.lock = threading.Lock()
+        self.data = {"run_id": run_id, "created": time.time(), "stages": {}}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    @staticmethod
+    def hash_inputs(*parts):
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def stage(self, name):
+        return self.data["stages"].get(name)
+
+    def completed_output(self, name, inputs_hash):
+        record = self.stage(name)
+        if not record or record["status"] != "done" or record["inputs_hash"] != inputs_hash:
+            return None
+        if not os.path.exists(record["output_path"]):
+            return None
+        with open(record["output_path"], encoding="utf-8") as f:
+            return f.read()
+
+    def start(self, name, inputs_hash, output_path):
+        with self.lock:
+            self.data["stages"][name] = {
+                "status": "running",
+                "inputs_hash": inputs_hash,
+                "output_path": output_path,
+                "cost": 0.0,
+                "started": time.time(),
+                "finished": None,
+            }
+            self._save()
+
+    def finish(self, name, cost=0.0, status="done"):
+        # any status other than "done" (e.g. "truncated") leaves the stage to be run again
+        with self.lock:
+            record = self.data["stages"][name]
+            record.update(status=status, cost=cost, finished=time.time())
+            self._save()
+
+    def fail(self, name, error):
+        with self.lock:
+            record = self.data["stages"][name]
+            record.update(status="failed", error=repr(error), finished=time.time())
+            self._save()
+
+    def total_cost(self):
+        return sum(record.get("cost", 0.0) for record in self.data["stages"].values())
+
+    def _save(self):
+        # Write to a temp file and rename so a crash never leaves a half-written manifest
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,64 @@
+import time
+
+
+class StageSkipped(Exception):
+    pass
+
+
+class StageGraph:
+    # Small async DAG scheduler: every stage starts as soon as all of its dependencies have
+    # finished, so independent branches overlap and a run takes as long as its critical path.
+    # A stage function is an async callable receiving the dict of finished stage results.
+    def __init__(self, name=""):
+        self.name = name
+        self.stages = {}
+        self.timings = {}
+
+    def add(self, name, func, deps=()):
+        missing = [dep for dep in deps if dep not in self.stages]
+        if missing:
+            # Stages must be added after their dependencies, which also rules out cycles
+            raise ValueError(f"Stage {name!r} depends on unknown stages {missing}")
+        self.stages[name] = (func, tuple(deps))
+        return name
+
+    async def run(self):
+        import asyncio
+        results = {}
+        errors = {}
+        tasks = {}
+
+        async def run_stage(name, func, deps):
+            for dep in deps:
+                try:
+                    await tasks[dep]
+                except Exception:
+                    errors[name] = StageSkipped(f"{name} skipped because {dep} failed")
+                    raise errors[name]
+            start = time.perf_counter()
+            try:
+                results[name] = await func(results)
+            except Exception as e:
+                errors[name] = e
+                print(f"[{self.name}] stage {name} failed: {e!r}")
+                raise
+            finally:
+                self.timings[name] = (start, time.perf_counter())
+            return results[name]
+
+        # Dependencies were added first, so their tasks always exist already
+        for name, (func, deps) in self.stages.items():
+            tasks[name] = asyncio.ensure_future(run_stage(name, func, deps))
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        failures = {name: e for name, e in errors.items() if not isinstance(e, StageSkipped)}
+        if failures:
+            first = next(iter(failures.values()))
+            raise RuntimeError(f"{self.name}: stages failed: {sorted(failures)}") from first
+        return results
+
+    def wall_seconds(self):
+        if not self.timings:
+            return 0.0
+        starts, ends = zip(*self.timings.values())
+        return max(ends) - min(starts)
@@ -0,0 +1,287 @@
+import json
+import os
+import socket
+import time
+
+DEFAULT_SWEEP_DIR = "Sweeps"
+# A claimed unit whose lock has not been refreshed for this long is considered abandoned
+DEFAULT_LEASE_SECONDS = 1800
+# Worker environment variable holding each provider's key (the mock provider needs none)
+API_KEY_ENV = {"openai": "OPENAI_API_KEY", "anthropic": "ANTHROPIC_API_KEY"}
+
+# Sweep layout on the shared filesystem (one directory per sweep):
+#   plan.json              the expanded problems x options matrix and the pipeline arguments
+#   units/<unit>.json      one work unit per (problem, option) pair
+#   locks/<unit>.lock      created with O_EXCL by the worker running the unit, refreshed while it runs
+#   done/<unit>.json       written when the pipeline finished
+#   failed/<unit>.json     written when it raised; retried only with retry_failed
+# Every unit has its own (provider, model, web, id_count), so its full_pipeline save_suffix (and
+# with it every Responses/, FullChats/ and Manifests/ path) differs from every other unit's;
+# plan() refuses a sweep whose units would reuse those of another sweep under the same root.
+
+
+def sweep_path(name, root=DEFAULT_SWEEP_DIR):
+    return os.path.join(root, name)
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _unit_names(directory):
+    # unit ids are plain numbers; skips temp files and locks being taken over
+    if not os.path.isdir(directory):
+        return set()
+    return {name.split(".", 1)[0] for name in os.listdir(directory)
+            if not name.endswith(".tmp") and ".stale-" not in name}
+
+
+def _planned_runs(options, id_start, count):
+    # the (provider, model, web, id_count) of every unit: what its save_suffix is made of
+    return {(provider, model_name, bool(web_enabled), id_start + i)
+            for i in range(count) for provider, model_name, web_enabled in options}
+
+
+def _check_collisions(name, options, id_start, count, root):
+    runs = _planned_runs(options, id_start, count)
+    if len(runs) < len(options) * count:
+        raise ValueError("The same (provider, model, web) option is listed twice")
+    if not os.path.isdir(root):
+        return
+    for other in sorted(os.listdir(root)):
+        other_plan = os.path.join(root, other, "plan.json")
+        if other == name or not os.path.exists(other_plan):
+            continue
+        planned = _read_json(other_plan)
+        overlap = runs & _planned_runs(planned["options"], planned["id_start"], len(planned["problem_indices"]))
+        if overlap:
+            ids = sorted({run[3] for run in overlap})
+            free = planned["id_start"] + len(planned["problem_indices"])
+            raise ValueError(f"Sweep {other!r} already uses ids {ids[0]}-{ids[-1]} for the same options, so both "
+                             f"would write the same Responses/ paths; pick another id_start (e.g. {free})")
+
+
+def plan(name, problem_indices, options, id_start=0, pipeline_args=None, root=DEFAULT_SWEEP_DIR,
+         dataset_path="test.json"):
+    # problem_indices are positions in the dataset, so every machine can load the same problems
+    sweep_dir = sweep_path(name, root)
+    if os.path.exists(os.path.join(sweep_dir, "plan.json")):
+        raise FileExistsError(f"Sweep {name!r} already planned in {sweep_dir}")
+    _check_collisions(name, options, id_start, len(problem_indices), root)
+    pipeline_args = dict(pipeline_args or {})
+    # credentials come from each worker's environment, never from the shared plan
+    pipeline_args.pop("api_key", None)
+
+    for sub in ("units", "locks", "done", "failed"):
+        os.makedirs(os.path.join(sweep_dir, sub), exist_ok=True)
+    units = []
+    for i, problem_index in enumerate(problem_indices):
+        for provider, model_name, web_enabled in options:
+            unit = {
+                "unit": f"{len(units):06d}",
+                "problem_index": problem_index,
+                "id_count": id_start + i,
+                "provider": provider,
+                "model_name": model_name,
+                "web_enabled": bool(web_enabled),
+            }
+            units.append(unit)
+            _write_json(os.path.join(sweep_dir, "units", f"{unit['unit']}.json"), unit)
+    _write_json(os.path.join(sweep_dir, "plan.json"), {
+        "name": name,
+        "dataset_path": dataset_path,
+        "id_start": id_start,
+        "problem_indices": list(problem_indices),
+        "options": [list(option) for option in options],
+        "pipeline_args": pipeline_args,
+        "units": len(units),
+        "created": time.time(),
+    })
+    print(f"Planned sweep {name!r}: {len(problem_indices)} problems x {len(options)} options = {len(units)} units")
+    return sweep_dir
+
+
+class SweepWorker:
+    # Claims units of one sweep through lock files and runs their pipelines, up to
+    # max_pipelines at a time in one event loop. Any number of workers, local or on other
+    # machines sharing the sweep directory, can run side by side; shard/shards restricts a
+    # worker to the units with index % shards == shard.
+    def __init__(self, sweep_dir, worker_id=None, shard=0, shards=1, max_pipelines=4,
+                 lease_seconds=DEFAULT_LEASE_SECONDS, retry_failed=False):
+        if not 0 <= shard < shards:
+            raise ValueError(f"shard must be in [0, {shards}), got {shard}")
+        self.sweep_dir = sweep_dir
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.shard = shard
+        self.shards = shards
+        self.max_pipelines = max_pipelines
+        self.lease_seconds = lease_seconds
+        self.retry_failed = retry_failed
+        self.plan = _read_json(os.path.join(sweep_dir, "plan.json"))
+        self.running = {}
+        self.finished = 0
+        self.failed = 0
+
+    def _path(self, sub, unit, ext="json"):
+        return os.path.join(self.sweep_dir, sub, f"{unit}.{ext}")
+
+    def _mine(self, unit):
+        return int(unit) % self.shards == self.shard
+
+    def _lock(self, unit):
+        path = self._path("locks", unit, "lock")
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if time.time() - os.path.getmtime(path) < self.lease_seconds:
+                return False
+            # Abandoned lease: exactly one worker wins the rename and may retry the claim
+            stolen = f"{path}.stale-{self.worker_id}"
+            try:
+                os.rename(path, stolen)
+            except FileNotFoundError:
+                return False
+            os.remove(stolen)
+            print(f"[{self.worker_id}] taking over abandoned unit {unit}")
+            return self._lock(unit)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"worker": self.worker_id, "claimed": time.time()}, f)
+        return True
+
+    def claim(self):
+        done = _unit_names(os.path.join(self.sweep_dir, "done"))
+        failed = set() if self.retry_failed else _unit_names(os.path.join(self.sweep_dir, "failed"))
+        for unit in sorted(_unit_names(os.path.join(self.sweep_dir, "units"))):
+            if unit in done or unit in failed or unit in self.running or not self._mine(unit):
+                continue
+            if self._lock(unit):
+                # another worker may have finished it between the listing and the lock
+                if os.path.exists(self._path("done", unit)):
+                    os.remove(self._path("locks", unit, "lock"))
+                    continue
+                return _read_json(self._path("units", unit))
+        return None
+
+    def _release(self, unit):
+        try:
+            os.remove(self._path("locks", unit, "lock"))
+        except FileNotFoundError:
+            pass
+
+    async def _heartbeat(self):
+        import asyncio
+        while True:
+            await asyncio.sleep(max(1.0, self.lease_seconds / 4))
+            for unit in list(self.running):
+                try:
+                    os.utime(self._path("locks", unit, "lock"))
+                except FileNotFoundError:
+                    pass
+
+    def _pipeline_args(self):
+        args = dict(self.plan["pipeline_args"])
+        budget = args.get("history_budget")
+        if isinstance(budget, dict):
+            from HistoryBudget import HistoryBudget
+            # plans written before drop_blocks was removed still carry it
+            budget = {key: value for key, value in budget.items() if key != "drop_blocks"}
+            args["history_budget"] = HistoryBudget(**budget)
+        return args
+
+    async def _run_unit(self, unit, problems, pipeline_args):
+        from main import async_full_pipeline
+        args = dict(pipeline_args)
+        args.update(provider=unit["provider"], model_name=unit["model_name"], web_enabled=unit["web_enabled"],
+                    api_key=os.environ.get(API_KEY_ENV.get(unit["provider"], ""), ""))
+        start = time.time()
+        label = f"{unit['provider']}_{unit['model_name']}_{unit['id_count']}_web_{unit['web_enabled']}"
+        print(f"[{self.worker_id}] starting unit {unit['unit']} ({label})")
+        try:
+            await async_full_pipeline(problems[unit["problem_index"]], unit["id_count"], **args)
+        except Exception as e:
+            self.failed += 1
+            _write_json(self._path("failed", unit["unit"]), dict(unit, worker=self.worker_id, error=repr(e),
+                                                                  seconds=time.time() - start, finished=time.time()))
+            print(f"[{self.worker_id}] unit {unit['unit']} failed: {e!r}")
+        else:
+            self.finished += 1
+            _write_json(self._path("done", unit["unit"]), dict(unit, worker=self.worker_id,
+                                                                seconds=time.time() - start, finished=time.time()))
+            if os.path.exists(self._path("failed", unit["unit"])):
+                os.remove(self._path("failed", unit["unit"]))
+        finally:
+            self._release(unit["unit"])
+
+    async def run(self):
+        import asyncio
+        from ProblemDataset import ProblemDataset
+
+        problems = ProblemDataset(self.plan["dataset_path"])
+        pipeline_args = self._pipeline_args()
+        heartbeat = asyncio.ensure_future(self._heartbeat())
+        try:
+            while True:
+                while len(self.running) < self.max_pipelines:
+                    unit = self.claim()
+                    if unit is None:
+                        break
+                    self.running[unit["unit"]] = asyncio.ensure_future(self._run_unit(unit, problems, pipeline_args))
+                if not self.running:
+                    break
+                finished, _ = await asyncio.wait(self.running.values(), return_when=asyncio.FIRST_COMPLETED)
+                for unit in [u for u, task in self.running.items() if task in finished]:
+                    del self.running[unit]
+        finally:
+            heartbeat.cancel()
+            for unit in list(self.running):
+                self._release(unit)
+        print(f"[{self.worker_id}] no units left: {self.finished} finished, {self.failed} failed")
+        return self.finished, self.failed
+
+
+def run_worker(sweep_dir, **worker_args):
+    from ChatSession import ChatSession
+    return ChatSession.client_registry.run(SweepWorker(sweep_dir, **worker_args).run())
+
+
+def run_local(sweep_dir, processes=None, shard=0, shards=1, **worker_args):
+    # Local process pool: every process is an independent queue worker, so a sweep can be
+    # served by this pool and by workers on other machines at the same time
+    import multiprocessing
+
+    processes = processes or os.cpu_count() or 1
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_worker, args=(sweep_dir,),
+                               kwargs=dict(worker_args, worker_id=f"{socket.gethostname()}-local{i}",
+                                           shard=shard, shards=shards))
+               for i in range(processes)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    print(f"Local pool of {processes} processes finished in {time.time() - start:.1f}s")
+    return status(sweep_dir)
+
+
+def status(sweep_dir, shards=1):
+    units = _unit_names(os.path.join(sweep_dir, "units"))
+    done = _unit_names(os.path.join(sweep_dir, "done")) & units
+    failed = (_unit_names(os.path.join(sweep_dir, "failed")) & units) - done
+    running = _unit_names(os.path.join(sweep_dir, "locks")) - done
+    counts = {"units": len(units), "done": len(done), "failed": len(failed), "running": len(running),
+              "pending": len(units - done - failed - running)}
+    print(f"{sweep_dir}: " + ", ".join(f"{key} {value}" for key, value in counts.items()))
+    if shards > 1:
+        for shard in range(shards):
+            mine = {u for u in units if int(u) % shards == shard}
+            print(f"  shard {shard}/{shards}: {len(mine & done)}/{len(mine)} done, {len(mine & failed)} failed")
+    return counts
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+DEFAULT_LEDGER_PATH = os.path.join("Telemetry", "ledger.jsonl")
+
+# Fields written for every provider call (missing ones are stored as null)
+LEDGER_FIELDS = (
+    "timestamp", "run_id", "stage", "provider", "model",
+    "input_tokens", "cached_tokens", "cache_write_tokens", "output_tokens", "reasoning_tokens",
+    "search_calls", "cost", "latency", "retries", "cache_hit", "streamed", "time_to_first_token",
+    "estimated_input_tokens", "estimated_cost", "hedged", "hedge_won", "hedge_cost",
+    "local_searches",
+)
+
+
+class TelemetryLedger:
+    # Append-only JSONL ledger with one record per provider call. Appends are single
+    # write() calls of one line, so several processes can share a ledger file.
+    def __init__(self, path=DEFAULT_LEDGER_PATH, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.lock = threading.Lock()
+
+    def record(self, **fields):
+        if not self.enabled:
+            return None
+        entry = {name: fields.get(name) for name in LEDGER_FIELDS}
+        entry["timestamp"] = entry["timestamp"] or time.time()
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        return entry
+
+    def read(self, run_id=None, since=None):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a crash mid-write can leave one partial line at the end
+                    continue
+                if run_id is not None and entry.get("run_id") != run_id:
+                    continue
+                if since is not None and entry.get("timestamp", 0) < since:
+                    continue
+                entries.append(entry)
+        return entries
+
+    def stage_stats(self, run_id=None, since=None):
+        grouped = defaultdict(list)
+        for entry in self.read(run_id, since):
+            grouped[(entry.get("stage") or "-", entry.get("model") or "-")].append(entry)
+        stats = []
+        for (stage, model), entries in grouped.items():
+            latencies = sorted(e.get("latency") or 0.0 for e in entries)
+            stats.append({
+                "stage": stage,
+                "model": model,
+                "calls": len(entries),
+                "cache_hits": sum(1 for e in entries if e.get("cache_hit")),
+                # a hedged call also paid for its losing duplicate
+                "cost": sum((e.get("cost") or 0.0) + (e.get("hedge_cost") or 0.0) for e in entries),
+                "output_tokens": sum(e.get("output_tokens") or 0 for e in entries),
+                "mean_latency": sum(latencies) / len(latencies),
+                "p95_latency": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+                "retries": sum(e.get("retries") or 0 for e in entries),
+                "hedged": sum(1 for e in entries if e.get("hedged")),
+                "hedge_wins": sum(1 for e in entries if e.get("hedge_won")),
+                "hedge_cost": sum(e.get("hedge_cost") or 0.0 for e in entries),
+            })
+        return stats
+
+    def summary(self, run_id=None, since=None, top=10):
+        stats = self.stage_stats(run_id, since)
+        if not stats:
+            print(f"No ledger entries in {self.path}")
+            return stats
+        total = sum(s["cost"] for s in stats)
+        calls = sum(s["calls"] for s in stats)
+        print(f"Ledger {self.path}: {calls} calls, total cost ${total:.4f}")
+        header = f"{'STAGE':<24} | {'MODEL':<26} | {'CALLS':>5} | {'COST':>10} | {'MEAN s':>7} | {'P95 s':>7} | {'RETRIES':>7}"
+
+        def show(title, rows):
+            print(f"\n======= {title} =======")
+            print(header)
+            print("-" * len(header))
+            for s in rows:
+                print(f"{s['stage']:<24} | {s['model']:<26} | {s['calls']:>5} | ${s['cost']:>9.4f} | "
+                      f"{s['mean_latency']:>7.1f} | {s['p95_latency']:>7.1f} | {s['retries']:>7}")
+
+        show("MOST EXPENSIVE STAGES", sorted(stats, key=lambda s: s["cost"], reverse=True)[:top])
+        show("SLOWEST STAGES (P95)", sorted(stats, key=lambda s: s["p95_latency"], reverse=True)[:top])
+        hedged = [s for s in stats if s["hedged"]]
+        if hedged:
+            print("\n======= HEDGED REQUESTS =======")
+            print(f"{'STAGE':<24} | {'MODEL':<26} | {'RATE':>6} | {'WON':>5} | {'EXTRA COST':>10}")
+            for s in sorted(hedged, key=lambda s: s["hedge_cost"], reverse=True)[:top]:
+                print(f"{s['stage']:<24} | {s['model']:<26} | {s['hedged'] / s['calls']:>6.1%} | "
+                      f"{s['hedge_wins']:>5} | ${s['hedge_cost']:>9.4f}")
+            print(f"{sum(s['hedged'] for s in stats)} of {calls} calls hedged, extra cost "
+                  f"${sum(s['hedge_cost'] for s in stats):.4f}")
+        return stats
+
+
+ledger = TelemetryLedger(os.environ.get("TELEMETRY_LEDGER", DEFAULT_LEDGER_PATH),
+                         enabled=os.environ.get("TELEMETRY_LEDGER", "unset") != "")
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+DEFAULT_STORE_PATH = "Transcripts"
+
+# Pack record: magic, sha256 digest of the message, length of the zlib data, zlib data
+RECORD_MAGIC = b"TSM1"
+RECORD_HEADER = struct.Struct(">4s32sI")
+
+
+def message_hash(message):
+    return hashlib.sha256(_encode(message)).hexdigest()
+
+
+def _encode(message):
+    return json.dumps({"role": message["role"], "content": message["content"]},
+                      sort_keys=True, ensure_ascii=False).encode("utf-8")
+
+
+def format_transcript(messages):
+    # The FullChats/ text layout write_history has always produced
+    parts = []
+    for line in messages:
+        parts.append(f"********** {line['role']} ********** \n\n")
+        parts.append(f"\t {line['content']}\n\n")
+        parts.append("---------------------------------------------------\n\n")
+    return "".join(parts)
+
+
+class TranscriptStore:
+    # Content-addressed transcript storage. Every message body is written once, compressed,
+    # to messages.pack; a transcript is one line of transcripts.jsonl holding the list of its
+    # message hashes. In keep_chat mode later transcripts of a problem repeat the earlier
+    # messages, so they only cost one hash per repeated message instead of a full rewrite.
+    # Both files are append-only; the latest line for a name wins.
+    def __init__(self, path=DEFAULT_STORE_PATH, enabled=True, level=6):
+        self.path = path
+        self.enabled = enabled
+        self.level = level
+        self.pack_path = os.path.join(path, "messages.pack")
+        self.log_path = os.path.join(path, "transcripts.jsonl")
+        self.lock = threading.Lock()
+        self.offsets = {}
+        self.scanned = 0
+
+    def _scan(self):
+        # Index records appended since the last scan (possibly by other processes). A record
+        # cut short by a crash is skipped by searching for the next magic.
+        if not os.path.exists(self.pack_path):
+            return
+        with open(self.pack_path, "rb") as f:
+            f.seek(self.scanned)
+            data = f.read()
+        position = 0
+        while position + RECORD_HEADER.size <= len(data):
+            magic, digest, length = RECORD_HEADER.unpack_from(data, position)
+            end = position + RECORD_HEADER.size + length
+            broken = end < len(data) and not RECORD_MAGIC.startswith(data[end:end + len(RECORD_MAGIC)])
+            if magic != RECORD_MAGIC or end > len(data) or broken:
+                following = data.find(RECORD_MAGIC, position + 1)
+                if following == -1:
+                    break
+                position = following
+                continue
+            self.offsets.setdefault(digest.hex(), (self.scanned + position + RECORD_HEADER.size, length))
+            position = end
+        self.scanned += position
+
+    def _put(self, message):
+        digest = message_hash(message)
+        if digest in self.offsets:
+            return digest
+        self._scan()
+        if digest not in self.offsets:
+            data = zlib.compress(_encode(message), self.level)
+            record = RECORD_HEADER.pack(RECORD_MAGIC, bytes.fromhex(digest), len(data)) + data
+            os.makedirs(self.path, exist_ok=True)
+            # one write() per record so concurrent appenders never interleave inside a record
+            with open(self.pack_path, "ab") as f:
+                f.write(record)
+        return digest
+
+    def get(self, digest):
+        with self.lock:
+            if digest not in self.offsets:
+                self._scan()
+            offset, length = self.offsets[digest]
+        with open(self.pack_path, "rb") as f:
+            f.seek(offset)
+            return json.loads(zlib.decompress(f.read(length)).decode("utf-8"))
+
+    def write(self, name, messages):
+        with self.lock:
+            hashes = [self._put(message) for message in messages]
+            line = json.dumps({"name": name, "timestamp": time.time(), "messages": hashes}) + "\n"
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        return hashes
+
+    def transcripts(self):
+        latest = {}
+        if not os.path.exists(self.log_path):
+            return latest
+        with open(self.log_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a crash mid-write can leave one partial line at the end
+                    continue
+                latest[entry["name"]] = entry["messages"]
+        return latest
+
+    def load(self, name):
+        hashes = self.transcripts().get(name)
+        if hashes is None:
+            raise KeyError(f"No transcript named {name!r} in {self.path}")
+        return [self.get(digest) for digest in hashes]
+
+    def export(self, name, output_path=None):
+        output_path = output_path or name
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(format_transcript(self.load(name)))
+        return output_path
+
+    def export_all(self, output_dir=None, match=""):
+        exported = []
+        for name in sorted(self.transcripts()):
+            if match in name:
+                target = os.path.join(output_dir, os.path.basename(name)) if output_dir else name
+                exported.append(self.export(name, target))
+        print(f"Exported {len(exported)} transcripts")
+        return exported
+
+    def stats(self):
+        with self.lock:
+            self._scan()
+            stored = os.path.getsize(self.pack_path) if os.path.exists(self.pack_path) else 0
+        transcripts = self.transcripts()
+        references = sum(len(hashes) for hashes in transcripts.values())
+        text_bytes = sum(len(format_transcript(self.load(name)).encode("utf-8")) for name in transcripts)
+        log_bytes = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        return {
+            "transcripts": len(transcripts),
+            "messages": len(self.offsets),
+            "message_references": references,
+            "stored_bytes": stored + log_bytes,
+            "text_export_bytes": text_bytes,
+        }
+
+
+transcript_store = TranscriptStore(os.environ.get("TRANSCRIPT_STORE", DEFAULT_STORE_PATH),
+                                   enabled=os.environ.get("TRANSCRIPT_STORE", "unset") != "")
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+DEFAULT_STATE_DIR = "Watch"
+# a file modified more recently than this is assumed to still be written and is left for the next poll
+DEFAULT_SETTLE_SECONDS = 2.0
+
+
+def _state_name(directory, save_prefix):
+    folder = os.path.basename(os.path.normpath(directory)).replace(" ", "_")
+    digest = hashlib.sha256(os.path.abspath(directory).encode("utf-8")).hexdigest()[:8]
+    return f"{save_prefix}_{folder}_{digest}.json"
+
+
+class WatchGrader:
+    # Long-running grade_answers_from_directory: polls an answer directory and grades every
+    # new or modified file through a bounded queue served by max_in_flight workers, writing
+    # each grade as soon as it finishes. What was graded is persisted as a seen-set keyed by
+    # the hash of the grading setup plus the file content, so restarts skip graded answers,
+    # an edited file is graded again and a copy of a graded answer reuses its grade.
+    def __init__(self, directory, problem_d, save_prefix, grading_prompt_func=None, structured=False,
+                 max_in_flight=4, queue_size=16, poll_interval=2.0, settle_seconds=DEFAULT_SETTLE_SECONDS,
+                 max_attempts=3, state_path=None):
+        from PromptFactory import PromptFactory
+        if grading_prompt_func is None:
+            grading_prompt_func = (PromptFactory.get_structured_grading_prompt if structured
+                                   else PromptFactory.get_grading_prompt)
+        self.directory = directory
+        self.problem_d = problem_d
+        self.save_prefix = save_prefix
+        self.grading_prompt_func = grading_prompt_func
+        self.structured = structured
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.max_attempts = max_attempts
+        self.state_path = state_path or os.path.join(DEFAULT_STATE_DIR, _state_name(directory, save_prefix))
+        # answers graded under another problem, prompt or output format are not "seen"
+        self.setup_hash = hashlib.sha256(json.dumps(
+            [problem_d["answer"], problem_d["problem"], save_prefix, getattr(grading_prompt_func, "__name__", ""),
+             structured], ensure_ascii=False).encode("utf-8")).hexdigest()
+        self.seen = self._load()
+        self.signatures = {}
+        self.pending = set()
+        self.queued_keys = set()
+        self.attempts = {}
+        self.graded = 0
+        self.reused = 0
+        self.failed = 0
+
+    def _load(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, encoding="utf-8") as f:
+            return json.load(f)["seen"]
+
+    def _save(self):
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"directory": self.directory, "save_prefix": self.save_prefix, "seen": self.seen}, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def content_key(self, path):
+        digest = hashlib.sha256(self.setup_hash.encode("ascii"))
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _reuse(self, path, key):
+        # same content as a graded file under another name: copy its grade instead of regrading
+        from main import file_grade_paths
+        grade_path, _ = file_grade_paths(path, self.save_prefix)
+        source = self.seen[key]["grade_path"]
+        if grade_path != source and not os.path.exists(grade_path) and os.path.exists(source):
+            shutil.copyfile(source, grade_path)
+            self.reused += 1
+            print(f"[watch] {os.path.basename(path)} has the content of {self.seen[key]['file']}, reused its grade")
+
+    def scan(self, settled_only=True):
+        # -> [(path, key)] of files whose content has not been graded yet. Only files whose
+        # (mtime, size) changed since the last poll are read and hashed.
+        found = []
+        now = time.time()
+        for entry in sorted(os.scandir(self.directory), key=lambda e: e.name):
+            if not entry.is_file() or entry.name.startswith(".") or entry.name.endswith(".tmp"):
+                continue
+            if entry.path in self.pending:
+                continue
+            stat = entry.stat()
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if self.signatures.get(entry.path) == signature:
+                continue
+            if settled_only and now - stat.st_mtime < self.settle_seconds:
+                continue
+            try:
+                key = self.content_key(entry.path)
+            except OSError as e:
+                print(f"[watch] skipping {entry.name}: {e}")
+                continue
+            if key in self.queued_keys:
+                # a copy of an answer being graded: picked up (and reused) once that grade exists
+                continue
+            self.signatures[entry.path] = signature
+            if key in self.seen:
+                self._reuse(entry.path, key)
+            elif self.attempts.get(key, 0) < self.max_attempts:
+                self.queued_keys.add(key)
+                found.append((entry.path, key))
+        return found
+
+    async def _grade(self, path, key):
+        from main import async_grade_answer_from_file, file_grade_paths
+        start = time.perf_counter()
+        try:
+            await async_grade_answer_from_file(self.grading_prompt_func, path, self.problem_d, self.save_prefix,
+                                               structured=self.structured)
+        except Exception as e:
+            self.failed += 1
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+            # forget the signature so the next poll retries it (up to max_attempts)
+            self.signatures.pop(path, None)
+            print(f"[watch] grading {os.path.basename(path)} failed ({self.attempts[key]}/{self.max_attempts}): {e!r}")
+            return
+        grade_path, _ = file_grade_paths(path, self.save_prefix)
+        self.seen[key] = {"file": os.path.basename(path), "grade_path": grade_path, "graded": time.time(),
+                          "seconds": time.perf_counter() - start}
+        self._save()
+        self.graded += 1
+        print(f"[watch] graded {os.path.basename(path)} -> {grade_path} ({time.perf_counter() - start:.1f}s)")
+
+    async def _worker(self, queue):
+        while True:
+            path, key = await queue.get()
+            try:
+                await self._grade(path, key)
+            finally:
+                self.pending.discard(path)
+                self.queued_keys.discard(key)
+                queue.task_done()
+
+    async def run(self, once=False, idle_exit=None):
+        # once: grade what is there now and return; idle_exit: return after that many seconds
+        # without new files; otherwise run until cancelled (Ctrl-C)
+        import asyncio
+        os.makedirs(os.path.join("Responses", "Grading from files"), exist_ok=True)
+        os.makedirs("FullChats", exist_ok=True)
+        queue = asyncio.Queue(self.queue_size)
+        workers = [asyncio.ensure_future(self._worker(queue)) for _ in range(self.max_in_flight)]
+        print(f"[watch] watching '{self.directory}' ({len(self.seen)} answers already graded, "
+              f"{self.max_in_flight} in flight, queue of {self.queue_size})")
+        last_activity = time.time()
+        try:
+            while True:
+                found = self.scan(settled_only=not once)
+                for path, key in found:
+                    self.pending.add(path)
+                    # waits while the queue is full, so scanning never runs far ahead of grading
+                    await queue.put((path, key))
+                if found or self.pending:
+                    last_activity = time.time()
+                if once:
+                    # rescan until nothing is left: copies skipped while their twin was graded reuse it now
+                    await queue.join()
+                    if not found:
+                        break
+                    continue
+                if idle_exit is not None and time.time() - last_activity >= idle_exit:
+                    await queue.join()
+                    break
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            for worker in workers:
+                worker.cancel()
+        print(f"[watch] '{self.directory}': {self.graded} graded, {self.reused} reused, {self.failed} failed")
+        return {"graded": self.graded, "reused": self.reused, "failed": self.failed}
+
+
+def watch(directory, problem_d, save_prefix, once=False, idle_exit=None, **grader_args):
+    from ChatSession import ChatSession
+    grader = WatchGrader(directory, problem_d, save_prefix, **grader_args)
+    return ChatSession.client_registry.run(grader.run(once=once, idle_exit=idle_exit))
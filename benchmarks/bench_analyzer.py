@@ -0,0 +1,78 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Paired bootstrap benchmark on a synthetic results index: --pairs problems graded under
+# "default" and every projection variant, spread over models, subjects and search settings.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from Analyzer import COMPARED_VARIANTS, BREAKDOWNS, paired_bootstrap  # noqa: E402
+from ResultsIndex import COLUMNS, ResultsIndex  # noqa: E402
+
+MODELS = [("openai", "gpt-5.2"), ("anthropic", "claude-opus-4-5-20251101")]
+SUBJECTS = ["biology", "physics", "chemistry"]
+SEARCH = ["off", "hosted", "local"]
+
+
+def build_index(path, pairs, seed):
+    rng = random.Random(seed)
+    index = ResultsIndex(path)
+    rows = []
+    for i in range(pairs):
+        provider, model = MODELS[i % len(MODELS)]
+        subject = SUBJECTS[(i // len(MODELS)) % len(SUBJECTS)]
+        search = SEARCH[(i // (len(MODELS) * len(SUBJECTS))) % len(SEARCH)]
+        web = int(search != "off")
+        problem_id = i
+        for variant in ("default",) + COMPARED_VARIANTS:
+            p = 0.45 if variant == "default" else 0.5
+            verdict = float(rng.random() < p)
+            name = f"{variant}/{provider}_{model}_{subject}_{problem_id}_{search}"
+            row = dict.fromkeys(COLUMNS)
+            row.update(path=name, directory=variant, filename=name, mtime=0.0, size=0, verdict=verdict,
+                       provider=provider, model=model, subject=subject, problem_id=problem_id, web_enabled=web,
+                       search=search, variant=variant, format="verdict")
+            rows.append(tuple(row[column] for column in COLUMNS))
+    # named columns: the rows follow the index schema instead of its column count
+    with index.conn:
+        index.conn.executemany(f"INSERT OR REPLACE INTO grades ({', '.join(COLUMNS)}) "
+                               f"VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pairs", type=int, default=30000)
+    parser.add_argument("--resamples", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = build_index(os.path.join(tmp, "bench.sqlite"), args.pairs, args.seed)
+        print(f"{'VARIANT':<20} | {'BREAKDOWN':<12} | {'GROUPS':>6} | {'TIME':>8}")
+        print("-" * 56)
+        total = 0.0
+        for variant in COMPARED_VARIANTS:
+            start = time.perf_counter()
+            pairs = index.paired(variant)
+            elapsed = time.perf_counter() - start
+            total += elapsed
+            print(f"{variant:<20} | {'(pairing)':<12} | {'':>6} | {elapsed * 1000:>6.0f}ms")
+            for by in BREAKDOWNS:
+                start = time.perf_counter()
+                results = paired_bootstrap(index, variant, by=by, n_resamples=args.resamples, seed=args.seed,
+                                           pairs=pairs)
+                elapsed = time.perf_counter() - start
+                total += elapsed
+                print(f"{variant:<20} | {','.join(by) or 'overall':<12} | {len(results):>6} | {elapsed * 1000:>6.0f}ms")
+        print(f"\n{args.pairs} pairs x {args.resamples} resamples, all comparisons: {total:.2f}s")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+# End-to-end throughput benchmark on the offline "mock" provider (MockProvider): the async
+# full_pipeline sweep, grade_answers_from_directory and the Analyzer, each timed separately.
+# Everything runs in a scratch directory with its own response cache, ledger and transcripts,
+# so runs are independent and cost nothing; the same --seed replays the same completions.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESPONSE_DIRS = ["Simplification", "Projection Answer", "Reprojection", "DefaultAnswers", "Grading projection",
+                 "Grading from projection", "Grading default", "Grading from files"]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def prepare_workdir(args):
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.symlink(os.path.join(REPO_ROOT, args.dataset), os.path.join(workdir, "test.json"))
+    for name in RESPONSE_DIRS:
+        os.makedirs(os.path.join(workdir, "Responses", name))
+    os.makedirs(os.path.join(workdir, "FullChats"))
+    # must be set before the repo modules are imported: they read them at import time
+    os.environ["RESPONSE_CACHE_MODE"] = args.cache
+    os.environ["RESPONSE_CACHE_PATH"] = os.path.join(workdir, "cache.sqlite")
+    os.environ["TELEMETRY_LEDGER"] = os.path.join(workdir, "ledger.jsonl")
+    os.environ["TRANSCRIPT_STORE"] = os.path.join(workdir, "Transcripts")
+    os.environ["RUBRIC_AGREEMENT_LOG"] = os.path.join(workdir, "rubric_agreement.jsonl")
+    if args.corpus:
+        os.environ["LOCAL_SEARCH_CORPUS"] = os.path.abspath(args.corpus)
+        os.environ["LOCAL_SEARCH_INDEX"] = os.path.join(workdir, "corpus_index.sqlite")
+    if args.hedge_percentile is not None:
+        os.environ["HEDGE_PERCENTILE"] = str(args.hedge_percentile)
+        os.environ["HEDGE_MIN_SAMPLES"] = str(args.hedge_min_samples)
+    os.environ["MOCK_PROVIDER"] = (f"latency_median={args.latency_median},latency_sigma={args.latency_sigma},"
+                                   f"error_rate={args.error_rate},rate_limit_rate={args.rate_limit_rate},"
+                                   f"output_words={args.output_words},seed={args.seed}")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+    return workdir
+
+
+def stage_latencies(ledger_path):
+    by_stage = defaultdict(list)
+    output_tokens = defaultdict(list)
+    with open(ledger_path, encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if not entry.get("cache_hit"):
+                by_stage[entry.get("stage") or "-"].append(entry.get("latency") or 0.0)
+                output_tokens[entry.get("stage") or "-"].append(entry.get("output_tokens") or 0)
+    return {stage: {"calls": len(latencies), "p50": statistics.median(latencies), "p95": percentile(latencies, 0.95),
+                    "output_tokens": statistics.mean(output_tokens[stage])}
+            for stage, latencies in sorted(by_stage.items())}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--per-subject", type=int, default=4, help="problems per subject")
+    parser.add_argument("--web-options", choices=["off", "on", "both"], default="both")
+    parser.add_argument("--max-pipelines", type=int, default=None)
+    parser.add_argument("--max-concurrency", type=int, default=16, help="in-flight mock calls")
+    parser.add_argument("--latency-median", type=float, default=0.05)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--output-words", type=int, default=200)
+    parser.add_argument("--base-delay", type=float, default=0.05, help="rate limiter backoff base (seconds)")
+    parser.add_argument("--cache", default="bypass", choices=["bypass", "write_through", "read_only"])
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--structured-grading", action="store_true", help="JSON grades instead of VERDICT lines")
+    parser.add_argument("--rubric-grading", choices=["off", "items", "check"], default="off")
+    parser.add_argument("--search-backend", choices=["hosted", "local"], default="hosted")
+    parser.add_argument("--corpus", default=None, help="local search corpus directory (--search-backend local)")
+    parser.add_argument("--hedge-percentile", type=float, default=None, help="hedge calls slower than this percentile")
+    parser.add_argument("--hedge-min-samples", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dataset", default="test.json")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args()
+    if args.search_backend == "local" and not args.corpus:
+        parser.error("--search-backend local needs --corpus")
+    output_json = os.path.abspath(args.json) if args.json else None
+
+    workdir = prepare_workdir(args)
+    import asyncio
+    import AsyncRunner
+    import Analyzer
+    import main as pipeline
+    from ChatSession import ChatSession
+    from MockProvider import mock_settings
+    from PromptFactory import PromptFactory
+
+    pipeline.GRADING_PROVIDER = "mock"
+    pipeline.GRADING_MODEL = "mock"
+    ChatSession.MAX_CONCURRENCY["mock"] = args.max_concurrency
+    ChatSession.rate_limiter.base_delay = args.base_delay
+    webs = {"off": [False], "on": [True], "both": [False, True]}[args.web_options]
+    options = [("mock", "mock", web) for web in webs]
+    problems = pipeline.problems.sample_by_subject(args.per_subject, seed=args.seed)
+    report = {"problems": len(problems), "options": len(options), "phases": {}}
+
+    start = time.perf_counter()
+    results = asyncio.run(AsyncRunner.run_problems(problems, options, max_pipelines=args.max_pipelines,
+                                                   api_key="", stream=args.stream,
+                                                   structured_grading=args.structured_grading,
+                                                   rubric_grading=args.rubric_grading,
+                                                   search_backend=args.search_backend))
+    wall = time.perf_counter() - start
+    failed = sum(1 for r in results if isinstance(r, BaseException))
+    report["phases"]["full_pipeline"] = {
+        "seconds": wall,
+        "pipelines": len(results),
+        "failed": failed,
+        "problems_per_minute": len(problems) * 60 / wall,
+        "pipelines_per_minute": (len(results) - failed) * 60 / wall,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    start = time.perf_counter()
+    answers = os.path.join("Responses", "DefaultAnswers")
+    grading_prompt_func = (PromptFactory.get_structured_grading_prompt if args.structured_grading
+                           else PromptFactory.get_grading_prompt)
+    pipeline.grade_answers_from_directory(grading_prompt_func, answers, problems[0], "bench",
+                                          structured=args.structured_grading)
+    wall = time.perf_counter() - start
+    graded = len(os.listdir(answers))
+    report["phases"]["grade_answers_from_directory"] = {
+        "seconds": wall, "files": graded, "files_per_minute": graded * 60 / wall, "peak_rss_mb": peak_rss_mb(),
+    }
+
+    start = time.perf_counter()
+    index = Analyzer.index_grading_directories(index_path="results_index.sqlite")
+    Analyzer.report_grouped(index, by=("subject", "web_enabled", "variant"), output_file="grouped.txt")
+    try:
+        import numpy  # noqa: F401
+        Analyzer.report_paired(index, output_file="paired.txt")
+    except ImportError:
+        print("numpy not installed: skipping the paired bootstrap")
+    index.close()
+    report["phases"]["analyzer"] = {"seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+    report["stages"] = stage_latencies(os.environ["TELEMETRY_LEDGER"])
+    if args.rubric_grading == "check":
+        from RubricGrader import agreement_log
+        report["rubric_agreement"] = agreement_log.summary()
+    if args.search_backend == "local":
+        from LocalRetrieval import get_default_retrieval
+        report["local_search"] = get_default_retrieval().stats()
+    if ChatSession.hedge_policy is not None:
+        report["hedging"] = ChatSession.hedge_policy.summary()
+    report["mock"] = {"calls": mock_settings.calls, "injected_failures": mock_settings.failures,
+                      "retries": ChatSession.rate_limiter.retries}
+
+    print(f"\n======= {len(problems)} problems x {len(options)} options on the mock provider =======")
+    for name, phase in report["phases"].items():
+        extra = ", ".join(f"{k} {v:.1f}" if isinstance(v, float) else f"{k} {v}"
+                          for k, v in phase.items() if k not in ("seconds", "peak_rss_mb"))
+        print(f"{name:<30} {phase['seconds']:>7.2f}s | peak RSS {phase['peak_rss_mb']:>6.1f} MB | {extra}")
+    print(f"\n{'STAGE':<24} | {'CALLS':>5} | {'P50 s':>7} | {'P95 s':>7} | {'OUT TOK':>7}")
+    print("-" * 62)
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<24} | {stats['calls']:>5} | {stats['p50']:>7.3f} | {stats['p95']:>7.3f} | "
+              f"{stats['output_tokens']:>7.0f}")
+    if "rubric_agreement" in report:
+        print()
+        agreement_log.report()
+    if "local_search" in report:
+        local = report["local_search"]
+        print(f"\nlocal searches {local['searches']} ({local['cache_hits']} cached), "
+              f"{local['search_seconds'] * 1000:.1f} ms in total")
+    if "hedging" in report:
+        hedging = report["hedging"]
+        print(f"\nhedged {hedging['hedged']} of {hedging['calls']} calls ({hedging['hedge_rate']:.1%}), "
+              f"{hedging['hedge_wins']} won by the duplicate, extra cost ${hedging['extra_cost']:.4f}")
+    print(f"\nmock calls {report['mock']['calls']}, injected failures {report['mock']['injected_failures']}, "
+          f"retries {report['mock']['retries']}")
+
+    if output_json:
+        with open(output_json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    os.chdir(REPO_ROOT)
+    if args.keep:
+        print(f"Scratch directory kept: {workdir}")
+    else:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
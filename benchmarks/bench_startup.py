@@ -0,0 +1,56 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Startup-time benchmark: every case runs in a fresh interpreter, from the repo root.
+# "eager SDK imports" is what every entry point used to pay before the SDKs were made lazy.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["openai", "anthropic", "httpx", "pydantic", "numpy"]
+
+CASES = {
+    "python -c pass (baseline)": "pass",
+    "import ChatSession": "import ChatSession",
+    "import main": "import main",
+    "import Analyzer": "import Analyzer",
+    "cli.py --help": "import cli\ntry:\n    cli.main(['--help'])\nexcept SystemExit:\n    pass",
+    "eager SDK imports (old startup)": "import openai, anthropic",
+}
+
+
+def run_case(code, repeats):
+    probe = (f"{code}\nimport sys, json\n"
+             f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    timings = []
+    loaded = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", probe], cwd=REPO_ROOT, capture_output=True, text=True)
+        timings.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+        loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return statistics.median(timings), loaded
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'CASE':<34} | {'MEDIAN':>9} | HEAVY MODULES LOADED")
+    print("-" * 80)
+    for name, code in CASES.items():
+        median, loaded = run_case(code, args.repeats)
+        if median is None:
+            print(f"{name:<34} | {'n/a':>9} | failed: {loaded}")
+        else:
+            print(f"{name:<34} | {median * 1000:>7.1f}ms | {', '.join(loaded) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+import argparse
+import os
+import sys
+
+# Only argparse is imported up front: every command imports what it needs when it runs,
+# and the provider SDKs are loaded by ChatSession only for the providers actually used.
+
+DEFAULT_OPTION = ("anthropic", "claude-opus-4-5-20251101", "no")
+
+
+def _yes(value):
+    return str(value).lower() in ("1", "true", "yes", "y", "web", "web_enabled")
+
+
+def _problem_indices(args, problems):
+    if args.problems:
+        return list(args.problems)
+    return problems.sample_indices_by_subject(args.per_subject, seed=args.seed)
+
+
+def _options(args):
+    return [(provider, model, _yes(web)) for provider, model, web in (args.option or [DEFAULT_OPTION])]
+
+
+def _max_concurrency(args):
+    max_concurrency = {}
+    for limit in args.max_concurrency or []:
+        provider, n = limit.split("=")
+        max_concurrency[provider] = int(n)
+    return max_concurrency or None
+
+
+def _apply_budget(args):
+    # through the environment, so sweep worker processes pick the caps up too (per process for
+    # --budget-run, shared through the ledger for --budget-day)
+    caps = {"BUDGET_RUN_CAP": args.budget_run, "BUDGET_DAY_CAP": args.budget_day,
+            "BUDGET_RESERVE_FRACTION": args.budget_reserve}
+    if args.budget_run is None and args.budget_day is None:
+        return None
+    for name, value in caps.items():
+        if value is not None:
+            os.environ[name] = str(value)
+    from BudgetController import budget_from_env
+    from ChatSession import ChatSession
+    ChatSession.budget = budget_from_env()
+    return ChatSession.budget
+
+
+def _apply_hedging(args):
+    # like the budget caps, through the environment so sweep workers get the same policy
+    if args.hedge_percentile is None and not args.stage_timeout:
+        return None
+    if args.hedge_percentile is not None:
+        os.environ["HEDGE_PERCENTILE"] = str(args.hedge_percentile)
+    if args.stage_timeout:
+        os.environ["STAGE_TIMEOUTS"] = ",".join(args.stage_timeout)
+    from ChatSession import ChatSession
+    from HedgePolicy import hedge_policy_from_env
+    ChatSession.hedge_policy = hedge_policy_from_env()
+    return ChatSession.hedge_policy
+
+
+def _pipeline_args(args):
+    # JSON-serializable, so a sweep plan can store them; history_budget is HistoryBudget kwargs
+    history_budget = None
+    if args.max_input_tokens or args.keep_last_turns is not None:
+        history_budget = dict(max_input_tokens=args.max_input_tokens, keep_last_turns=args.keep_last_turns,
+                              summarize=args.summarize_history)
+    return dict(
+        grade_projected=not args.no_projected,
+        grade_default=not args.no_default,
+        grade_reprojected=not args.no_reprojected,
+        clean_chat=args.clean_chat,
+        keep_chat=not args.no_keep_chat,
+        high_reasoning=not args.low_reasoning,
+        force_search=args.force_search,
+        stream=args.stream,
+        resume=not args.no_resume,
+        history_budget=history_budget,
+        structured_grading=args.structured_grading,
+        rubric_grading=args.rubric_grading,
+        search_backend=args.search_backend,
+    )
+
+
+def cmd_run(args):
+    from AsyncRunner import run_sweep
+    from main import problems
+
+    selected = [problems[i] for i in _problem_indices(args, problems)]
+    pipeline_args = _pipeline_args(args)
+    if pipeline_args["history_budget"]:
+        from HistoryBudget import HistoryBudget
+        pipeline_args["history_budget"] = HistoryBudget(**pipeline_args["history_budget"])
+    budget = _apply_budget(args)
+    hedge_policy = _apply_hedging(args)
+
+    try:
+        run_sweep(
+            selected, _options(args),
+            id_start=args.id_start,
+            max_concurrency=_max_concurrency(args),
+            max_pipelines=args.max_pipelines,
+            api_key=os.environ.get("OPENAI_API_KEY", ""),
+            **pipeline_args,
+        )
+    finally:
+        if budget is not None:
+            budget.summary()
+        if hedge_policy is not None:
+            hedge_policy.report()
+
+
+def cmd_sweep(args):
+    import SweepRunner
+
+    sweep_dir = SweepRunner.sweep_path(args.name, args.root)
+    if args.action == "plan":
+        from ProblemDataset import ProblemDataset
+        problems = ProblemDataset(args.dataset)
+        SweepRunner.plan(args.name, _problem_indices(args, problems), _options(args), id_start=args.id_start,
+                         pipeline_args=_pipeline_args(args), root=args.root, dataset_path=args.dataset)
+        return
+    if args.action == "status":
+        SweepRunner.status(sweep_dir, shards=args.shards)
+        return
+
+    _apply_budget(args)
+    _apply_hedging(args)
+    if args.max_concurrency:
+        # per worker process: the in-flight limit of the whole sweep is this times the process count
+        from ChatSession import ChatSession
+        ChatSession.MAX_CONCURRENCY.update(_max_concurrency(args))
+    worker_args = dict(shard=args.shard, shards=args.shards, max_pipelines=args.max_pipelines or 4,
+                       retry_failed=args.retry_failed)
+    if args.action == "work":
+        SweepRunner.run_worker(sweep_dir, **worker_args)
+    else:
+        SweepRunner.run_local(sweep_dir, processes=args.processes, **worker_args)
+
+
+def cmd_watch(args):
+    from main import problems
+    from WatchGrader import watch
+
+    _apply_budget(args)
+    _apply_hedging(args)
+    try:
+        watch(args.directory, problems[args.problem], args.save_prefix, once=args.once, idle_exit=args.idle_exit,
+              structured=args.structured, max_in_flight=args.max_in_flight, queue_size=args.queue_size,
+              poll_interval=args.interval, settle_seconds=args.settle, state_path=args.state)
+    except KeyboardInterrupt:
+        print("Stopped watching; graded answers are recorded and skipped next time")
+
+
+def cmd_grade_dir(args):
+    from main import grade_answers_from_directory, problems
+    from PromptFactory import PromptFactory
+
+    backend = None
+    if args.local_batch:
+        from BatchGrader import LocalBatchBackend
+        backend = LocalBatchBackend()
+    grading_prompt_func = (PromptFactory.get_structured_grading_prompt if args.structured
+                           else PromptFactory.get_grading_prompt)
+    _apply_budget(args)
+    _apply_hedging(args)
+    grade_answers_from_directory(grading_prompt_func, args.directory, problems[args.problem],
+                                 args.save_prefix, batch=args.batch or args.local_batch, batch_backend=backend,
+                                 structured=args.structured)
+
+
+def cmd_analyze(args):
+    if args.text:
+        from Analyzer import extract_verdicts_to_table, group_results_by_subject
+
+        for directory in args.extract or []:
+            extract_verdicts_to_table(directory, args.results)
+        group_results_by_subject(args.results, args.grouped)
+        return
+
+    from Analyzer import index_grading_directories, report_grouped, report_paired
+
+    index = index_grading_directories(args.extract, args.index)
+    if args.paired:
+        report_paired(index, baseline=args.baseline, n_resamples=args.resamples, output_file=args.output)
+    else:
+        filters = dict(f.split("=", 1) for f in args.where or [])
+        report_grouped(index, by=args.group_by, output_file=args.output, **filters)
+    index.close()
+
+
+def cmd_rubric_agreement(args):
+    from RubricGrader import AgreementLog, agreement_log
+
+    selected = AgreementLog(args.path) if args.path else agreement_log
+    selected.report(tolerance=args.tolerance, run_id=args.run)
+
+
+def cmd_ledger(args):
+    import time
+    from Telemetry import TelemetryLedger, ledger
+
+    selected = TelemetryLedger(args.path) if args.path else ledger
+    since = time.time() - args.days * 86400 if args.days else None
+    selected.summary(run_id=args.run, since=since, top=args.top)
+
+
+def cmd_transcripts(args):
+    from TranscriptStore import TranscriptStore, transcript_store
+
+    store = TranscriptStore(args.path) if args.path else transcript_store
+    if args.action == "export":
+        if args.name:
+            for name in args.name:
+                print(f"Exported {store.export(name, os.path.join(args.out, os.path.basename(name)) if args.out else None)}")
+        else:
+            store.export_all(args.out, args.match)
+    elif args.action == "list":
+        for name in sorted(store.transcripts()):
+            if args.match in name:
+                print(name)
+    else:
+        stats = store.stats()
+        for key, value in stats.items():
+            print(f"{key:<20} {value}")
+        if stats["stored_bytes"]:
+            print(f"{'text / stored':<20} {stats['text_export_bytes'] / stats['stored_bytes']:.1f}x")
+
+
+def _add_matrix_arguments(parser):
+    parser.add_argument("--problems", type=int, nargs="*", help="problem indices in test.json")
+    parser.add_argument("--per-subject", type=int, default=3, help="random problems per subject when --problems is not given")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--option", nargs=3, action="append", metavar=("PROVIDER", "MODEL", "WEB"),
+                     help="repeatable, e.g. --option openai gpt-5.2 yes")
+    parser.add_argument("--id-start", type=int, default=200)
+    parser.add_argument("--no-projected", action="store_true")
+    parser.add_argument("--no-default", action="store_true")
+    parser.add_argument("--no-reprojected", action="store_true")
+    parser.add_argument("--clean-chat", action="store_true")
+    parser.add_argument("--no-keep-chat", action="store_true")
+    parser.add_argument("--low-reasoning", action="store_true")
+    parser.add_argument("--force-search", action="store_true")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--no-resume", action="store_true")
+    parser.add_argument("--max-input-tokens", type=int, default=None, help="trim chat history sent per request to this")
+    parser.add_argument("--keep-last-turns", type=int, default=None, help="send only the first and the last N turns")
+    parser.add_argument("--summarize-history", action="store_true", help="summarize trimmed turns instead of dropping them")
+    parser.add_argument("--structured-grading", action="store_true", help="JSON grades with per-rubric-item points")
+    parser.add_argument("--search-backend", choices=["hosted", "local"], default="hosted",
+                        help="web-enabled options search the web (hosted) or the local corpus (LOCAL_SEARCH_CORPUS)")
+    parser.add_argument("--rubric-grading", choices=["off", "items", "check"], default="off",
+                        help="grade rubric items concurrently; 'check' also runs the single-call grader and logs agreement")
+
+
+def _add_budget_arguments(parser):
+    parser.add_argument("--budget-run", type=float, default=None, help="dollar cap on this run's API calls")
+    parser.add_argument("--budget-day", type=float, default=None,
+                        help="dollar cap on today's API calls (every run sharing the ledger)")
+    parser.add_argument("--budget-reserve", type=float, default=None,
+                        help="share of each cap new problems leave to finishing started ones (default 0.1)")
+
+
+def _add_hedging_arguments(parser):
+    parser.add_argument("--hedge-percentile", type=float, default=None,
+                        help="send a duplicate of a call slower than this latency percentile of its stage "
+                             "(e.g. 0.95; async pipeline calls only, sync calls only get the deadlines)")
+    parser.add_argument("--stage-timeout", nargs="*", metavar="STAGE=SECONDS",
+                        help="deadline per stage or stage prefix, e.g. grade=300 default=900")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Projection experiments: run, grade and analyze")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run full_pipeline over problems x options")
+    _add_matrix_arguments(run)
+    run.add_argument("--max-concurrency", nargs="*", metavar="PROVIDER=N")
+    run.add_argument("--max-pipelines", type=int, default=None)
+    _add_budget_arguments(run)
+    _add_hedging_arguments(run)
+    run.set_defaults(func=cmd_run)
+
+    grade = sub.add_parser("grade-dir", help="grade every answer file in a directory against one problem")
+    grade.add_argument("directory")
+    grade.add_argument("--problem", type=int, required=True, help="problem index in test.json")
+    grade.add_argument("--save-prefix", required=True)
+    grade.add_argument("--batch", action="store_true", help="grade through the OpenAI batch API")
+    grade.add_argument("--local-batch", action="store_true", help="offline file-based batch stand-in")
+    grade.add_argument("--structured", action="store_true", help="JSON grades with per-rubric-item points")
+    _add_budget_arguments(grade)
+    _add_hedging_arguments(grade)
+    grade.set_defaults(func=cmd_grade_dir)
+
+    watch = sub.add_parser("watch", help="keep grading new or modified answer files in a directory as they appear")
+    watch.add_argument("directory")
+    watch.add_argument("--problem", type=int, required=True, help="problem index in test.json")
+    watch.add_argument("--save-prefix", required=True)
+    watch.add_argument("--structured", action="store_true", help="JSON grades with per-rubric-item points")
+    watch.add_argument("--max-in-flight", type=int, default=4, help="answers graded at the same time")
+    watch.add_argument("--queue-size", type=int, default=16, help="answers waiting for a grader before scanning pauses")
+    watch.add_argument("--interval", type=float, default=2.0, help="seconds between directory scans")
+    watch.add_argument("--settle", type=float, default=2.0, help="skip files modified in the last N seconds")
+    watch.add_argument("--once", action="store_true", help="grade what is there now, then exit")
+    watch.add_argument("--idle-exit", type=float, default=None, help="exit after N seconds without new files")
+    watch.add_argument("--state", default=None, help="seen-set file (default: Watch/<prefix>_<dir>.json)")
+    _add_budget_arguments(watch)
+    _add_hedging_arguments(watch)
+    watch.set_defaults(func=cmd_watch)
+
+    analyze = sub.add_parser("analyze", help="index VERDICT lines and report them grouped")
+    analyze.add_argument("--extract", nargs="*", metavar="DIR",
+                         help="grading directories to (re)index (default: Responses/Grading *)")
+    analyze.add_argument("--index", default=None, help="SQLite results index (default: results_index.sqlite)")
+    analyze.add_argument("--group-by", nargs="+", default=["subject", "variant"],
+                         help="columns: directory provider model subject problem_id web_enabled search variant")
+    analyze.add_argument("--where", nargs="*", metavar="COLUMN=VALUE", help="e.g. --where provider=openai")
+    analyze.add_argument("--paired", action="store_true",
+                         help="bootstrap paired comparison of projection variants against default answers")
+    analyze.add_argument("--baseline", default="default")
+    analyze.add_argument("--resamples", type=int, default=5000)
+    analyze.add_argument("--output", default=None, help="write the report to a file instead of stdout")
+    analyze.add_argument("--text", action="store_true", help="legacy results.txt / grouped_results.txt reports")
+    analyze.add_argument("--results", default="results.txt")
+    analyze.add_argument("--grouped", default="grouped_results.txt")
+    analyze.set_defaults(func=cmd_analyze)
+
+    ledger = sub.add_parser("ledger", help="summarize cost and latency per stage from the telemetry ledger")
+    ledger.add_argument("--run", default=None, help="only this run id (a pipeline save_suffix)")
+    ledger.add_argument("--days", type=float, default=None, help="only calls from the last N days")
+    ledger.add_argument("--top", type=int, default=10)
+    ledger.add_argument("--path", default=None, help="ledger file (default: Telemetry/ledger.jsonl)")
+    ledger.set_defaults(func=cmd_ledger)
+
+    agreement = sub.add_parser("rubric-agreement", help="compare rubric-item grades with single-call grades "
+                                                        "(runs with --rubric-grading check)")
+    agreement.add_argument("--run", default=None, help="only run ids containing this")
+    agreement.add_argument("--tolerance", type=float, default=1.0, help="points counted as agreeing")
+    agreement.add_argument("--path", default=None, help="agreement log (default: Telemetry/rubric_agreement.jsonl)")
+    agreement.set_defaults(func=cmd_rubric_agreement)
+
+    sweep = sub.add_parser("sweep", help="sharded multi-process / multi-machine sweep through a shared work queue")
+    sweep.add_argument("action", choices=["plan", "work", "local", "status"],
+                       help="plan: write the work units; work: run one queue worker; "
+                            "local: run a pool of workers on this machine; status: progress")
+    sweep.add_argument("name", help="sweep name (directory under --root)")
+    sweep.add_argument("--root", default="Sweeps", help="shared sweep directory")
+    sweep.add_argument("--dataset", default="test.json")
+    _add_matrix_arguments(sweep)
+    sweep.add_argument("--shard", type=int, default=0, help="run only units with index %% shards == shard")
+    sweep.add_argument("--shards", type=int, default=1)
+    sweep.add_argument("--processes", type=int, default=None, help="local: worker processes (default: CPU count)")
+    sweep.add_argument("--max-pipelines", type=int, default=None, help="pipelines in flight per worker (default 4)")
+    sweep.add_argument("--max-concurrency", nargs="*", metavar="PROVIDER=N", help="in-flight API calls per worker")
+    sweep.add_argument("--retry-failed", action="store_true")
+    _add_budget_arguments(sweep)
+    _add_hedging_arguments(sweep)
+    sweep.set_defaults(func=cmd_sweep)
+
+    transcripts = sub.add_parser("transcripts", help="list, export (to FullChats text) or size up stored transcripts")
+    transcripts.add_argument("action", choices=["export", "list", "stats"])
+    transcripts.add_argument("--name", nargs="*", help="transcripts to export (default: all matching --match)")
+    transcripts.add_argument("--match", default="", help="substring filter on transcript names")
+    transcripts.add_argument("--out", default=None, help="export directory (default: the original FullChats/ path)")
+    transcripts.add_argument("--path", default=None, help="store directory (default: Transcripts)")
+    transcripts.set_defaults(func=cmd_transcripts)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
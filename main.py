@@ -1,11 +1,15 @@
 import json
 from ChatSession import  ChatSession
 import os
-from openai import OpenAI
 import time
-from random import shuffle
 GRADING_MODEL= "gpt-5"
-from PromptFactory import PromptFactory
+GRADING_PROVIDER = "openai"
+from PromptFactory import PromptFactory, grading_schema
+from RunManifest import RunManifest
+from ProblemDataset import ProblemDataset
+from StageGraph import StageGraph
+from TranscriptStore import transcript_store, format_transcript
+from RubricGrader import RubricGrader, agreement_log, format_grade
 
 FULL_PATH = ""
 PROBLEM_REFORMATION_PREFIX = "I'm being asked the following but I don't understand anything about material/life sciences. Explain what these are like I'm in middle school, and frame the questions in the same way. \n"
@@ -33,37 +37,84 @@ Then, tally the points up and write VERDICT: ¡total˙points¿ in the last line
 no other text. For example, VERDICT: 2.5 or VERDICT: 8."
 
 
-problems = []
-with open("test.json", "r", encoding="utf-8") as f:
-    for line in f:
-        if line.strip():
-            problems.append(json.loads(line))
-
-    x = 1
+# indexed once into test.json.index.json; problems are only parsed when accessed
+problems = ProblemDataset("test.json")
 
+api_key=os.environ.get("OPENAI_API_KEY")
 
 
+def file_grade_paths(fname, save_prefix):
+    # (grade, transcript) paths of an answer file graded by grade_answer_from_file
+    filename = os.path.basename(fname)
+    return (os.path.join("Responses", "Grading from files", f"{save_prefix}_high_reasoning_{filename}"),
+            os.path.join("FullChats", f"{save_prefix}_file_grading_{filename}"))
 
-def grade_answer_from_file(grading_prompt_func,fname, problem_d, save_prefix):
-    from pathlib import Path
-    filename = Path(fname).name
+def grade_answer_from_file(grading_prompt_func,fname, problem_d, save_prefix, batch = None, structured = False):
     with open(fname, encoding="utf-8") as f:
         answer = f.read()
         full_problem = problem_d["problem"]
-        problem = clean_problem(full_problem)
+        problem = problem_d.get("clean_problem") or clean_problem(full_problem)
         rubric = problem_d["answer"]
-        default_grade_save_path = os.path.join("Responses", "Grading from files", f"{save_prefix}_high_reasoning_{filename}")
-        default_grade_full_chat_path = os.path.join("FullChats", f"{save_prefix}_file_grading_{filename}")
+        default_grade_save_path, default_grade_full_chat_path = file_grade_paths(fname, save_prefix)
         grade_answer_high_reasoning(grading_prompt_func,problem, answer, rubric, default_grade_save_path,
-                                    default_grade_full_chat_path)
+                                    default_grade_full_chat_path, batch=batch, structured=structured)
+
+async def async_grade_answer_from_file(grading_prompt_func, fname, problem_d, save_prefix, structured = False):
+    with open(fname, encoding="utf-8") as f:
+        answer = f.read()
+    problem = problem_d.get("clean_problem") or clean_problem(problem_d["problem"])
+    grade_save_path, history_path = file_grade_paths(fname, save_prefix)
+    return await async_grade_answer_high_reasoning(grading_prompt_func, problem, answer, problem_d["answer"],
+                                                   grade_save_path, history_path, stage="grade_file",
+                                                   structured=structured)
 
 def get_and_save_response(chat, prompt, save_path, force_search = False):
-    time.sleep(100)
+    # Pacing and retries are done by ChatSession's shared rate limiter
+    if chat.stream:
+        # deltas are appended to save_path while the answer is generated
+        return "".join(chat.stream_message(prompt, force_search=force_search, save_path=save_path))
     response = chat.send_message(prompt, force_search=force_search)
     with open(save_path, "w", encoding="utf-8") as f:
         f.write(response)
     return response
 
+async def async_get_and_save_response(chat, prompt, save_path, force_search = False):
+    # No fixed sleep here: concurrency and rate limits are handled inside ChatSession
+    if chat.stream:
+        return "".join([delta async for delta in chat.async_stream_message(prompt, force_search=force_search, save_path=save_path)])
+    response = await chat.async_send_message(prompt, force_search=force_search)
+    with open(save_path, "w", encoding="utf-8") as f:
+        f.write(response)
+    return response
+
+async def async_chat_stage(manifest, stage, chat, prompt, save_path, force_search = False):
+    # Skips the stage when the manifest says it already finished with the same inputs.
+    # Chat stages continue a conversation, so a skipped stage replays its turn into the history.
+    inputs_hash = RunManifest.hash_inputs(chat.provider, chat.model_name, chat.history, prompt, force_search)
+    # label the telemetry records of this call
+    chat.stage = stage
+    if manifest is not None:
+        chat.run_id = manifest.run_id
+        output = manifest.completed_output(stage, inputs_hash)
+        if output is not None:
+            print(f"\t[resume] {stage} already done, loading {save_path}")
+            chat.history.append({"role": "user", "content": prompt})
+            chat.history.append({"role": "assistant", "content": output})
+            return output
+        manifest.start(stage, inputs_hash, save_path)
+    cost_before = chat.total_cost
+    try:
+        output = await async_get_and_save_response(chat, prompt, save_path, force_search=force_search)
+    except Exception as e:
+        if manifest is not None:
+            manifest.fail(stage, e)
+        raise
+    if manifest is not None:
+        # a stream cut off at max_output_chars or interrupted is a partial answer: resume must request it again
+        status = "truncated" if chat.last_call_metrics.get("truncated") else "done"
+        manifest.finish(stage, chat.total_cost - cost_before, status=status)
+    return output
+
 def clean_problem(raw_text, remove_cot = True):
     # 1. Remove the "Context:" and "Question:" labels
     # We use .replace() for simple targeted removals
@@ -106,7 +157,29 @@ def get_problem_reprojection(chat, problem_projection, reprojection_prompt_func,
     return get_and_save_response(chat, prompt, save_suffix, force_search=force_search)
 
 
+async def async_get_problem_projection_pipeline(chat, problem_d, save_suffix, projection_prompt_func, project_answer_prompt_func, force_search = False, manifest = None):
+    print("\t1. projecting problem")
+    simplification_response_save_path = os.path.join("Responses", "Simplification", save_suffix)
+    await async_chat_stage(manifest, "project", chat, projection_prompt_func(problem_d), simplification_response_save_path)
+    #answering projected problem:
+    print("\t2. answering projection")
+    projection_answer_path = os.path.join("Responses", "Projection Answer", save_suffix)
+    projection_answer_prompt = project_answer_prompt_func()
+    projection_answer = await async_chat_stage(manifest, "answer_projection", chat, projection_answer_prompt,  projection_answer_path, force_search=force_search)
+
+    return projection_answer, chat
+
+async def async_get_problem_reprojection(chat, problem_projection, reprojection_prompt_func, save_suffix, force_search = False, manifest = None, stage = "reproject"):
+    prompt  = reprojection_prompt_func(problem_projection)
+    return await async_chat_stage(manifest, stage, chat, prompt, save_suffix, force_search=force_search)
+
+
 def full_pipeline(problem_d, id_count, provider, model_name, **kwargs):
+    # closes this loop's async SDK clients before asyncio.run ends it
+    return ChatSession.client_registry.run(async_full_pipeline(problem_d, id_count, provider, model_name, **kwargs))
+
+
+async def async_full_pipeline(problem_d, id_count, provider, model_name, **kwargs):
     # Extract defaults from kwargs
     api_key = kwargs.get("api_key", "")
     grade_projected = kwargs.get("grade_projected", True)
@@ -117,128 +190,203 @@ def full_pipeline(problem_d, id_count, provider, model_name, **kwargs):
     web_enabled = kwargs.get("web_enabled", False)
     high_reasoning = kwargs.get("high_reasoning", True)
     force_search = kwargs.get("force_search", False)
+    # search_backend: "hosted" provider web search or "local" (LocalRetrieval) when web_enabled
+    search_backend = kwargs.get("search_backend", "hosted")
     projection_prompt_func = kwargs.get("projection_prompt_func", PromptFactory.get_projection_prompt)
     reprojection_prompt_func = kwargs.get("reprojection_prompt_func", PromptFactory.get_reprojection_prompt)
     project_answer_prompt_func = kwargs.get("projection_answer_prompt_func", PromptFactory.get_projection_answer_prompt)
-    grading_prompt_func = kwargs.get("grading_prompt_func", PromptFactory.get_grading_prompt)
+    # structured_grading: grades are JSON (per-item points and total) constrained by grading_schema()
+    structured_grading = kwargs.get("structured_grading", False)
+    # rubric_grading: "off" one call per grade; "items" rubric items graded concurrently and summed
+    # (RubricGrader); "check" both, keeping the monolithic grade and logging their agreement
+    rubric_grading = kwargs.get("rubric_grading", "off")
+    grading_prompt_func = kwargs.get("grading_prompt_func", PromptFactory.get_structured_grading_prompt
+                                     if structured_grading else PromptFactory.get_grading_prompt)
+    resume = kwargs.get("resume", True)
+    stream = kwargs.get("stream", False)
+    max_output_chars = kwargs.get("max_output_chars", None)
+    # HistoryBudget shared by this pipeline's answer chats (None: send the full history)
+    history_budget = kwargs.get("history_budget", None)
+    # projection_snapshot: the projection chat of an earlier run of this problem (a HistorySnapshot,
+    # see async_fan_out_pipeline); its branches fork it instead of projecting again
+    projection_snapshot = kwargs.get("projection_snapshot", None)
 
     #small definitions
     subject = problem_d["subject"]
     full_problem = problem_d["problem"]
-    problem = clean_problem(full_problem)
+    problem = problem_d.get("clean_problem") or clean_problem(full_problem)
     rubric = problem_d["answer"]
-    web_text = "web_enabled" if web_enabled else "web_disabled"
+    web_text = "web_disabled"
+    if web_enabled:
+        web_text = "web_local" if search_backend == "local" else "web_enabled"
     save_suffix = f"{provider}_{model_name}_{subject}_{id_count}_{web_text}.txt"
+    # per-run stage record; on restart finished stages are reloaded instead of re-requested
+    manifest = RunManifest(save_suffix) if resume else None
+
+    def new_chat():
+        return ChatSession(
+            provider=provider,
+            model_name=model_name,
+            api_key=api_key,
+            web_enabled=web_enabled,
+            high_reasoning=high_reasoning,
+            cache_salt=str(id_count),
+            stream=stream,
+            max_output_chars=max_output_chars,
+            run_id=save_suffix,
+            history_budget=history_budget,
+            search_backend=search_backend,
+        )
+
+    def grade(stage, answer_stage, save_path, history_path):
+        async def run(results):
+            print(f"Grading {answer_stage}")
+            if rubric_grading != "off":
+                return await async_grade_answer_by_items(grading_prompt_func, problem, results[answer_stage], rubric,
+                                                         save_path, history_path, problem_d.get("task_group_id"),
+                                                         manifest=manifest, stage=stage, check=rubric_grading == "check",
+                                                         structured=structured_grading, run_id=save_suffix)
+            return await async_grade_answer_high_reasoning(grading_prompt_func, problem, results[answer_stage], rubric,
+                                                           save_path, history_path, manifest=manifest, stage=stage,
+                                                           structured=structured_grading, run_id=save_suffix)
+        return run
+
+    # Stages run as soon as their inputs exist: the default-answer branch runs alongside the
+    # projection branch, and every grading step starts right after the answer it grades.
+    graph = StageGraph(save_suffix)
     #initializing chat
-    chat = ChatSession(
-        provider=provider,
-        model_name=model_name,
-        api_key=api_key,
-        web_enabled=web_enabled,
-        high_reasoning=high_reasoning,
-    )
-    projection_histories = []
+    chat = new_chat()
+    # snapshots the reprojection branches fork from; they share the projection turns
+    branches = {}
     #getting problem projection:
     if grade_projected:
+        async def project(results):
+            if projection_snapshot is not None:
+                print("Reusing the projection of an earlier run")
+                branches["projection"] = projection_snapshot
+                save_projection_outputs(projection_snapshot, save_suffix)
+                if not keep_chat:
+                    write_history(os.path.join("FullChats", f"projection_chat_{save_suffix}"), [projection_snapshot.messages])
+                return projection_snapshot.last_output()
+            print("Projecting problem to lower space")
+            problem_projection, _ = await async_get_problem_projection_pipeline(chat, problem_d, save_suffix, projection_prompt_func, project_answer_prompt_func, manifest=manifest)
+            branches["projection"] = chat.snapshot()
+            if not keep_chat:
+                projection_hist_path = os.path.join("FullChats", f"projection_chat_{save_suffix}")
+                write_history(projection_hist_path, [chat.get_history()])
+            return problem_projection
+        graph.add("answer_projection", project)
 
-        print("Projecting problem to lower space")
-        problem_projection = get_problem_projection_pipeline(chat, problem, projection_prompt_func,project_answer_prompt_func, save_suffix)
-        projection_histories.append(chat.get_history())
         #grading:
-        print("Grading projected problem")
         projection_grade_save_path  = os.path.join("Responses", "Grading projection", save_suffix)
         projection_grade_full_chat_path = os.path.join("FullChats", f"projection_grading_{save_suffix}")
-        grade_answer_high_reasoning(grading_prompt_func,problem,problem_projection, rubric, projection_grade_save_path, projection_grade_full_chat_path)
-        if not keep_chat:
-            projection_hist_path = os.path.join("FullChats", f"projection_chat_{save_suffix}")
-            write_history(projection_hist_path, [chat.get_history()])
-        # grading_chat.save_history(projection_hist_path)
+        graph.add("grade_projection", grade("grade_projection", "answer_projection", projection_grade_save_path, projection_grade_full_chat_path), deps=["answer_projection"])
 
         #grading reprojected:
         if grade_reprojected:
             if keep_chat:
-                print("Answering problem using projected answer - unclean chat")
-                time.sleep(100)
-                reprojection_path = os.path.join("Responses", "Reprojection", save_suffix)
-                reprojected_answer = get_problem_reprojection(chat, problem_projection, reprojection_prompt_func, reprojection_path, force_search=force_search)
-                projection_histories.append(chat.get_history())
-                # saving history:
-                projection_hist_path = os.path.join("FullChats", f"reprojection_cont_chat_{save_suffix}")
-                write_history(projection_hist_path, [chat.get_history()])
+                async def reproject_keep(results):
+                    print("Answering problem using projected answer - unclean chat")
+                    keep = chat.fork(branches["projection"])
+                    reprojection_path = os.path.join("Responses", "Reprojection", save_suffix)
+                    reprojected_answer = await async_get_problem_reprojection(keep, results["answer_projection"], reprojection_prompt_func, reprojection_path, force_search=force_search, manifest=manifest, stage="reproject_keep")
+                    branches["keep"] = keep.snapshot()
+                    # saving history:
+                    projection_hist_path = os.path.join("FullChats", f"reprojection_cont_chat_{save_suffix}")
+                    write_history(projection_hist_path, [keep.get_history()])
+                    return reprojected_answer
+                graph.add("reproject_keep", reproject_keep, deps=["answer_projection"])
 
-                # grading
-                print("Grading reprojection")
-                time.sleep(100)
                 reprojection_grade_save_path = os.path.join("Responses", "Grading from projection", save_suffix)
                 reprojection_grade_full_chat_path = os.path.join("FullChats", f"reprojection_grading_{save_suffix}")
-                grade_answer_high_reasoning(grading_prompt_func,problem, reprojected_answer, rubric, reprojection_grade_save_path,reprojection_grade_full_chat_path)
-
-
-            if clean_chat:
-                chat = ChatSession(
-                    provider=provider,
-                    model_name=model_name,
-                    api_key=api_key,
-                    web_enabled=web_enabled,
-                    high_reasoning=high_reasoning,
-                )
-            print("Answering problem using projected answer - clean chat")
-            time.sleep(100)
-            reprojection_path  = os.path.join("Responses", "Reprojection", f"clean_{save_suffix}")
-            reprojected_answer = get_problem_reprojection(chat, problem_projection, reprojection_prompt_func, reprojection_path, force_search=force_search)
-            projection_hist_path = os.path.join("FullChats", f"reprojection_clean_chat_{save_suffix}")
-            write_history(projection_hist_path, [chat.get_history()])
+                graph.add("grade_reproject_keep", grade("grade_reproject_keep", "reproject_keep", reprojection_grade_save_path, reprojection_grade_full_chat_path), deps=["reproject_keep"])
+
+            # Without clean_chat this step continues the projection chat where the keep-chat
+            # reprojection left it, so it forks that branch once it has finished
+            clean_deps = ["reproject_keep"] if keep_chat and not clean_chat else ["answer_projection"]
+
+            async def reproject_clean(results):
+                if clean_chat:
+                    clean = new_chat()
+                else:
+                    clean = chat.fork(branches["keep"] if keep_chat else branches["projection"])
+                print("Answering problem using projected answer - clean chat")
+                reprojection_path  = os.path.join("Responses", "Reprojection", f"clean_{save_suffix}")
+                reprojected_answer = await async_get_problem_reprojection(clean, results["answer_projection"], reprojection_prompt_func, reprojection_path, force_search=force_search, manifest=manifest, stage="reproject_clean")
+                projection_hist_path = os.path.join("FullChats", f"reprojection_clean_chat_{save_suffix}")
+                write_history(projection_hist_path, [clean.get_history()])
+                return reprojected_answer
+            graph.add("reproject_clean", reproject_clean, deps=clean_deps)
+
             #grading
-            print("Grading reprojection")
             reprojection_grade_save_path = os.path.join("Responses", "Grading from projection", f"{save_suffix}_clean")
             reprojection_grade_full_chat_path = os.path.join("FullChats", f"clean_reprojection_grading_{save_suffix}")
-            time.sleep(100)
-            grade_answer_high_reasoning(grading_prompt_func,problem, reprojected_answer, rubric, reprojection_grade_save_path,reprojection_grade_full_chat_path)
-            #reprojection_hist_path = os.path.join("FullChats", f"reprojection_grading_{save_suffix}")
+            graph.add("grade_reproject_clean", grade("grade_reproject_clean", "reproject_clean", reprojection_grade_save_path, reprojection_grade_full_chat_path), deps=["reproject_clean"])
 
     #grading regular:
     if grade_default:
-        chat = ChatSession(
-            provider=provider,
-            model_name=model_name,
-            api_key=api_key,
-            web_enabled=web_enabled,
-            high_reasoning=high_reasoning,
-        )
-        # get
-        print("Getting default answer")
-        time.sleep(100)
-        default_problem = clean_problem(full_problem, False)
-        default_save_path = os.path.join("Responses", "DefaultAnswers", save_suffix)
-        default_answer = get_and_save_response(chat, default_problem, default_save_path, force_search=force_search)
-        projection_hist_path = os.path.join("FullChats", f"default_answer_chat_{save_suffix}")
-        write_history(projection_hist_path, [chat.get_history()])
-        #grading:
-        time.sleep(100)
-        print("Grading default answer")
+        async def default_answer(results):
+            default_chat = new_chat()
+            print("Getting default answer")
+            default_problem = clean_problem(full_problem, False)
+            default_save_path = os.path.join("Responses", "DefaultAnswers", save_suffix)
+            answer = await async_chat_stage(manifest, "default_answer", default_chat, default_problem, default_save_path, force_search=force_search)
+            projection_hist_path = os.path.join("FullChats", f"default_answer_chat_{save_suffix}")
+            write_history(projection_hist_path, [default_chat.get_history()])
+            return answer
+        graph.add("default_answer", default_answer)
+
         default_grade_save_path = os.path.join("Responses", "Grading default", f"high_reasoning_{save_suffix}")
         default_grade_full_chat_path = os.path.join("FullChats", f"default_grading_{save_suffix}")
-        grade_answer_high_reasoning(grading_prompt_func,problem, default_answer, rubric, default_grade_save_path, default_grade_full_chat_path)
-        #reprojection_hist_path = os.path.join("FullChats", f"default_grading_{save_suffix}")
-        #grading_chat.save_history(reprojection_hist_path)
-    #chat.save_history(history_path)
+        graph.add("grade_default", grade("grade_default", "default_answer", default_grade_save_path, default_grade_full_chat_path), deps=["default_answer"])
+
+    results = await graph.run()
+    print(f"[{save_suffix}] {len(results)} stages done in {graph.wall_seconds():.1f}s")
+    if "projection" in branches:
+        results["projection_snapshot"] = branches["projection"]
+    return results
+
+
+def save_projection_outputs(snapshot, save_suffix):
+    # Simplification / Projection Answer files of a run that reuses another run's projection
+    outputs = [m["content"] for m in snapshot.messages if m["role"] == "assistant"]
+    for folder, output in zip(("Simplification", "Projection Answer"), outputs[-2:]):
+        with open(os.path.join("Responses", folder, save_suffix), "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+def fan_out_pipeline(problem_d, id_counts, provider, model_name, **kwargs):
+    return ChatSession.client_registry.run(async_fan_out_pipeline(problem_d, id_counts, provider, model_name,
+                                                                  **kwargs))
+
+
+async def async_fan_out_pipeline(problem_d, id_counts, provider, model_name, **kwargs):
+    # Repeated runs of one problem that share a single projection: the first id runs the whole
+    # pipeline, the others fork its projection chat and run only the later stages, concurrently
+    import asyncio
+    id_counts = list(id_counts)
+    first = await async_full_pipeline(problem_d, id_counts[0], provider, model_name, **kwargs)
+    snapshot = first.get("projection_snapshot")
+    rest = await asyncio.gather(*(async_full_pipeline(problem_d, id_count, provider, model_name,
+                                                      projection_snapshot=snapshot, **kwargs)
+                                  for id_count in id_counts[1:]))
+    return [first] + list(rest)
 
 
 def write_history(save_path, histories):
+    # Transcripts go to the deduplicating store under their FullChats/ path; the text file is
+    # produced on demand with `cli.py transcripts export`. TRANSCRIPT_STORE="" writes text directly.
+    messages = [line for history in histories for line in history]
+    if transcript_store.enabled:
+        transcript_store.write(save_path, messages)
+        return
     with open(save_path,"w", encoding="utf-8") as f:
-        for history in histories:
-            for line in history:
-                f.write(f"********** {line['role']} ********** \n\n")
-                f.write(f"\t {line['content']}\n\n")
-                f.write("---------------------------------------------------\n\n")
+        f.write(format_transcript(messages))
 
 
 
 def get_high_reasoning_response(client, prompt):
-    COST_INPUT = 1.25 / 1_000_000
-    COST_CACHED = 0.125 / 1_000_000  # 90% discount
-    COST_OUTPUT = 10.00 / 1_000_000
-
+    start = time.perf_counter()
     response = client.responses.create(
         model="gpt-5",
         reasoning={"effort": "high"},
@@ -246,29 +394,15 @@ def get_high_reasoning_response(client, prompt):
         input=[{"role": "user", "content": prompt}]
     )
 
-    usage = response.usage
-
-    # 1. Calculate Input Cost (Standard vs Cached)
-    total_input = usage.input_tokens
-    cached_input = usage.input_tokens_details.cached_tokens
-    standard_input = total_input - cached_input
-
-    input_cost = (standard_input * COST_INPUT) + (cached_input * COST_CACHED)
-
-    # 2. Calculate Output Cost (Visible + Reasoning)
-    total_output = usage.output_tokens
-    reasoning_tokens = usage.output_tokens_details.reasoning_tokens
-    visible_tokens = total_output - reasoning_tokens
-
-    output_cost = total_output * COST_OUTPUT
-
-    # 3. Final Calculation
-    total_cost = input_cost + output_cost
+    # Same pricing table (cached input, reasoning billed as output) as every ChatSession call
+    usage = ChatSession.cost_breakdown("gpt-5", response.usage)
+    ChatSession.ledger.record(stage="high_reasoning_response", provider="openai", model="gpt-5",
+                              latency=time.perf_counter() - start, **usage)
 
     print(f"--- Cost Breakdown ---")
-    print(f"Input: {standard_input} standard, {cached_input} cached")
-    print(f"Output: {visible_tokens} visible, {reasoning_tokens} reasoning")
-    print(f"TOTAL COST: ${total_cost:.6f}")
+    print(f"Input: {usage['input_tokens'] - usage['cached_tokens']} standard, {usage['cached_tokens']} cached")
+    print(f"Output: {usage['output_tokens'] - usage['reasoning_tokens']} visible, {usage['reasoning_tokens']} reasoning")
+    print(f"TOTAL COST: ${usage['cost']:.6f}")
 
     return response.output_text
 
@@ -279,20 +413,99 @@ def grade_answer(chat, problem, answer, rubric, response_save_path, grade_from_t
         prompt = f"{GRADING_ANSWER_PREFIX} {answer} \n Rubric:\n {rubric}\n"
     return get_and_save_response(chat, prompt, response_save_path)
 
-def grade_answer_high_reasoning(grading_prompt_func,problem, answer, rubric, response_save_path, history_path):
+def grade_answer_high_reasoning(grading_prompt_func,problem, answer, rubric, response_save_path, history_path, batch = None, structured = False):
     prompt = grading_prompt_func(problem, rubric, answer)
+    if batch is not None:
+        # queued on a BatchGrader; the grade is written to response_save_path when the batch completes
+        batch.add(prompt, response_save_path, history_path)
+        return None
     grading_chat = ChatSession(
-        provider="openai",
-        model_name="gpt-5",
+        provider=GRADING_PROVIDER,
+        model_name=GRADING_MODEL,
         api_key=api_key,
         web_enabled=False,
-        high_reasoning=True
+        high_reasoning=True,
+        stage="grade",
+        response_schema=grading_schema() if structured else None
     )
     # get
     grade = get_and_save_response(grading_chat, prompt, response_save_path)
     write_history(history_path, [grading_chat.get_history()])
     return grade
 
+async def async_grade_answer_high_reasoning(grading_prompt_func,problem, answer, rubric, response_save_path, history_path, manifest = None, stage = "grade", structured = False, stats = None, run_id = ""):
+    # run_id ties the grading calls' telemetry to their pipeline, with or without a manifest
+    prompt = grading_prompt_func(problem, rubric, answer)
+    grading_chat = ChatSession(
+        provider=GRADING_PROVIDER,
+        model_name=GRADING_MODEL,
+        api_key=api_key,
+        web_enabled=False,
+        high_reasoning=True,
+        run_id=run_id or (manifest.run_id if manifest is not None else ""),
+        response_schema=grading_schema() if structured else None
+    )
+    grade = await async_chat_stage(manifest, stage, grading_chat, prompt, response_save_path)
+    write_history(history_path, [grading_chat.get_history()])
+    if stats is not None:
+        stats["cost"] = grading_chat.total_cost
+    return grade
+
+async def async_grade_answer_by_items(grading_prompt_func, problem, answer, rubric, response_save_path, history_path, task_group_id = None, manifest = None, stage = "grade", check = False, structured = False, run_id = ""):
+    # Every rubric item graded by its own low-effort call, all concurrently (RubricGrader). With
+    # check=True the monolithic grader runs alongside: its grade stays the result, the item grade
+    # goes to Responses/Item grades/ and the agreement of the two to agreement_log
+    import asyncio
+    grader = RubricGrader(GRADING_PROVIDER, GRADING_MODEL, api_key,
+                          run_id=run_id or (manifest.run_id if manifest is not None else ""))
+    items_stage = f"{stage}_items" if check else stage
+    items_save_path = response_save_path
+    items_history_path = history_path
+    if check:
+        items_save_path = os.path.join("Responses", "Item grades", f"{stage}_{os.path.basename(response_save_path)}")
+        items_history_path = os.path.join("FullChats", f"item_grading_{stage}_{os.path.basename(response_save_path)}")
+
+    async def by_items():
+        start = time.perf_counter()
+        inputs_hash = RunManifest.hash_inputs("rubric_items", GRADING_PROVIDER, GRADING_MODEL, grader.reasoning_effort,
+                                              problem, rubric, answer)
+        if manifest is not None:
+            output = manifest.completed_output(items_stage, inputs_hash)
+            if output is not None:
+                print(f"\t[resume] {items_stage} already done, loading {items_save_path}")
+                return json.loads(output), 0.0
+            manifest.start(items_stage, inputs_hash, items_save_path)
+        try:
+            grade = await grader.async_grade(problem, answer, rubric, task_group_id, stage=items_stage)
+        except Exception as e:
+            if manifest is not None:
+                manifest.fail(items_stage, e)
+            raise
+        os.makedirs(os.path.dirname(items_save_path), exist_ok=True)
+        with open(items_save_path, "w", encoding="utf-8") as f:
+            f.write(format_grade(grade))
+        if manifest is not None:
+            manifest.finish(items_stage, grader.last_cost)
+        write_history(items_history_path, grader.last_histories)
+        return grade, time.perf_counter() - start
+
+    if not check:
+        grade, _ = await by_items()
+        return format_grade(grade)
+
+    async def monolithic():
+        start = time.perf_counter()
+        text = await async_grade_answer_high_reasoning(grading_prompt_func, problem, answer, rubric, response_save_path,
+                                                       history_path, manifest=manifest, stage=stage,
+                                                       structured=structured, stats=stats, run_id=grader.run_id)
+        return text, time.perf_counter() - start
+
+    stats = {}
+    (text, monolithic_seconds), (grade, items_seconds) = await asyncio.gather(monolithic(), by_items())
+    agreement_log.record(grader.run_id, stage, text, grade, monolithic_seconds, items_seconds,
+                         monolithic_cost=stats.get("cost", 0.0), decomposed_cost=grader.last_cost)
+    return text
+
 
 
 def sample_different_problem_types(n, problems):
@@ -308,68 +521,81 @@ def sample_different_problem_types(n, problems):
     return problems_to_return
 
 
-def grade_answers_from_directory(grading_prompt_func,dir_name, problem_d, save_prefix):
+def grade_answers_from_directory(grading_prompt_func,dir_name, problem_d, save_prefix, batch = False, batch_backend = None, structured = False):
+    # batch=True sends all gradings as one batch job (see BatchGrader) instead of one call per file;
+    # structured=True asks for JSON grades (use it with PromptFactory.get_structured_grading_prompt)
+    grader = None
+    if batch:
+        from BatchGrader import BatchGrader
+        grader = BatchGrader(backend=batch_backend, model_name=GRADING_MODEL, name=f"{save_prefix}_{int(time.time())}",
+                             response_schema=grading_schema() if structured else None)
     for file in os.listdir(dir_name):
         file_path = os.path.join(dir_name, file)
         print(f"starting with file {file_path}")
-        grade_answer_from_file(grading_prompt_func,file_path, problem_d, save_prefix)
+        grade_answer_from_file(grading_prompt_func,file_path, problem_d, save_prefix, batch=grader, structured=structured)
+    if grader is not None:
+        return grader.run()
 
-# 1. Setup your session (Change "openai" to "claude" or "gemini" as needed)
+if __name__ == "__main__":
+    # 1. Setup your session (Change "openai" to "claude" or "gemini" as needed)
 
-# 2. Start the conversation
-type_to_id = {"physics" :0, "chemistry":0, "biology":0}
-id_start = 200
-shuffle(problems)
-sampled_problems = sample_different_problem_types(3, problems)
-# ,
-options = [ ("anthropic", "claude-opus-4-5-20251101", True),
-           ("anthropic", "claude-opus-4-5-20251101", False), ("openai", "gpt-5.2", False), ("openai", "gpt-5.2", True)]
-options = [("anthropic", "claude-opus-4-5-20251101", True)]
+    # 2. Start the conversation
+    type_to_id = {"physics" :0, "chemistry":0, "biology":0}
+    id_start = 200
+    sampled_problems = problems.sample_by_subject(3)
+    # ,
+    options = [ ("anthropic", "claude-opus-4-5-20251101", True),
+               ("anthropic", "claude-opus-4-5-20251101", False), ("openai", "gpt-5.2", False), ("openai", "gpt-5.2", True)]
+    options = [("anthropic", "claude-opus-4-5-20251101", True)]
 
-# options = [ ("openai", "gpt-5.2", True)]
+    # options = [ ("openai", "gpt-5.2", True)]
 
 
 
-dir = os.path.join("Nikki Answers", "ours_runs", "same_claude_chat")
-dir = "Nikki Answers"
+    dir = os.path.join("Nikki Answers", "ours_runs", "same_claude_chat")
+    dir = "Nikki Answers"
 
+    chem_problem = problems[30]
 
-api_key=os.environ.get("OPENAI_API_KEY")
-
-chem_problem = problems[30]
 
 
+    model = "claude-opus-4-5-20251101"
+    provider = "anthropic"
 
-model = "claude-opus-4-5-20251101"
-provider = "anthropic"
+    grade_answers_from_directory(PromptFactory.get_grading_prompt, dir, chem_problem,  "nikki_answers")
 
-grade_answers_from_directory(PromptFactory.get_grading_prompt, dir, chem_problem,  "nikki_answers")
+    # for i in range(5):
+    #     print(f"Starting with #{i}")
+    #     full_pipeline(chem_problem,  i+id_start, provider =provider, model_name=model, grade_projected=True, grade_reprojected=True,
+    #                   grade_regular=False, keep_chat=True, clean_chat=True, api_key=api_key, web_enabled=True, force_search = True)
+    #     print(f"Finished with #{i}")
 
-# for i in range(5):
-#     print(f"Starting with #{i}")
-#     full_pipeline(chem_problem,  i+id_start, provider =provider, model_name=model, grade_projected=True, grade_reprojected=True,
-#                   grade_regular=False, keep_chat=True, clean_chat=True, api_key=api_key, web_enabled=True, force_search = True)
-#     print(f"Finished with #{i}")
 
+    pipeline_args = {
+        "api_key": "",
+        "grade_projected": True,
+        "grade_default": True,
+        "grade_reprojected": True,
+        "clean_chat": False,
+        "keep_chat": True,
+        "web_enabled": False,
+        "high_reasoning": True,
+        "force_search": False,
+        "provider": provider,
+        "model_name": model
+    }
 
-pipeline_args = {
-    "api_key": "",
-    "grade_projected": True,
-    "grade_default": True,
-    "grade_reprojected": True,
-    "clean_chat": False,
-    "keep_chat": True,
-    "web_enabled": False,
-    "high_reasoning": True,
-    "force_search": False,
-    "provider": provider,
-    "model_name": model
-}
+    # Runs every (problem, option) pair concurrently, bounded per provider by ChatSession.MAX_CONCURRENCY
+    # from AsyncRunner import run_sweep
+    # run_sweep(sampled_problems, options, id_start=id_start, **pipeline_args)
+    # Across processes or machines sharing this directory (see SweepRunner):
+    #   python cli.py sweep plan NAME --per-subject 3 --option anthropic claude-opus-4-5-20251101 yes ...
+    #   python cli.py sweep local NAME --processes 4      (or: sweep work NAME --shard N --shards M)
 
-#
-# for i,problem_d in enumerate(sampled_problems):
-#     print(f"Starting with #{i}")
-#     full_pipeline(problem_d, i + id_start, **pipeline_args)
-#     print(f"Finished with #{i}")
+    #
+    # for i,problem_d in enumerate(sampled_problems):
+    #     print(f"Starting with #{i}")
+    #     full_pipeline(problem_d, i + id_start, **pipeline_args)
+    #     print(f"Finished with #{i}")
 
-# get_problem_projection_pipeline(problems[0], id_count, provider ="openai", model_name="gpt-5-nano")
\ No newline at end of file
+    # get_problem_projection_pipeline(problems[0], id_count, provider ="openai", model_name="gpt-5-nano")
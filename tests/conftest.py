@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root, like the benchmarks import them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # ChatSession on the mock provider with its response cache, ledger and output files under
+    # tmp_path, and a quick mock that never fails
+    import MockProvider
+    import ResponseCache as response_cache
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(response_cache, "_default_cache",
+                        response_cache.ResponseCache(str(tmp_path / "Cache" / "responses.sqlite")))
+    for name, value in {"latency_median": 0.001, "latency_sigma": 0.0, "stream_chunk_delay": 0.0,
+                        "error_rate": 0.0, "rate_limit_rate": 0.0, "output_words": 40}.items():
+        monkeypatch.setattr(MockProvider.mock_settings, name, value)
+    return tmp_path
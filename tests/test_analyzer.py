@@ -0,0 +1,46 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from Analyzer import paired_bootstrap
+
+
+def pairs_with(subject, diffs, baseline=2.0, model="gpt-5.2"):
+    return [("openai", model, subject, i, 0, "off", baseline + diff, baseline) for i, diff in enumerate(diffs)]
+
+
+def test_bootstrap_interval_contains_a_known_improvement():
+    # physics improves by 0.75 on average, biology gets worse by 0.5
+    pairs = pairs_with("physics", [1, 1, 1, 0] * 25) + pairs_with("biology", [-1, 0] * 30)
+    overall, = paired_bootstrap(None, "projection", pairs=pairs, n_resamples=2000)
+    assert overall["n"] == 160
+    assert overall["mean_diff"] == pytest.approx((75 - 30) / 160)
+
+    biology, physics = paired_bootstrap(None, "projection", by=("subject",), pairs=pairs, n_resamples=2000)
+    assert physics["mean_diff"] == pytest.approx(0.75)
+    assert 0 < physics["ci_low"] <= physics["mean_diff"] <= physics["ci_high"] <= 1
+    assert physics["p_not_better"] == 0.0
+    assert (physics["wins"], physics["ties"], physics["losses"]) == (75, 25, 0)
+    assert biology["mean_diff"] == pytest.approx(-0.5)
+    assert biology["ci_low"] <= -0.5 <= biology["ci_high"] < 0
+    assert biology["p_not_better"] == 1.0
+
+
+def test_continuous_scores_use_the_index_resampler():
+    diffs = np.random.default_rng(1).normal(0.3, 1.0, size=400)
+    pairs = pairs_with("physics", diffs[:200]) + pairs_with("physics", diffs[200:], model="gpt-5")
+    first = paired_bootstrap(None, "projection", by=("model",), pairs=pairs, n_resamples=1000, seed=3)
+    again = paired_bootstrap(None, "projection", by=("model",), pairs=pairs, n_resamples=1000, seed=3)
+    assert first == again
+    for result, part in zip(first, (diffs[200:], diffs[:200])):
+        assert result["mean_diff"] == pytest.approx(part.mean())
+        # the percentile interval is close to the normal one, mean +- 1.96 standard errors
+        error = part.std() / np.sqrt(len(part))
+        assert result["ci_low"] == pytest.approx(part.mean() - 1.96 * error, abs=0.05)
+        assert result["ci_high"] == pytest.approx(part.mean() + 1.96 * error, abs=0.05)
+        assert result["ci_low"] > 0
+
+
+def test_unknown_breakdown_column():
+    with pytest.raises(ValueError):
+        paired_bootstrap(None, "projection", by=("verdict",), pairs=pairs_with("physics", [1]))
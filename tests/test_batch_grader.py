@@ -0,0 +1,81 @@
+import json
+import os
+import types
+
+import pytest
+
+from BatchGrader import BATCH_DISCOUNT, BatchGrader, LocalBatchBackend
+from ChatSession import ChatSession
+from PromptFactory import grading_schema
+from Telemetry import ledger
+from TranscriptStore import transcript_store
+
+SCHEMA = grading_schema()
+
+
+@pytest.fixture
+def backend(workdir, monkeypatch):
+    # grades echo the prompt so every answer gets its own; transcripts go to plain text files
+    monkeypatch.setattr(transcript_store, "enabled", False)
+    monkeypatch.setattr(ledger, "enabled", True)
+    os.makedirs("grades")
+    return LocalBatchBackend(root="local", responder=lambda body: f"{body['input'][-1]['content']}\nVERDICT: 1")
+
+
+def add_jobs(grader, count=2):
+    for i in range(count):
+        grader.add(f"grade answer {i}", os.path.join("grades", f"{i}.txt"), os.path.join("grades", f"{i}_chat.txt"))
+
+
+def test_submit_poll_and_collect(backend):
+    grader = BatchGrader(backend=backend, model_name="gpt-5", name="b1")
+    add_jobs(grader)
+    grades = grader.run(poll_interval=0)
+
+    assert grades == {os.path.join("grades", "0.txt"): "grade answer 0\nVERDICT: 1",
+                      os.path.join("grades", "1.txt"): "grade answer 1\nVERDICT: 1"}
+    with open(os.path.join("grades", "1.txt"), encoding="utf-8") as f:
+        assert f.read() == "grade answer 1\nVERDICT: 1"
+    with open(os.path.join("grades", "1_chat.txt"), encoding="utf-8") as f:
+        assert "grade answer 1" in f.read()
+    records = ledger.read(run_id="b1")
+    assert len(records) == 2 and all(entry["stage"] == "batch_grading" for entry in records)
+    # billed at the batch discount
+    full_price = ChatSession.cost_breakdown("gpt-5", types.SimpleNamespace(input_tokens=records[0]["input_tokens"],
+                                                                          output_tokens=records[0]["output_tokens"]))
+    assert records[0]["cost"] == pytest.approx(full_price["cost"] * BATCH_DISCOUNT)
+
+
+def test_a_loaded_batch_keeps_its_jobs_and_schema(backend):
+    grader = BatchGrader(backend=backend, model_name="gpt-5", name="b2", response_schema=SCHEMA)
+    add_jobs(grader, 3)
+    batch_id = grader.submit()
+    with open(grader.write_batch_file(), encoding="utf-8") as f:
+        body = json.loads(f.readline())["body"]
+    assert body["text"]["format"]["type"] == "json_schema"
+
+    resumed = BatchGrader.load("b2", backend=backend)
+    assert resumed.batch_id == batch_id and resumed.jobs == grader.jobs
+    assert resumed.response_schema == SCHEMA
+    assert resumed.wait(poll_interval=0) == "completed"
+    assert len(resumed.collect()) == 3
+
+
+def test_failed_requests_are_skipped(backend, monkeypatch):
+    grader = BatchGrader(backend=backend, model_name="gpt-5", name="b3")
+    add_jobs(grader)
+    grader.submit()
+    original = backend.results
+
+    def with_a_failure(batch_id):
+        rows = original(batch_id)
+        rows[0]["response"]["status_code"] = 500
+        return rows
+
+    grader.backend.status(grader.batch_id)
+    monkeypatch.setattr(backend, "results", with_a_failure)
+    assert list(grader.collect()) == [os.path.join("grades", "1.txt")]
+
+
+def test_nothing_to_submit(backend):
+    assert BatchGrader(backend=backend, name="empty").run(poll_interval=0) == {}
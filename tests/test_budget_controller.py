@@ -0,0 +1,104 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from BudgetController import BudgetController, BudgetExceeded, stage_priority
+
+PRICING = {"m": {"input": 1.0, "output": 10.0, "search": 0.01}}
+
+
+class Ledger:
+    def __init__(self, path=None):
+        self.path = path or "/nonexistent/ledger.jsonl"
+        self.enabled = path is not None
+
+
+def request(stage, input_tokens=1_000_000, model="m", web_enabled=False):
+    # 1M input tokens at $1/M with a fixed, known output estimate below
+    return {"stage": stage, "run_id": "r", "estimate": {"pricing": PRICING, "model": model, "stage": stage,
+                                                        "input_tokens": input_tokens, "effort": "low",
+                                                        "web_enabled": web_enabled}}
+
+
+def controller(**kwargs):
+    kwargs.setdefault("safety_margin", 1.0)
+    return BudgetController(ledger=Ledger(), poll_interval=0.01, **kwargs)
+
+
+def test_estimate_uses_defaults_then_ledger_history(tmp_path):
+    budget = controller()
+    # no history: 1500 output tokens for low effort, one search when web is on
+    assert budget.estimate(PRICING, "m", "project", 1_000_000, effort="low") == pytest.approx(1.015)
+    assert budget.estimate(PRICING, "m", "project", 1_000_000, "low", web_enabled=True) == pytest.approx(1.025)
+
+    ledger = tmp_path / "ledger.jsonl"
+    ledger.write_text(json.dumps({"stage": "project", "model": "m", "cost": 1.0, "timestamp": time.time(),
+                                  "input_tokens": 100, "cached_tokens": 50, "output_tokens": 100_000,
+                                  "search_calls": 0}) + "\n")
+    budget = BudgetController(ledger=Ledger(str(ledger)), safety_margin=1.0)
+    # half cached (cached_input defaults to the input price), 100k output, no searches
+    assert budget.estimate(PRICING, "m", "project", 1_000_000, web_enabled=True) == pytest.approx(2.0)
+    assert budget.summary()["day_spent"] == pytest.approx(1.0)
+
+
+def test_admit_settle_and_reject():
+    budget = controller(run_cap=3.0, reserve_fraction=0.0)
+    ticket = budget.admit(request("grade"))
+    assert budget.reserved == pytest.approx(1.015)
+    budget.settle(ticket, 2.5, {"input_tokens": 1_000_000, "output_tokens": 1500})
+    assert budget.reserved == 0.0 and budget.run_spent == 2.5
+    # settling twice books nothing
+    budget.settle(ticket, 2.5)
+    assert budget.run_spent == 2.5
+    with pytest.raises(BudgetExceeded, match="run cap"):
+        budget.admit(request("grade"))
+    assert budget.counts == {"admitted": 1, "deferred": 0, "rejected": 1}
+
+
+def test_calls_in_flight_defer_until_they_settle():
+    budget = controller(run_cap=1.8, reserve_fraction=0.0)
+    first = budget.admit(request("answer_projection"))
+    timer = threading.Timer(0.05, budget.settle, (first, 0.5))
+    timer.start()
+    second = budget.admit(request("answer_projection"))
+    timer.join()
+    assert budget.counts["deferred"] == 1 and budget.counts["admitted"] == 2
+    assert budget.reserved == pytest.approx(second["estimate"])
+
+
+def test_new_problems_leave_the_reserve_to_started_ones():
+    budget = controller(run_cap=1.1, reserve_fraction=0.2)
+    # grading may use the whole cap, a new problem only 80% of it
+    assert stage_priority("grade_default") == 0 and stage_priority("project") == 2
+    with pytest.raises(BudgetExceeded):
+        budget.admit(request("project"))
+    budget.settle(budget.admit(request("grade_default")), 0.0)
+
+
+def test_max_wait_turns_a_deferral_into_a_rejection():
+    budget = controller(run_cap=1.5, max_wait=0.05, reserve_fraction=0.0)
+    budget.admit(request("grade"))
+    with pytest.raises(BudgetExceeded):
+        asyncio.run(budget.async_admit(request("grade")))
+
+
+def test_a_cancelled_deferred_call_stops_blocking_less_urgent_ones():
+    budget = controller(run_cap=1.8, reserve_fraction=0.0)
+    first = budget.admit(request("answer_projection"))
+
+    async def cancel_waiting_grade():
+        task = asyncio.ensure_future(budget.async_admit(request("grade")))
+        await asyncio.sleep(0.05)
+        assert budget.waiting
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_waiting_grade())
+    assert budget.waiting == {}
+    budget.settle(first, 0.0)
+    # nothing more urgent is waiting any more: a new problem is admitted right away
+    assert budget.admit(request("project"))["id"] in budget.in_flight
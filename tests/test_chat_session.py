@@ -0,0 +1,235 @@
+import asyncio
+import types
+
+import pytest
+
+import main
+import MockProvider
+from BudgetController import BudgetController, BudgetExceeded
+from ChatSession import ChatSession
+from LocalRetrieval import LocalRetrieval
+from RunManifest import RunManifest
+from Telemetry import TelemetryLedger, ledger
+
+
+def session(**kwargs):
+    return ChatSession("mock", "gpt-5.2", "", **kwargs)
+
+
+def empty_budget():
+    return BudgetController(run_cap=1e-9, ledger=TelemetryLedger(enabled=False))
+
+
+def roles(chat):
+    return [message["role"] for message in chat.history]
+
+
+def test_a_rejected_call_takes_its_prompt_back(workdir):
+    chat = session()
+    chat.budget = empty_budget()
+    with pytest.raises(BudgetExceeded):
+        chat.send_message("first")
+    with pytest.raises(BudgetExceeded):
+        list(chat.stream_message("first"))
+    with pytest.raises(BudgetExceeded):
+        asyncio.run(chat.async_send_message("first"))
+    assert chat.history == []
+
+    chat.budget = None
+    chat.send_message("second")
+    assert roles(chat) == ["user", "assistant"]
+
+
+def test_a_failed_preflight_takes_its_prompt_back(workdir):
+    class BrokenBudget:
+        def apply(self, history, session=None):
+            raise RuntimeError("summary failed")
+
+    chat = session()
+    chat.send_message("first")
+    chat.history_budget = BrokenBudget()
+    with pytest.raises(RuntimeError):
+        chat.send_message("second")
+    assert roles(chat) == ["user", "assistant"]
+
+
+@pytest.fixture
+def corpus(workdir):
+    directory = workdir / "corpus"
+    directory.mkdir()
+    (directory / "biology.txt").write_text("Photosynthesis converts light energy into chemical energy.",
+                                           encoding="utf-8")
+    return LocalRetrieval(str(directory), str(workdir / "index.sqlite"))
+
+
+def run_stage(chat, manifest, stage="project"):
+    return asyncio.run(main.async_chat_stage(manifest, stage, chat, "Explain photosynthesis.", f"{stage}.txt"))
+
+
+def test_streaming_records_time_to_first_token(workdir):
+    MockProvider.mock_settings.latency_median = 0.05
+    chat = session(stream=True, stage="project")
+    deltas = list(chat.stream_message("Explain photosynthesis.", save_path="answer.txt"))
+
+    metrics = chat.last_call_metrics
+    # timed from the start of the call: the request's own latency is part of the TTFT
+    assert 0.04 < metrics["time_to_first_token"] <= metrics["total_time"]
+    assert not metrics["truncated"] and len(deltas) > 1
+    with open("answer.txt", encoding="utf-8") as f:
+        assert f.read() == "".join(deltas) == chat.history[-1]["content"]
+    entry = ledger.read()[-1]
+    assert entry["streamed"] and entry["time_to_first_token"] == pytest.approx(metrics["time_to_first_token"])
+
+
+def test_a_truncated_stream_is_not_a_finished_stage(workdir):
+    manifest = RunManifest("run1")
+    chat = session(stream=True, max_output_chars=40)
+    output = run_stage(chat, manifest)
+
+    assert 40 <= len(output) < 60 and chat.last_call_metrics["truncated"]
+    assert manifest.stage("project")["status"] == "truncated"
+    # neither cached nor resumable: the next run asks for it again
+    assert chat.cache.stats()["entries"] == 0
+    assert RunManifest("run1").completed_output("project", manifest.stage("project")["inputs_hash"]) is None
+
+
+def test_an_interrupted_stream_is_marked_truncated(workdir, monkeypatch):
+    events = MockProvider._events
+    # the connection drops before the completion event
+    monkeypatch.setattr(MockProvider, "_events", lambda response: (e for e in events(response)
+                                                                   if e.type != "response.completed"))
+    manifest = RunManifest("run1")
+    chat = session(stream=True)
+    run_stage(chat, manifest)
+
+    assert manifest.stage("project")["status"] == "truncated"
+    assert chat.last_response_id is None and chat.cache.stats()["entries"] == 0
+
+    monkeypatch.setattr(MockProvider, "_events", events)
+    run_stage(session(stream=True), manifest)
+    assert manifest.stage("project")["status"] == "done"
+
+
+def test_streaming_with_local_search_writes_the_whole_answer(workdir, corpus):
+    chat = session(stream=True, web_enabled=True, search_backend=corpus)
+    deltas = list(chat.stream_message("Explain photosynthesis.", force_search=True, save_path="answer.txt"))
+
+    assert len(deltas) == 1 and "VERDICT" in deltas[0]
+    assert chat.last_usage["local_searches"] == 1 and corpus.stats()["searches"] == 1
+    with open("answer.txt", encoding="utf-8") as f:
+        assert f.read() == deltas[0]
+    assert [m["role"] for m in chat.history] == ["user", "assistant"]
+
+
+@pytest.fixture
+def sent(workdir, monkeypatch):
+    # every request body the mock provider receives
+    requests = []
+    create = MockProvider.MockResponses.create
+
+    def recording_create(self, stream=False, **request):
+        # input may be the session's own history list, which grows after the call
+        requests.append(dict(request, input=list(request["input"])))
+        return create(self, stream=stream, **request)
+
+    monkeypatch.setattr(MockProvider.MockResponses, "create", recording_create)
+    return requests
+
+
+def test_a_follow_up_turn_is_chained_to_the_previous_response(sent):
+    chat = session()
+    chat.send_message("first")
+    first_id = chat.last_response_id
+    chat.send_message("second")
+
+    assert "previous_response_id" not in sent[0]
+    assert sent[1]["previous_response_id"] == first_id
+    assert sent[1]["input"] == [{"role": "user", "content": "second"}]
+    assert chat.chained_length == len(chat.history) == 4
+
+    plain = session(incremental=False)
+    plain.send_message("one")
+    plain.send_message("two")
+    assert "previous_response_id" not in sent[3] and len(sent[3]["input"]) == 3
+
+
+def test_the_full_history_is_sent_after_a_cache_hit(sent):
+    session().send_message("first")
+    chat = session()
+    chat.send_message("first")
+    assert len(sent) == 1 and chat.last_response_id is None
+    chat.send_message("second")
+
+    # the server never saw the cached turn, so nothing is chained
+    assert "previous_response_id" not in sent[1]
+    assert [m["content"] for m in sent[1]["input"]][::2] == ["first", "second"]
+
+
+def test_a_fork_continues_the_chain_only_on_the_same_model(sent):
+    chat = session()
+    chat.send_message("first")
+    chat.fork().send_message("second")
+    assert sent[1]["previous_response_id"] == chat.last_response_id
+
+    chat.fork(model_name="gpt-5").send_message("second")
+    assert "previous_response_id" not in sent[2] and len(sent[2]["input"]) == 3
+
+
+def test_forks_share_the_snapshot_messages(workdir):
+    chat = session()
+    chat.send_message("first")
+    snapshot = chat.snapshot()
+    chat.send_message("second")
+    assert len(snapshot.messages) == 2
+
+    fork = chat.fork(snapshot)
+    assert all(a is b for a, b in zip(fork.history, chat.history)) and len(fork.history) == 2
+    assert (fork.last_response_id, fork.chained_length) == (snapshot.last_response_id, snapshot.chained_length)
+    assert fork.total_cost == 0
+
+    other = chat.fork(snapshot)
+    fork.send_message("third")
+    assert [m["content"] for m in fork.history[::2]] == ["first", "third"]
+    assert [m["content"] for m in chat.history[::2]] == ["first", "second"]
+    assert len(other.history) == len(snapshot.messages) == 2
+
+
+def anthropic_session(monkeypatch, history):
+    # requests are only built here, so no Anthropic client is needed
+    monkeypatch.setattr(ChatSession.client_registry, "get_client", lambda *args, **kwargs: None)
+    return ChatSession("anthropic", "claude-opus-4-5-20251101", "", history=history)
+
+
+def test_cache_control_goes_on_the_last_anthropic_message(monkeypatch):
+    history = [{"role": "user", "content": "first"}, {"role": "assistant", "content": "answer"},
+               {"role": "user", "content": [{"type": "text", "text": "a"}, {"type": "text", "text": "b"}]}]
+    chat = anthropic_session(monkeypatch, history)
+    messages = chat._claude_request()["messages"]
+
+    assert messages[:2] == history[:2]
+    assert messages[2]["content"] == [{"type": "text", "text": "a"},
+                                      {"type": "text", "text": "b", "cache_control": {"type": "ephemeral"}}]
+    # the history itself stays plain: it is part of the response cache key
+    assert "cache_control" not in history[2]["content"][1]
+
+    chat.history = [{"role": "user", "content": "only"}]
+    assert chat._claude_request()["messages"] == [
+        {"role": "user", "content": [{"type": "text", "text": "only", "cache_control": {"type": "ephemeral"}}]}]
+
+
+def test_cost_reports_cached_and_uncached_tokens_separately(workdir, capsys):
+    chat = session()
+    usage = types.SimpleNamespace(input_tokens=1_000_000, output_tokens=0,
+                                  input_tokens_details=types.SimpleNamespace(cached_tokens=800_000))
+    cost = chat._calculate_cost(usage, search_calls=0)
+    assert (cost["input_tokens"], cost["cached_tokens"]) == (1_000_000, 800_000)
+    # gpt-5.2: 200k uncached at $1.75/M, 800k cached at $0.175/M
+    assert cost["cost"] == pytest.approx(0.35 + 0.14)
+    assert "200000 uncached, 800000 cached" in capsys.readouterr().out
+
+    # Anthropic counts cache reads and writes outside input_tokens
+    usage = types.SimpleNamespace(input_tokens=100, output_tokens=0, cache_read_input_tokens=1000,
+                                  cache_creation_input_tokens=500)
+    cost = ChatSession.cost_breakdown("claude-opus-4-5-20251101", usage, 0)
+    assert (cost["input_tokens"], cost["cached_tokens"], cost["cache_write_tokens"]) == (1600, 1000, 500)
+    assert cost["cost"] == pytest.approx((100 * 5.00 + 1000 * 0.50 + 500 * 6.25) / 1e6)
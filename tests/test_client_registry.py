@@ -0,0 +1,85 @@
+import asyncio
+
+from ClientRegistry import ClientRegistry
+from MockProvider import AsyncMockClient, MockClient
+
+
+class FakePool:
+    # stands in for the httpx client behind an SDK client
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    async def aclose(self):
+        self.closed = True
+
+
+class PooledRegistry(ClientRegistry):
+    # mock clients with a pool to close, like the OpenAI / Anthropic ones
+    def __init__(self):
+        super().__init__()
+        self.pools = []
+
+    def _build(self, provider, api_key, use_async, stats):
+        client, _ = super()._build(provider, api_key, use_async, stats)
+        self.pools.append(FakePool())
+        return client, self.pools[-1]
+
+
+def test_clients_are_shared_per_provider_and_key():
+    registry = ClientRegistry()
+    client = registry.get_client("mock", "key-1")
+    assert isinstance(client, MockClient)
+    assert registry.get_client("mock", "key-1") is client
+    assert registry.get_client("mock", "key-2") is not client
+
+    stats = registry.pool_stats()
+    assert sorted(s["clients_created"] for s in stats.values()) == [1, 1]
+    assert sorted(s["client_reuses"] for s in stats.values()) == [0, 1]
+    # credentials never end up in the keys
+    assert not any("key-1" in name for name in stats)
+
+
+def test_async_clients_are_shared_within_one_event_loop():
+    registry = ClientRegistry()
+
+    async def get_twice():
+        first = registry.get_client("mock", "key", use_async=True)
+        return first, registry.get_client("mock", "key", use_async=True)
+
+    first, second = registry.run(get_twice())
+    assert isinstance(first, AsyncMockClient) and first is second
+    again, _ = registry.run(get_twice())
+    assert again is not first
+
+
+def test_run_closes_the_pools_of_its_loop():
+    registry = PooledRegistry()
+    registry.get_client("mock", "key")
+
+    async def use_async_client():
+        registry.get_client("mock", "key", use_async=True)
+        return len(registry.async_clients)
+
+    assert registry.run(use_async_client()) == 1
+    sync_pool, async_pool = registry.pools
+    assert async_pool.closed and not sync_pool.closed
+    assert len(registry.async_clients) == 0
+
+    registry.close()
+    assert sync_pool.closed and registry.clients == {}
+
+
+def test_close_reaches_async_pools_of_a_loop_that_is_not_running():
+    registry = PooledRegistry()
+    loop = asyncio.new_event_loop()
+
+    async def create():
+        registry.get_client("mock", "key", use_async=True)
+
+    loop.run_until_complete(create())
+    registry.close()
+    assert registry.pools[0].closed
+    loop.close()
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+from HedgePolicy import HedgePolicy, StageTimeout, parse_stage_timeouts
+from RateLimiter import DeadlineExceeded
+
+KEY = ("mock", "m", "grade_projection")
+
+
+class Ledger:
+    enabled = False
+
+
+def policy(**kwargs):
+    return HedgePolicy(ledger=Ledger(), **kwargs)
+
+
+def test_timeout_uses_the_longest_matching_prefix():
+    hedge = policy(stage_timeouts=parse_stage_timeouts("grade=300, grade_projection=60, default=900"))
+    assert hedge.timeout("grade_projection") == 60
+    assert hedge.timeout("grade_default") == 300
+    assert hedge.timeout("project") == 900
+    assert hedge.timeout(None) == 900
+    assert policy(stage_timeouts={"grade": 1}).timeout("project") is None
+
+
+def test_sync_call_passes_the_deadline_and_converts_deadline_errors():
+    hedge = policy(stage_timeouts={"grade": 30})
+    seen = []
+    result, info = hedge.call(KEY, lambda expires: seen.append(expires) or "ok")
+    assert result == "ok" and not info["hedged"]
+    assert seen[0] == pytest.approx(time.monotonic() + 30, abs=1)
+
+    def cut_short(expires):
+        raise DeadlineExceeded("retry would start after the deadline")
+
+    with pytest.raises(StageTimeout) as error:
+        hedge.call(KEY, cut_short)
+    assert isinstance(error.value.__cause__, DeadlineExceeded)
+    # other errors pass through unchanged
+    with pytest.raises(KeyError):
+        hedge.call(KEY, lambda expires: {}["missing"])
+    assert hedge.summary()["timeouts"] == 1
+
+
+def test_async_call_hedges_slow_calls_and_cancels_the_loser():
+    hedge = policy(percentile=0.5, min_samples=3)
+    for _ in range(3):
+        hedge.tracker.record(KEY, 0.01)
+    started, cancelled = [], []
+
+    async def request(expires):
+        started.append(len(started))
+        try:
+            # the first attempt hangs, the duplicate answers right away
+            await asyncio.sleep(10 if len(started) == 1 else 0)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "answer"
+
+    result, info = asyncio.run(hedge.async_call(KEY, request))
+    assert result == "answer" and info["hedged"] and info["hedge_won"]
+    assert len(started) == 2 and cancelled == [True]
+    assert hedge.summary()["hedge_wins"] == 1
+
+
+def test_async_call_times_out_at_the_stage_deadline():
+    hedge = policy(stage_timeouts={"grade": 0.05})
+
+    async def hang(expires):
+        await asyncio.sleep(10)
+
+    start = time.monotonic()
+    with pytest.raises(StageTimeout):
+        asyncio.run(hedge.async_call(KEY, hang))
+    assert time.monotonic() - start < 1
+
+
+def test_no_hedging_before_min_samples():
+    hedge = policy(percentile=0.5, min_samples=20)
+    hedge.tracker.record(KEY, 0.01)
+    assert hedge.hedge_delay(KEY) is None
@@ -0,0 +1,64 @@
+from HistoryBudget import HistoryBudget, SUMMARY_PREFIX, count_message_tokens
+
+
+def conversation(turns, words=50):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"question {i} " + "word " * words})
+        history.append({"role": "assistant", "content": f"answer {i} " + "word " * words})
+    history.append({"role": "user", "content": "current prompt"})
+    return history
+
+
+def first_words(turns):
+    return [turn[0]["content"].split()[:2] for turn in turns]
+
+
+def test_keep_last_turns_pins_the_first_turn():
+    pinned, dropped, kept = HistoryBudget(keep_last_turns=2).plan(conversation(5))
+    assert first_words(pinned) == [["question", "0"]]
+    assert first_words(dropped) == [["question", "1"], ["question", "2"], ["question", "3"]]
+    assert first_words(kept) == [["question", "4"], ["current", "prompt"]]
+
+
+def test_max_input_tokens_drops_oldest_unpinned_turns_until_it_fits():
+    history = conversation(6)
+    budget = HistoryBudget(max_input_tokens=count_message_tokens(history) // 2, keep_first_turns=2)
+    pinned, dropped, kept = budget.plan(history)
+    assert first_words(pinned) == [["question", "0"], ["question", "1"]]
+    assert dropped and first_words(dropped)[0] == ["question", "2"]
+    assert sum(count_message_tokens(turn) for turn in pinned + kept) <= budget.max_input_tokens
+
+
+def test_pinned_turns_and_the_prompt_survive_an_impossible_budget():
+    history = conversation(3)
+    messages, report = HistoryBudget(max_input_tokens=1).apply(history)
+    assert messages == history[:2] + history[-1:]
+    assert report["dropped_turns"] == 2 and report["over_budget"] and report["trimmed"]
+
+
+def test_a_single_turn_is_never_pinned_away_from_the_prompt():
+    history = [{"role": "user", "content": "only prompt"}]
+    pinned, dropped, kept = HistoryBudget(keep_last_turns=0, keep_first_turns=3).plan(history)
+    assert (pinned, dropped, kept) == ([], [], [history])
+
+
+def test_summaries_replace_dropped_turns_and_are_cached():
+    calls = []
+
+    class Session:
+        provider, model_name, api_key, cache, cache_salt, run_id = "mock", "m", "", None, "", ""
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def send_message(self, prompt):
+            calls.append(prompt)
+            return "earlier turns in short"
+
+    budget = HistoryBudget(keep_last_turns=1, summarize=True)
+    history = conversation(4)
+    messages, report = budget.apply(history, Session())
+    budget.apply(history, Session())
+    assert len(calls) == 1 and report["summarized"]
+    assert messages[2] == {"role": "user", "content": SUMMARY_PREFIX + "earlier turns in short"}
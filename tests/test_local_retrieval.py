@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from LocalRetrieval import LocalRetrieval, TOOL_NAME, resolve_search_backend
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    directory = tmp_path / "corpus"
+    directory.mkdir()
+    (directory / "biology.txt").write_text(
+        "Photosynthesis converts light energy into chemical energy.\n\n"
+        "Chlorophyll absorbs light for photosynthesis photosynthesis.", encoding="utf-8")
+    (directory / "physics.md").write_text("Newton's second law relates force, mass and acceleration.",
+                                          encoding="utf-8")
+    (directory / "notes.jsonl").write_text(
+        json.dumps({"text": "Light travels at about 300000 km per second.", "source": "speed of light"}) + "\n",
+        encoding="utf-8")
+    return directory
+
+
+def retrieval(corpus, tmp_path, **kwargs):
+    return LocalRetrieval(str(corpus), str(tmp_path / "index.sqlite"), passage_words=10, **kwargs)
+
+
+def test_bm25_ranks_the_passage_with_the_most_matches_first(corpus, tmp_path):
+    results = retrieval(corpus, tmp_path).search("photosynthesis chlorophyll")
+    assert results[0]["text"].startswith("Chlorophyll")
+    assert [r["score"] for r in results] == sorted((r["score"] for r in results), reverse=True)
+    assert all(r["source"] == "biology.txt" for r in results)
+    assert len(retrieval(corpus, tmp_path).search("light", top_k=1)) == 1
+    assert retrieval(corpus, tmp_path).search("the of and") == []
+
+
+def test_queries_with_the_same_terms_share_a_cache_entry(corpus, tmp_path):
+    search = retrieval(corpus, tmp_path)
+    first = search.search("newton force")
+    assert search.search("Force, Newton?") == first
+    stats = search.stats()
+    assert stats["searches"] == 2 and stats["cache_hits"] == 1
+
+
+def test_the_cache_evicts_least_recently_used_queries(corpus, tmp_path):
+    search = retrieval(corpus, tmp_path, cache_size=2)
+    search.search("light")
+    search.search("force")
+    search.search("light")
+    search.search("mass")
+    assert (("force",), 5) not in search.cache
+    assert (("light",), 5) in search.cache
+
+
+def test_the_index_is_rebuilt_only_when_the_corpus_changes(corpus, tmp_path, capsys):
+    retrieval(corpus, tmp_path).search("light")
+    retrieval(corpus, tmp_path).search("light")
+    assert capsys.readouterr().out.count("indexed") == 1
+    (corpus / "chemistry.txt").write_text("Covalent bonds share electrons.", encoding="utf-8")
+    changed = retrieval(corpus, tmp_path)
+    assert changed.search("covalent")[0]["source"] == "chemistry.txt"
+    assert capsys.readouterr().out.count("indexed") == 1
+
+
+def test_run_tool_accepts_both_argument_styles(corpus, tmp_path):
+    search = retrieval(corpus, tmp_path)
+    assert "[1] physics.md" in search.run_tool(TOOL_NAME, '{"query": "newton"}')
+    assert search.run_tool(TOOL_NAME, {"query": "newton"}) == search.run_tool(TOOL_NAME, "newton")
+    assert search.run_tool(TOOL_NAME, {"query": "zebra"}).startswith("No passages")
+    assert search.run_tool("browse", {}).startswith("Unknown tool")
+
+
+def test_missing_corpus_and_unknown_backends_fail_clearly(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        LocalRetrieval(str(tmp_path / "nowhere"), str(tmp_path / "index.sqlite")).search("light")
+    assert resolve_search_backend("hosted") is None
+    with pytest.raises(ValueError):
+        resolve_search_backend("bing")
@@ -0,0 +1,72 @@
+import pytest
+
+import MockProvider
+from ChatSession import ChatSession
+from MockProvider import MockClient, MockRateLimitError, MockServerError, MockSettings
+from Telemetry import TelemetryLedger
+
+REQUEST = {"model": "gpt-5.2", "input": [{"role": "user", "content": "Why is the sky blue?"}]}
+
+
+def quick(**settings):
+    return MockSettings(latency_median=0.001, **settings)
+
+
+def draws(settings, times=5):
+    return [settings.draw("digest") for _ in range(times)]
+
+
+def test_same_seed_replays_the_same_calls():
+    first, again = quick(error_rate=0.3, rate_limit_rate=0.3), quick(error_rate=0.3, rate_limit_rate=0.3)
+    first_draws, again_draws = draws(first, 20), draws(again, 20)
+    assert [latency for latency, _ in first_draws] == [latency for latency, _ in again_draws]
+    assert [type(error) for _, error in first_draws] == [type(error) for _, error in again_draws]
+    assert {type(error) for _, error in first_draws} == {type(None), MockRateLimitError, MockServerError}
+    assert first.calls == 20 and first.failures == again.failures > 0
+
+    other = quick(error_rate=0.3, rate_limit_rate=0.3, seed=1)
+    assert [latency for latency, _ in draws(other, 20)] != [latency for latency, _ in first_draws]
+
+
+def test_completions_depend_only_on_the_request():
+    response = MockClient(quick()).responses.create(**REQUEST).parse()
+    again = MockClient(quick(seed=5)).responses.create(**REQUEST).parse()
+    assert response.output_text == again.output_text and response.id == again.id
+    assert response.output_text.splitlines()[-1].startswith("VERDICT: ")
+    other = MockClient(quick()).responses.create(**dict(REQUEST, model="gpt-5")).parse()
+    assert other.id != response.id
+
+
+def test_injected_errors_look_like_the_sdk_ones():
+    with pytest.raises(MockRateLimitError) as rate_limited:
+        MockClient(quick(rate_limit_rate=1.0, retry_after=2.5)).responses.create(**REQUEST)
+    assert rate_limited.value.status_code == 429
+    assert rate_limited.value.response.headers == {"retry-after": "2.5"}
+    with pytest.raises(MockServerError) as failed:
+        MockClient(quick(error_rate=1.0)).responses.create(**REQUEST)
+    assert failed.value.status_code == 500
+
+
+def test_chat_session_retries_injected_errors(workdir, monkeypatch):
+    monkeypatch.setattr(MockProvider.mock_settings, "rate_limit_rate", 0.3)
+    monkeypatch.setattr(MockProvider.mock_settings, "error_rate", 0.3)
+    monkeypatch.setattr(MockProvider.mock_settings, "retry_after", 0.001)
+    monkeypatch.setattr(MockProvider.mock_settings, "failures", 0)
+    monkeypatch.setattr(ChatSession.rate_limiter, "base_delay", 0.001)
+    ledger = TelemetryLedger(str(workdir / "ledger.jsonl"))
+    monkeypatch.setattr(ChatSession, "ledger", ledger)
+
+    answers = [ChatSession("mock", "gpt-5.2", "").send_message(f"question {i}") for i in range(8)]
+    assert all("VERDICT: " in answer for answer in answers)
+    retries = sum(entry["retries"] for entry in ledger.read())
+    assert retries == MockProvider.mock_settings.failures > 0
+
+
+def test_configure_rejects_unknown_settings():
+    settings = MockSettings()
+    settings.configure_from_string("latency_median=0.2,error_rate=0.01")
+    assert (settings.latency_median, settings.error_rate) == (0.2, 0.01)
+    with pytest.raises(ValueError):
+        settings.configure(latency=1)
+    with pytest.raises(ValueError):
+        settings.configure(failures=0)
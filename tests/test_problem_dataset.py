@@ -0,0 +1,68 @@
+import json
+import os
+
+import pytest
+
+from ProblemDataset import ProblemDataset
+
+SUBJECTS = ["physics", "chemistry", "biology"]
+
+
+def write_problems(path, count, prefix="Problem"):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(json.dumps({"problem": f"Question: {prefix} {i} ü. Think step by step.", "answer": str(i),
+                                "subject": SUBJECTS[i % 3], "task_group_id": i // 2}) + "\n")
+            if i == 1:
+                f.write("\n")
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "problems.json")
+    write_problems(path, 6)
+    return path
+
+
+def test_the_sidecar_index_is_built_once(path, capsys):
+    dataset = ProblemDataset(path)
+    assert len(dataset) == 6
+    assert os.path.exists(f"{path}.index.json") and os.path.exists(f"{path}.clean.jsonl")
+    assert capsys.readouterr().out.count("Indexed") == 1
+    dataset.close()
+
+    reopened = ProblemDataset(path)
+    assert reopened[4]["answer"] == "4"
+    assert "Indexed" not in capsys.readouterr().out
+
+
+def test_a_stale_index_is_rebuilt(path, capsys):
+    first = ProblemDataset(path)
+    assert len(first) == 6
+    first.close()
+    write_problems(path, 4, prefix="Edited")
+    dataset = ProblemDataset(path)
+    assert len(dataset) == 4
+    assert dataset[0]["clean_problem"] == "Edited 0 ü."
+    assert capsys.readouterr().out.count("Indexed") == 2
+
+
+def test_slices_and_negative_indices(path):
+    dataset = ProblemDataset(path)
+    assert dataset[-1]["answer"] == "5" and dataset[-1]["clean_problem"] == "Problem 5 ü."
+    assert [p["answer"] for p in dataset[1:5:2]] == ["1", "3"]
+    assert [p["answer"] for p in dataset[::-2]] == ["5", "3", "1"]
+    assert dataset[10:] == []
+    assert [p["answer"] for p in dataset] == [str(i) for i in range(6)]
+    with pytest.raises(IndexError):
+        dataset[6]
+
+
+def test_lookups_by_subject_and_task_group(path):
+    dataset = ProblemDataset(path)
+    assert dataset.subjects() == ["biology", "chemistry", "physics"]
+    assert [p["answer"] for p in dataset.by_subject("chemistry")] == ["1", "4"]
+    assert [p["answer"] for p in dataset.by_task_group(1)] == ["2", "3"]
+    sample = dataset.sample_indices_by_subject(1, seed=3)
+    assert sample == dataset.sample_indices_by_subject(1, seed=3)
+    assert sorted(dataset.entries[i]["subject"] for i in sample) == ["biology", "chemistry", "physics"]
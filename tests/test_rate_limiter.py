@@ -0,0 +1,98 @@
+import time
+import types
+
+import pytest
+
+from RateLimiter import RateLimiter, TokenBucket, DeadlineExceeded, retry_after_seconds
+
+
+class TransientError(Exception):
+    def __init__(self, status_code=429, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = types.SimpleNamespace(headers=headers or {})
+
+
+def test_retry_after_seconds_formats():
+    assert retry_after_seconds({"retry-after-ms": "1500"}) == 1.5
+    assert retry_after_seconds({"retry-after": "3"}) == 3.0
+    assert retry_after_seconds({"retry-after": "not a date"}) is None
+    assert retry_after_seconds({}) is None
+    # an HTTP date in the past waits 0s
+    assert retry_after_seconds({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}) == 0.0
+
+
+def test_retry_after_blocks_the_model_and_sets_the_delay():
+    limiter = RateLimiter(base_delay=0.0)
+    delay = limiter._retry_delay(TransientError(headers={"retry-after": "5"}), 0, "openai", "m")
+    assert delay == pytest.approx(5.0)
+    # every caller of the same model now waits, other models do not
+    assert limiter.reserve("openai", "m", 1) == pytest.approx(5.0, abs=0.1)
+    assert limiter.reserve("openai", "other", 1) == 0.0
+
+
+def test_non_transient_errors_and_exhausted_retries_are_not_retried():
+    limiter = RateLimiter(max_retries=2, base_delay=0.0)
+    assert limiter._retry_delay(TransientError(status_code=400), 0, "openai", "m") is None
+    assert limiter._retry_delay(TransientError(), 2, "openai", "m") is None
+
+
+def test_call_retries_transient_errors():
+    limiter = RateLimiter(base_delay=0.0)
+    attempts = []
+
+    def request():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise TransientError(status_code=503)
+        return "ok"
+
+    stats = {}
+    assert limiter.call("openai", "m", 10, request, stats) == "ok"
+    assert stats["retries"] == 2
+    assert limiter.retries == 2
+
+
+def test_retry_past_the_deadline_raises_deadline_exceeded():
+    limiter = RateLimiter(base_delay=0.0)
+
+    def request():
+        raise TransientError(headers={"retry-after": "10"})
+
+    with pytest.raises(DeadlineExceeded) as info:
+        limiter.call("openai", "m", 10, request, deadline=time.monotonic() + 1)
+    assert isinstance(info.value.__cause__, TransientError)
+
+
+def test_openai_headers_sync_the_buckets():
+    limiter = RateLimiter()
+    limiter.update_from_headers("openai", "m", {
+        "x-ratelimit-limit-requests": "120", "x-ratelimit-remaining-requests": "0",
+        "x-ratelimit-reset-requests": "2s", "x-ratelimit-limit-tokens": "6000",
+        "x-ratelimit-remaining-tokens": "6000"})
+    requests, tokens = limiter.buckets[("openai", "m")]
+    assert requests.capacity == 120 and tokens.capacity == 6000
+    # no requests left: the next one waits for the reset (2s) plus its own slot (0.5s at 2/s)
+    assert limiter.reserve("openai", "m", 1) == pytest.approx(2.5, abs=0.1)
+
+
+def test_anthropic_headers_sync_the_buckets():
+    limiter = RateLimiter()
+    limiter.update_from_headers("anthropic", "m", {"anthropic-ratelimit-requests-limit": "30",
+                                                   "anthropic-ratelimit-tokens-limit": "9000",
+                                                   "anthropic-ratelimit-tokens-remaining": "100"})
+    requests, tokens = limiter.buckets[("anthropic", "m")]
+    assert requests.capacity == 30
+    assert tokens.capacity == 9000 and tokens.level <= 100
+
+
+def test_token_bucket_queues_reservations_in_order():
+    bucket = TokenBucket(capacity=2, per_minute=60)
+    now = bucket.updated
+    assert bucket.reserve(1, now) == 0.0
+    assert bucket.reserve(1, now) == 0.0
+    assert bucket.reserve(1, now) == pytest.approx(1.0)
+    assert bucket.reserve(1, now) == pytest.approx(2.0)
+    # billed usage below the estimate gives tokens back
+    bucket.credit(2, now)
+    assert bucket.reserve(1, now) == pytest.approx(1.0)
@@ -0,0 +1,65 @@
+import itertools
+
+import pytest
+
+import ResponseCache as response_cache
+from ResponseCache import ResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # strictly increasing timestamps, so LRU order does not depend on the clock resolution
+    ticks = itertools.count(1)
+    monkeypatch.setattr(response_cache.time, "time", lambda: float(next(ticks)))
+
+
+def test_unknown_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        ResponseCache(str(tmp_path / "c.sqlite"), mode="sometimes")
+
+
+def test_write_through_stores_and_serves(tmp_path):
+    cache = ResponseCache(str(tmp_path / "c.sqlite"))
+    assert cache.get("k") is None
+    cache.put("k", "openai", "m", "answer")
+    assert cache.get("k") == "answer"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_read_only_serves_but_never_stores(tmp_path):
+    path = str(tmp_path / "c.sqlite")
+    ResponseCache(path).put("old", "openai", "m", "cached")
+    cache = ResponseCache(path, mode="read_only")
+    cache.put("new", "openai", "m", "fresh")
+    assert cache.get("old") == "cached"
+    assert cache.get("new") is None
+
+
+def test_bypass_ignores_the_cache(tmp_path):
+    path = str(tmp_path / "c.sqlite")
+    ResponseCache(path).put("k", "openai", "m", "cached")
+    cache = ResponseCache(path, mode="bypass")
+    cache.put("other", "openai", "m", "fresh")
+    assert cache.get("k") is None
+    assert ResponseCache(path).get("other") is None
+
+
+def test_lru_eviction_keeps_recently_read_entries(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "c.sqlite"), max_bytes=35)
+    for key in ("a", "b", "c"):
+        cache.put(key, "openai", "m", "x" * 10)
+    # reading "a" makes "b" the least recently used
+    assert cache.get("a") is not None
+    cache.put("d", "openai", "m", "x" * 10)
+    assert cache.get("b") is None
+    assert [cache.get(key) is not None for key in ("a", "c", "d")] == [True, True, True]
+    assert cache.stats()["bytes"] <= 35
+
+
+def test_make_key_only_changes_with_optional_fields_when_set():
+    base = ResponseCache.make_key("openai", "m", [{"role": "user", "content": "q"}], "high", False, False)
+    assert base == ResponseCache.make_key("openai", "m", [{"role": "user", "content": "q"}], "high", False, False,
+                                          response_schema=None, search_corpus=None)
+    assert base != ResponseCache.make_key("openai", "m", [{"role": "user", "content": "q"}], "high", False, False,
+                                          search_corpus="fingerprint")
+    assert base != ResponseCache.make_key("openai", "m", [{"role": "user", "content": "q"}], "low", False, False)
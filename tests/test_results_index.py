@@ -0,0 +1,101 @@
+import os
+import time
+
+import pytest
+
+import ResultsIndex as results_index
+from ResultsIndex import ResultsIndex, parse_grade, parse_grading_filename
+
+
+def test_fenced_json_grade_sums_the_item_points():
+    text = ('```json\n{"items": [{"item": "units", "max_points": 2, "points": 1.5, "rationale": "ok"},'
+            ' {"item": "answer", "max_points": 3, "points": 3}], "total": 9}\n```')
+    grade = parse_grade(text)
+    assert grade["format"] == "json" and grade["verdict"] == 4.5
+    assert [item["item"] for item in grade["items"]] == ["units", "answer"]
+
+
+def test_json_total_is_used_without_items():
+    assert parse_grade('{"items": [], "total": 7}') == {"verdict": 7.0, "items": [], "format": "json"}
+
+
+def test_free_text_falls_back_to_the_verdict_line():
+    assert parse_grade("The answer is mostly right.\nVERDICT: 0.75") == {"verdict": 0.75, "items": [],
+                                                                        "format": "verdict"}
+    # broken JSON, or JSON without a grade, still reads the VERDICT line
+    assert parse_grade('{"items": [ VERDICT: 1')["verdict"] == 1.0
+    assert parse_grade('{"comment": "no grade"}\nVERDICT: 2')["format"] == "verdict"
+
+
+def test_unparseable_grades_have_no_verdict():
+    assert parse_grade("no verdict here") == {"verdict": None, "items": [], "format": None}
+    assert parse_grade('{"items": [{"points": true}]}')["verdict"] is None
+
+
+def test_grading_filename_metadata():
+    meta = parse_grading_filename("Responses/Grading from projection",
+                                  "openai_gpt-5.2_physics_12_web_local.txt_clean")
+    assert meta == {"provider": "openai", "model": "gpt-5.2", "subject": "physics", "problem_id": 12,
+                    "web_enabled": 1, "search": "local", "variant": "reprojection_clean"}
+    assert parse_grading_filename("Grading default", "notes.txt")["provider"] is None
+
+
+def write_grade(directory, filename, text):
+    path = directory / filename
+    path.write_text(text, encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def grades(tmp_path):
+    default = tmp_path / "Grading default"
+    projection = tmp_path / "Grading projection"
+    default.mkdir()
+    projection.mkdir()
+    for problem_id, (base, variant) in enumerate([(1, 2), (3, 3)]):
+        name = f"openai_gpt-5.2_physics_{problem_id}_web_disabled.txt"
+        write_grade(default, f"high_reasoning_{name}", f"VERDICT: {base}")
+        write_grade(projection, name, f"VERDICT: {variant}")
+    write_grade(projection, "mock_m_biology_7_web_local.txt",
+                '{"items": [{"item": "units", "max_points": 2, "points": 2, "rationale": "ok"}], "total": 2}')
+    write_grade(projection, "notes.txt", "no grade here")
+    index = ResultsIndex(str(tmp_path / "index.sqlite"))
+    index.ingest(str(default))
+    index.ingest(str(projection))
+    return index, default, projection
+
+
+def test_ingest_only_rereads_changed_files(grades, monkeypatch):
+    index, default, projection = grades
+    reads = []
+    monkeypatch.setattr(results_index, "parse_grade", lambda text: reads.append(text) or parse_grade(text))
+
+    assert index.ingest(str(projection)) == 0 and reads == []
+    changed = projection / "openai_gpt-5.2_physics_0_web_disabled.txt"
+    changed.write_text("VERDICT: 0", encoding="utf-8")
+    os.utime(changed, (time.time() + 10, time.time() + 10))
+    (projection / "notes.txt").unlink()
+
+    assert index.ingest(str(projection)) == 1 and reads == ["VERDICT: 0"]
+    assert [row["verdict"] for row in index.verdicts(variant="projection", subject="physics")] == [0.0, 3.0]
+    assert index.verdicts(filename="notes.txt") == []
+
+
+def test_query_helpers(grades):
+    index, default, projection = grades
+    assert index.grouped(by=("variant",)) == [
+        {"variant": "default", "n": 2, "mean": 2.0, "min": 1.0, "max": 3.0, "unparsed": 0},
+        {"variant": "projection", "n": 3, "mean": pytest.approx(7 / 3), "min": 2.0, "max": 3.0, "unparsed": 1},
+    ]
+    assert [(row["subject"], row["variant"], row["n"]) for row in index.grouped(subject="physics")] == [
+        ("physics", "default", 2), ("physics", "projection", 2)]
+
+    items = index.items(search="local")
+    assert [(item["item"], item["points"], item["format"]) for item in items] == [("units", 2.0, "json")]
+    assert sorted(index.paired("projection")) == [
+        ("openai", "gpt-5.2", "physics", 0, 0, "off", 2.0, 1.0),
+        ("openai", "gpt-5.2", "physics", 1, 0, "off", 3.0, 3.0)]
+    with pytest.raises(ValueError):
+        index.verdicts(nonsense=1)
+    with pytest.raises(ValueError):
+        index.grouped(by=("path",))
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from RubricGrader import AgreementLog, RubricGrader, RubricSplitCache, parse_item_points, split_rubric
+
+RUBRIC = """Total: 10 points
+Points: 3, Item: Energy conservation - states that kinetic energy equals the lost potential energy
+Points: 4.5, Item: Final speed
+  derives v = sqrt(2gh) with the numbers substituted
+Points: 2.5, Item: Units - gives the speed in m/s"""
+
+
+def test_split_rubric_items_add_up_to_the_total():
+    items = split_rubric(RUBRIC)
+    assert [(item["label"], item["max_points"]) for item in items] == [
+        ("Energy conservation", 3.0), ("Final speed", 4.5), ("Units", 2.5)]
+    assert sum(item["max_points"] for item in items) == 10
+    assert items[1]["text"] == "Final speed\n  derives v = sqrt(2gh) with the numbers substituted"
+    assert split_rubric("Give full marks for a correct answer") == []
+
+
+def test_split_cache_resplits_a_changed_rubric():
+    cache = RubricSplitCache()
+    assert cache.get(RUBRIC, "task-1") is cache.get(RUBRIC, "task-1")
+    assert len(cache.get(RUBRIC.split("\nPoints: 2.5")[0], "task-1")) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_parse_item_points_clamps_to_the_item():
+    assert parse_item_points('{"points": 7, "rationale": "all there"}', 4.5) == (4.5, "all there")
+    assert parse_item_points("VERDICT: 2", 3) == (2.0, None)
+    assert parse_item_points("no points given", 3) == (None, None)
+
+
+def test_grade_sums_the_item_points(workdir):
+    grade = RubricGrader(provider="mock", model_name="gpt-5.2", splits=RubricSplitCache()).grade(
+        "A ball falls from 5 m. How fast does it land?", "About 10 m/s.", RUBRIC)
+    assert [item["max_points"] for item in grade["items"]] == [3.0, 4.5, 2.5]
+    assert all(0 <= item["points"] <= item["max_points"] for item in grade["items"])
+    assert grade["total"] == sum(item["points"] for item in grade["items"])
+
+
+def test_agreement_log_keeps_the_latest_entry_per_answer(tmp_path):
+    log = AgreementLog(str(tmp_path / "Telemetry" / "agreement.jsonl"))
+    decomposed = {"items": [{"points": 3.0}, {"points": 2.0}], "total": 5.0}
+    monolithic = json.dumps({"items": [{"item": "a", "max_points": 3, "points": 2},
+                                       {"item": "b", "max_points": 4.5, "points": 2}], "total": 4})
+    log.record("run-1", "grade problem 1", "VERDICT: 9", decomposed, 4.0, 1.0)
+    log.record("run-1", "grade problem 1", monolithic, decomposed, 4.0, 1.0, 0.02, 0.01)
+    log.record("run-1", "grade problem 2", "VERDICT: 8", {"items": [], "total": 6.0}, 3.0, 2.0)
+    log.record("run-2", "grade problem 1", "no verdict", decomposed, 1.0, 1.0)
+
+    assert len(log.entries("run-1")) == 2
+    summary = log.summary(run_id="run-1")
+    assert summary["n"] == 2
+    assert summary["mean_abs_diff"] == pytest.approx(1.5)
+    assert summary["bias"] == pytest.approx(-0.5)
+    assert summary["within_tolerance"] == 0.5
+    assert summary["item_mean_abs_diff"] == pytest.approx(0.5)
+    assert summary["median_speedup"] == pytest.approx(2.75)
+    assert summary["correlation"] == pytest.approx(1.0)
+    assert log.summary(run_id="run-2") == {"n": 0}
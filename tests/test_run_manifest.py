@@ -0,0 +1,51 @@
+from RunManifest import RunManifest
+
+
+def run_stage(manifest, name, inputs_hash, output_path, text, status="done"):
+    manifest.start(name, inputs_hash, str(output_path))
+    output_path.write_text(text, encoding="utf-8")
+    manifest.finish(name, cost=0.5, status=status)
+
+
+def test_resumed_run_reuses_finished_stages(tmp_path):
+    manifest_dir = str(tmp_path / "Manifests")
+    inputs = RunManifest.hash_inputs("prompt", "gpt-5.2")
+    run_stage(RunManifest("run1", manifest_dir), "project", inputs, tmp_path / "project.txt", "projection")
+
+    resumed = RunManifest("run1", manifest_dir)
+    assert resumed.completed_output("project", inputs) == "projection"
+    assert resumed.total_cost() == 0.5
+
+
+def test_changed_inputs_or_missing_output_rerun_the_stage(tmp_path):
+    manifest_dir = str(tmp_path / "Manifests")
+    output = tmp_path / "project.txt"
+    inputs = RunManifest.hash_inputs("prompt")
+    run_stage(RunManifest("run1", manifest_dir), "project", inputs, output, "projection")
+
+    resumed = RunManifest("run1", manifest_dir)
+    assert resumed.completed_output("project", RunManifest.hash_inputs("edited prompt")) is None
+    output.unlink()
+    assert resumed.completed_output("project", inputs) is None
+
+
+def test_unfinished_failed_and_truncated_stages_rerun(tmp_path):
+    manifest_dir = str(tmp_path / "Manifests")
+    manifest = RunManifest("run1", manifest_dir)
+    inputs = RunManifest.hash_inputs("prompt")
+    manifest.start("running", inputs, str(tmp_path / "running.txt"))
+    (tmp_path / "running.txt").write_text("partial", encoding="utf-8")
+    run_stage(manifest, "truncated", inputs, tmp_path / "truncated.txt", "cut off", status="truncated")
+    manifest.start("failed", inputs, str(tmp_path / "failed.txt"))
+    manifest.fail("failed", RuntimeError("boom"))
+
+    resumed = RunManifest("run1", manifest_dir)
+    assert resumed.stage("failed")["error"] == "RuntimeError('boom')"
+    for name in ("running", "truncated", "failed"):
+        assert resumed.completed_output(name, inputs) is None
+
+
+def test_hash_inputs_is_order_sensitive_and_stable():
+    assert RunManifest.hash_inputs("a", "b") == RunManifest.hash_inputs("a", "b")
+    assert RunManifest.hash_inputs("a", "b") != RunManifest.hash_inputs("b", "a")
+    assert RunManifest.hash_inputs({"x": 1, "y": 2}) == RunManifest.hash_inputs({"y": 2, "x": 1})
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from StageGraph import StageGraph
+
+
+def stage(name, order, delay=0.0, fail=False):
+    async def func(results):
+        order.append(("start", name, sorted(results)))
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError(f"{name} broke")
+        order.append(("end", name))
+        return name.upper()
+    return func
+
+
+def test_stages_start_after_their_dependencies():
+    order = []
+    graph = StageGraph("t")
+    graph.add("project", stage("project", order, 0.02))
+    graph.add("default", stage("default", order))
+    graph.add("answer", stage("answer", order), deps=["project"])
+    graph.add("grade", stage("grade", order), deps=["answer", "default"])
+    results = asyncio.run(graph.run())
+
+    assert results == {"project": "PROJECT", "default": "DEFAULT", "answer": "ANSWER", "grade": "GRADE"}
+    position = {(event[0], event[1]): i for i, event in enumerate(order)}
+    assert position[("end", "project")] < position[("start", "answer")]
+    assert position[("end", "answer")] < position[("start", "grade")]
+    assert position[("end", "default")] < position[("start", "grade")]
+    # independent branches overlap: default finishes while project is still running
+    assert position[("end", "default")] < position[("end", "project")]
+    assert set(graph.timings) == set(results)
+
+
+def test_unknown_dependencies_and_cycles_are_rejected():
+    graph = StageGraph()
+    graph.add("a", stage("a", []))
+    with pytest.raises(ValueError):
+        graph.add("b", stage("b", []), deps=["c"])
+    # a stage cannot depend on itself or on a later stage, so no cycle can be built
+    with pytest.raises(ValueError):
+        graph.add("c", stage("c", []), deps=["c"])
+    assert list(graph.stages) == ["a"]
+
+
+def test_failure_skips_dependents_but_not_other_branches():
+    order = []
+    graph = StageGraph("t")
+    graph.add("project", stage("project", order, fail=True))
+    graph.add("answer", stage("answer", order), deps=["project"])
+    graph.add("default", stage("default", order))
+    with pytest.raises(RuntimeError) as info:
+        asyncio.run(graph.run())
+
+    assert "['project']" in str(info.value)
+    assert str(info.value.__cause__) == "project broke"
+    started = {event[1] for event in order if event[0] == "start"}
+    assert started == {"project", "default"}
+    assert ("end", "default") in order
@@ -0,0 +1,53 @@
+import json
+import os
+import time
+
+import pytest
+
+import SweepRunner
+from SweepRunner import SweepWorker
+
+OPTIONS = [("mock", "mock-model", False), ("mock", "mock-model", True)]
+
+
+@pytest.fixture
+def sweep_dir(tmp_path):
+    return SweepRunner.plan("s1", [0, 1], OPTIONS, root=str(tmp_path))
+
+
+def lock_path(sweep_dir, unit):
+    return os.path.join(sweep_dir, "locks", f"{unit}.lock")
+
+
+def test_a_live_lease_is_not_taken(sweep_dir):
+    assert SweepWorker(sweep_dir, worker_id="a")._lock("000000")
+    assert not SweepWorker(sweep_dir, worker_id="b")._lock("000000")
+
+
+def test_a_stale_lease_is_taken_over(sweep_dir):
+    assert SweepWorker(sweep_dir, worker_id="a", lease_seconds=60)._lock("000000")
+    old = time.time() - 120
+    os.utime(lock_path(sweep_dir, "000000"), (old, old))
+
+    assert SweepWorker(sweep_dir, worker_id="b", lease_seconds=60)._lock("000000")
+    with open(lock_path(sweep_dir, "000000"), encoding="utf-8") as f:
+        assert json.load(f)["worker"] == "b"
+    # the renamed stale lock is gone and never listed as a unit
+    assert os.listdir(os.path.join(sweep_dir, "locks")) == ["000000.lock"]
+
+
+def test_claim_skips_done_and_locked_units_and_other_shards(sweep_dir):
+    worker = SweepWorker(sweep_dir, worker_id="a", shard=0, shards=2)
+    with open(os.path.join(sweep_dir, "done", "000000.json"), "w") as f:
+        json.dump({}, f)
+    assert worker.claim()["unit"] == "000002"
+    # 000001 and 000003 belong to shard 1, 000002 is locked now
+    assert worker.claim() is None
+
+
+def test_plan_refuses_colliding_sweeps(sweep_dir, tmp_path):
+    with pytest.raises(ValueError, match="id_start"):
+        SweepRunner.plan("s2", [5], OPTIONS[:1], id_start=1, root=str(tmp_path))
+    SweepRunner.plan("s3", [5], OPTIONS[:1], id_start=2, root=str(tmp_path))
+    with pytest.raises(ValueError):
+        SweepRunner.plan("s4", [0], OPTIONS + OPTIONS[:1], id_start=10, root=str(tmp_path))
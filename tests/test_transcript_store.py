@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from TranscriptStore import TranscriptStore, format_transcript
+
+CHAT = [{"role": "user", "content": "Project the problem."},
+        {"role": "assistant", "content": "A projection with unicode: λ ≈ 500 nm"}]
+
+
+def test_round_trip_and_export(tmp_path):
+    store = TranscriptStore(str(tmp_path / "store"))
+    store.write("FullChats/p1.txt", CHAT)
+
+    reopened = TranscriptStore(str(tmp_path / "store"))
+    assert reopened.load("FullChats/p1.txt") == CHAT
+    output = reopened.export("FullChats/p1.txt", str(tmp_path / "out" / "p1.txt"))
+    with open(output, encoding="utf-8") as f:
+        assert f.read() == format_transcript(CHAT)
+    with pytest.raises(KeyError):
+        reopened.load("missing")
+
+
+def test_repeated_messages_are_stored_once(tmp_path):
+    store = TranscriptStore(str(tmp_path / "store"))
+    store.write("p1_turn1", CHAT)
+    size = os.path.getsize(store.pack_path)
+    longer = CHAT + [{"role": "user", "content": "Answer it."}]
+    store.write("p1_turn2", longer)
+    stats = store.stats()
+    assert stats["messages"] == 3 and stats["message_references"] == 5
+    # the second transcript only appended its new message
+    assert os.path.getsize(store.pack_path) - size < 200
+    assert store.load("p1_turn2") == longer
+
+
+def test_latest_transcript_wins_and_partial_lines_are_skipped(tmp_path):
+    store = TranscriptStore(str(tmp_path / "store"))
+    store.write("p1", CHAT)
+    store.write("p1", CHAT[:1])
+    with open(store.log_path, "a", encoding="utf-8") as f:
+        f.write('{"name": "p2", "mess')
+    assert store.load("p1") == CHAT[:1]
+    assert set(store.transcripts()) == {"p1"}
+
+
+def test_a_truncated_pack_record_is_skipped(tmp_path):
+    store = TranscriptStore(str(tmp_path / "store"))
+    store.write("p1", CHAT[:1])
+    with open(store.pack_path, "ab") as f:
+        f.write(b"TSM1" + b"\0" * 10)
+    other = TranscriptStore(str(tmp_path / "store"))
+    other.write("p2", CHAT)
+    assert TranscriptStore(str(tmp_path / "store")).load("p2") == CHAT
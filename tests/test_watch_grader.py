@@ -0,0 +1,77 @@
+import asyncio
+import os
+
+import pytest
+
+import main
+from WatchGrader import WatchGrader
+
+PROBLEM = {"problem": "What is 2 + 2?", "answer": "4"}
+
+
+@pytest.fixture
+def graded(tmp_path, monkeypatch):
+    # grading writes a grade file naming the answer it read, without any provider call
+    monkeypatch.chdir(tmp_path)
+    calls = []
+
+    async def fake_grade(prompt_func, fname, problem_d, save_prefix, structured=False):
+        calls.append(os.path.basename(fname))
+        grade_path, _ = main.file_grade_paths(fname, save_prefix)
+        with open(grade_path, "w", encoding="utf-8") as f:
+            f.write(f"grade of {os.path.basename(fname)}\nVERDICT: 1")
+
+    monkeypatch.setattr(main, "async_grade_answer_from_file", fake_grade)
+    os.makedirs("answers")
+    return calls
+
+
+def write(name, text):
+    with open(os.path.join("answers", name), "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def run_once(save_prefix="p1", **grader_args):
+    grader = WatchGrader("answers", PROBLEM, save_prefix, grading_prompt_func=lambda *a: "", poll_interval=0,
+                         state_path="state.json", **grader_args)
+    return asyncio.run(grader.run(once=True))
+
+
+def test_a_copy_of_a_graded_answer_reuses_its_grade(graded):
+    write("a.txt", "four")
+    write("b.txt", "five")
+    write("copy_of_a.txt", "four")
+    assert run_once() == {"graded": 2, "reused": 1, "failed": 0}
+    assert sorted(graded) == ["a.txt", "b.txt"]
+    copy_grade, _ = main.file_grade_paths("copy_of_a.txt", "p1")
+    with open(copy_grade, encoding="utf-8") as f:
+        assert f.read().startswith("grade of a.txt")
+
+
+def test_restarts_skip_graded_answers_and_regrade_edited_ones(graded):
+    write("a.txt", "four")
+    write("b.txt", "five")
+    run_once()
+    assert run_once()["graded"] == 0
+    write("b.txt", "5")
+    assert run_once()["graded"] == 1
+    assert graded == ["a.txt", "b.txt", "b.txt"]
+
+
+def test_a_different_grading_setup_is_not_seen(graded):
+    write("a.txt", "four")
+    run_once()
+    assert run_once(structured=True)["graded"] == 1
+
+
+def test_failed_grades_are_retried_up_to_max_attempts(graded, monkeypatch):
+    async def broken(*args, **kwargs):
+        graded.append("broken")
+        raise RuntimeError("provider down")
+
+    monkeypatch.setattr(main, "async_grade_answer_from_file", broken)
+    write("a.txt", "four")
+    grader = WatchGrader("answers", PROBLEM, "p1", grading_prompt_func=lambda *a: "", poll_interval=0,
+                         state_path="state.json", max_attempts=2)
+    assert asyncio.run(grader.run(once=True)) == {"graded": 0, "reused": 0, "failed": 2}
+    assert not os.path.exists("state.json")